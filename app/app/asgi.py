@@ -0,0 +1,26 @@
+"""
+ASGI config for app project.
+
+It exposes the ASGI callable as a module-level variable named ``application``
+so the project can be served by any ASGI server, e.g.:
+
+    uvicorn app.asgi:application
+
+Django 2.1 has no native ASGI support, so the django application is bridged
+by core.asgi.WsgiToAsgi, which runs the views and the ORM on a thread pool
+of settings.ASGI_THREADS threads.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+from core.asgi import WsgiToAsgi
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+application = WsgiToAsgi(
+    get_wsgi_application(),
+    max_workers=getattr(settings, 'ASGI_THREADS', None),
+)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -23,9 +24,12 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = 'x(4ad!9qxz$$58a_3z+#gqlli&pdu-#s*ypvxpp15ncty6w*up'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [
+    host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',')
+    if host
+]
 
 
 # Application definition
@@ -44,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
+    'core.middleware.CompressionMiddleware',
+    'core.middleware.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,20 +80,89 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'app.wsgi.application'
 
+# The ASGI entry point (app.asgi) runs django on a pool of this many threads
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 8))
+
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# core.db.backends.postgresql_pool is the stock postgresql backend handing
+# out connections from a bounded per process pool (configured by POOL).
+# CONN_MAX_AGE keeps a connection checked out across requests on top of that.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.environ.get(
+            'DB_ENGINE', 'core.db.backends.postgresql_pool'
+        ),
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'HEALTH_CHECK_INTERVAL': int(
+                os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30)
+            ),
+        },
     }
 }
 
+# Read replicas, one per host of DB_REPLICA_HOSTS (comma separated). They
+# use the same credentials as the primary. core.routers.ReplicaRouter sends
+# the reads of users and tokens to them.
+
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES['replica_%d' % index] = dict(
+        DATABASES['default'],
+        HOST=host.strip(),
+        TEST={'MIRROR': 'default'},
+    )
+
+DATABASE_REPLICAS = [
+    alias for alias in DATABASES if alias.startswith('replica_')
+]
+
+# 'round_robin' or 'least_latency'
+DATABASE_REPLICA_STRATEGY = os.environ.get(
+    'DB_REPLICA_STRATEGY', 'round_robin'
+)
+
+# seconds a client keeps reading from the primary after a write
+READ_YOUR_WRITES_WINDOW = int(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', 5))
+# entry of CACHES remembering which users wrote, for the token clients that
+# do not send the pin cookie back; must be shared by all the processes
+READ_YOUR_WRITES_CACHE = os.environ.get('DB_READ_YOUR_WRITES_CACHE', 'default')
+
+# Shards the users (and their tokens) are spread over, one per host of
+# DB_SHARD_HOSTS (comma separated) on top of the primary, with the same
+# credentials. core.routers.ShardRouter and core.sharding place them, the
+# rebalance_shards command moves the users once the shards change. Read
+# replicas only serve the primary. "manage.py serve" migrates every shard
+# except for core 0006 (bigint ids), which locks the users table and is
+# applied by hand, see its docstring.
+
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(',')), 1):
+    DATABASES['shard_%d' % index] = dict(
+        DATABASES['default'], HOST=host.strip()
+    )
+
+shards = [alias for alias in DATABASES if alias.startswith('shard_')]
+
+USER_SHARDING = {
+    # no sharding without shard hosts
+    'SHARDS': ['default'] + shards if shards else [],
+    'ID_BLOCK_SIZE': int(os.environ.get('DB_SHARD_ID_BLOCK_SIZE', 100)),
+}
+
+DATABASE_ROUTERS = ['core.routers.ShardRouter', 'core.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -107,6 +183,41 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing executor (see core.hashing)
+# EXECUTOR is one of 'thread', 'process' or 'inline'
+
+PASSWORD_HASHING = {
+    'EXECUTOR': os.environ.get('PASSWORD_HASHING_EXECUTOR', 'thread'),
+    'WORKERS': int(os.environ.get('PASSWORD_HASHING_WORKERS', 4)),
+    'MAX_QUEUE': int(os.environ.get('PASSWORD_HASHING_MAX_QUEUE', 64)),
+    'QUEUE_TIMEOUT': float(
+        os.environ.get('PASSWORD_HASHING_QUEUE_TIMEOUT', 5)
+    ),
+}
+
+
+# Tests (see core.test_runner), PARALLEL is the number of processes, 0 is
+# one per CPU and 1 runs the tests serially
+
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+TEST_RUNNER_OPTIONS = {
+    'PARALLEL': int(os.environ.get('TEST_PARALLEL', 0)),
+    'SLOWEST': int(os.environ.get('TEST_SLOWEST', 10)),
+}
+
+
+# "python manage.py serve" (see core.startup and core.server)
+# WORKERS is the number of worker processes, 0 is one per CPU
+# GRACEFUL_TIMEOUT the seconds a stopping worker finishes its requests for
+
+SERVE = {
+    'BIND': os.environ.get('SERVE_BIND', '0.0.0.0:8000'),
+    'WORKERS': int(os.environ.get('SERVE_WORKERS', 0)),
+    'GRACEFUL_TIMEOUT': int(os.environ.get('SERVE_GRACEFUL_TIMEOUT', 8)),
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.1/topics/i18n/
 
@@ -127,3 +238,134 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 AUTH_USER_MODEL = 'core.User'
+
+# ModelBackend with the permission sets cached (see user.backends)
+AUTHENTICATION_BACKENDS = ['user.backends.CachedPermissionBackend']
+
+
+# Django REST framework
+
+REST_FRAMEWORK = {
+    # the renderer picked for an Accept header is cached
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS':
+        'core.negotiation.CachedContentNegotiation',
+    # JSON through orjson when it is installed, the browsable API only
+    # when debugging
+    'DEFAULT_RENDERER_CLASSES': ['core.renderers.FastJSONRenderer'] + (
+        ['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []
+    ),
+    # a full password hashing queue is a 429 with Retry-After, not a 500
+    'EXCEPTION_HANDLER': 'core.exceptions.exception_handler',
+}
+
+# gzip (and brotli, when the brotli package is installed) compression of the
+# responses bigger than MIN_SIZE bytes
+
+RESPONSE_COMPRESSION = {
+    'MIN_SIZE': int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+}
+
+
+# Request metrics (see core.middleware.PerformanceMiddleware), scraped from
+# /metrics/ with "Authorization: Bearer <PERF_METRICS_TOKEN>" or by staff
+# users when no token is configured
+
+PERF_METRICS_TOKEN = os.environ.get('PERF_METRICS_TOKEN') or None
+
+# Sampling profiler, dumps flame graph data of requests slower than THRESHOLD
+# seconds to DIR
+
+PERF_PROFILER = {
+    'ENABLED': os.environ.get('PERF_PROFILER') == '1',
+    'SAMPLE_RATE': float(os.environ.get('PERF_PROFILER_SAMPLE_RATE', 1)),
+    'INTERVAL': float(os.environ.get('PERF_PROFILER_INTERVAL', 0.005)),
+    'THRESHOLD': float(os.environ.get('PERF_PROFILER_THRESHOLD', 0.5)),
+    'DIR': os.environ.get('PERF_PROFILER_DIR', '/tmp/profiles'),
+}
+
+
+# Token authentication cache (see user.authentication)
+# SHARED_CACHE is the name of an entry in CACHES shared by all the processes
+# Set it when serving with several processes: without it a process sees the
+# tokens and users changed by another one only after TTL seconds
+
+USER_TOKEN_CACHE = {
+    'MAX_SIZE': int(os.environ.get('TOKEN_CACHE_SIZE', 10000)),
+    'TTL': int(os.environ.get('TOKEN_CACHE_TTL', 60)),
+    'SHARED_CACHE': os.environ.get('TOKEN_CACHE_SHARED') or None,
+}
+
+# API token lifetime (see user.tokens), in seconds, empty means no limit
+# Expired tokens are deleted by "python manage.py purge_tokens"
+
+USER_TOKEN = {
+    'EXPIRES_AFTER': (
+        int(os.environ['TOKEN_EXPIRES_AFTER'])
+        if os.environ.get('TOKEN_EXPIRES_AFTER') else None
+    ),
+    'ROTATE_AFTER': (
+        int(os.environ['TOKEN_ROTATE_AFTER'])
+        if os.environ.get('TOKEN_ROTATE_AFTER') else None
+    ),
+}
+
+
+# Failed login limits per email and client IP (see user.throttling)
+# WINDOW is in seconds, a limit of 0 disables that check. Behind a proxy set
+# LOGIN_CLIENT_IP_HEADER (e.g. HTTP_X_FORWARDED_FOR), or every client shares
+# the address of the proxy
+
+LOGIN_FAILURE_LIMIT = {
+    'MAX_PER_EMAIL_AND_IP': int(
+        os.environ.get('LOGIN_MAX_FAILURES_PER_EMAIL_AND_IP', 5)
+    ),
+    'MAX_PER_EMAIL': int(os.environ.get('LOGIN_MAX_FAILURES_PER_EMAIL', 20)),
+    'MAX_PER_IP': int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 50)),
+    'WINDOW': int(os.environ.get('LOGIN_FAILURE_WINDOW', 300)),
+    'SHARED_CACHE': os.environ.get('LOGIN_FAILURE_SHARED_CACHE') or None,
+    'CLIENT_IP_HEADER': os.environ.get('LOGIN_CLIENT_IP_HEADER') or None,
+    'TRUSTED_PROXIES': int(os.environ.get('LOGIN_TRUSTED_PROXIES', 1)),
+}
+
+
+# Staff user list/export (api/user/)
+# EXPORT_CHUNK_SIZE is the number of rows read per round trip by ?export=
+
+USER_LIST = {
+    'PAGE_SIZE': int(os.environ.get('USER_LIST_PAGE_SIZE', 100)),
+    'MAX_PAGE_SIZE': 1000,
+    'EXPORT_CHUNK_SIZE': int(os.environ.get('USER_EXPORT_CHUNK_SIZE', 2000)),
+}
+
+
+# Bulk user creation (api/user/bulk-create/)
+# HASH_WORKERS is the size of the password hashing process pool, empty means
+# one process per CPU and 0 hashes inline
+
+USER_BULK_CREATE = {
+    'BATCH_SIZE': int(os.environ.get('BULK_CREATE_BATCH_SIZE', 500)),
+    'MAX_BATCH_SIZE': 5000,
+    'HASH_WORKERS': (
+        int(os.environ['BULK_CREATE_HASH_WORKERS'])
+        if os.environ.get('BULK_CREATE_HASH_WORKERS') else None
+    ),
+}
+
+
+# Post-commit task queue (see core.tasks), run the workers with
+# "python manage.py run_tasks"
+# BROKER is 'sqlite' (durable, in the file at PATH) or 'memory' (lost with
+# the process, use WORKER_THREAD to run the tasks in the same process).
+# PATH must be writable by the app and shared with the workers: the image
+# runs as a user that can not write to /app, docker-compose.yml puts it on
+# the tasks volume
+
+TASKS = {
+    'BROKER': os.environ.get('TASKS_BROKER', 'sqlite'),
+    'PATH': os.environ.get(
+        'TASKS_DB', os.path.join(tempfile.gettempdir(), 'tasks.sqlite3')
+    ),
+    'WORKER_THREAD': os.environ.get('TASKS_WORKER_THREAD') == '1',
+    'BATCH_SIZE': int(os.environ.get('TASKS_BATCH_SIZE', 100)),
+    'MAX_RETRIES': int(os.environ.get('TASKS_MAX_RETRIES', 5)),
+}
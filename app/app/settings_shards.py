@@ -0,0 +1,30 @@
+"""Settings spreading the users over three local SQLite databases
+
+Exercises the sharding without any server:
+
+    python manage.py migrate --settings=app.settings_shards
+    python manage.py migrate --settings=app.settings_shards --database=shard_1
+    python manage.py migrate --settings=app.settings_shards --database=shard_2
+    python manage.py rebalance_shards --settings=app.settings_shards
+    python manage.py test core.tests.test_sharding \\
+        --settings=app.settings_shards
+"""
+from app.settings import *  # noqa: F401,F403
+from app.settings import BASE_DIR, os
+
+
+DATABASES = {
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, '%s.sqlite3' % alias),
+    }
+    for alias in ('default', 'shard_1', 'shard_2')
+}
+
+DATABASE_REPLICAS = []
+
+USER_SHARDING = {
+    'SHARDS': list(DATABASES),
+    # small blocks, the tests see several reservations
+    'ID_BLOCK_SIZE': 10,
+}
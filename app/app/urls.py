@@ -16,6 +16,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from core import views as core_views
+
 urlpatterns = [
     path('polls/', include('polls.urls')),
     path('admin/', admin.site.urls),
@@ -23,4 +25,6 @@ urlpatterns = [
     # user.urls if the url is 'api/user/create' the 'create' will be matched
     # in user.urls and passed to the view
     path('api/user/', include('user.urls')),
+    # prometheus style scrape endpoint of core.metrics
+    path('metrics/', core_views.metrics, name='metrics'),
 ]
@@ -1,12 +1,188 @@
+import json
+
 from django.contrib import admin
-from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION, LogEntry
+from django.contrib.admin.options import get_content_type_for_model
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.contrib.auth.admin import GroupAdmin as BaseGroupAdmin, \
+                                      UserAdmin as BaseUserAdmin
+from django.contrib.auth.models import Group
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
+from rest_framework.authtoken.admin import TokenAdmin as BaseTokenAdmin
+from rest_framework.authtoken.models import Token
 from core import models
+from core.sharding import get_shards, is_sharded, shard_for_user_id
+
+
+# the query string parameter of the keyset pagination
+AFTER_VAR = 'after'
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that avoids COUNT(*) over the whole table
+
+    On postgres the size of an unfiltered, big table comes from the planner
+    statistics. Filtered lists are counted up to `count_limit` rows only.
+    """
+    # below this many rows the statistics are not trusted, just count
+    estimate_threshold = 10000
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where:
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples::bigint FROM pg_class '
+                        'WHERE oid = %s::regclass',
+                        [queryset.model._meta.db_table],
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= self.estimate_threshold:
+                    return row[0]
+            return queryset.count()
+        # COUNT over a LIMIT subquery, it stops after count_limit rows
+        return queryset[:self.count_limit].count()
+
+
+class KeysetChangeList(ChangeList):
+    """Change list paginated with ?after=<id> instead of OFFSET
+
+    Only used with the default ordering by id, sorting by a column falls
+    back to the regular page numbers.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = None
+        if ORDER_VAR not in request.GET:
+            try:
+                self.after = int(request.GET[AFTER_VAR])
+            except (KeyError, ValueError):
+                pass
+        self.next_after = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.after is not None:
+            queryset = queryset.filter(pk__gt=self.after)
+        # only load the columns the list displays
+        fields = {'pk'} | {
+            name for name in self.list_display
+            if name in {field.name for field in self.opts.concrete_fields}
+        }
+        return queryset.only(*fields)
+
+    def get_results(self, request):
+        if self.after is None:
+            super().get_results(request)
+        else:
+            # no count and no page numbers, just the next rows
+            self.paginator = self.model_admin.get_paginator(
+                request, self.queryset, self.list_per_page
+            )
+            self.result_list = list(self.queryset[:self.list_per_page])
+            self.result_count = len(self.result_list)
+            self.full_result_count = None
+            self.show_full_result_count = False
+            self.show_admin_actions = True
+            self.can_show_all = False
+            self.multi_page = False
+
+        if ORDER_VAR not in self.params:
+            rows = list(self.result_list)
+            if len(rows) == self.list_per_page:
+                self.next_after = rows[-1].pk
+
+    def get_next_url(self):
+        """URL of the page following this one in keyset mode"""
+        return self.get_query_string(
+            {AFTER_VAR: self.next_after}, remove=[PAGE_VAR]
+        )
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Pick the shard the change list reads, the first one by default
+
+    The keyset pagination and the counts work on one database, so the
+    shards are listed one at a time rather than merged.
+    """
+    title = _('database')
+    parameter_name = 'shard'
 
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in get_shards()]
 
-class UserAdmin(BaseUserAdmin):
+    def value(self):
+        return super().value() or get_shards()[0]
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string(
+                    {self.parameter_name: lookup}, [AFTER_VAR, PAGE_VAR]
+                ),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.value())
+
+
+class ShardedLogMixin:
+    """Write the admin log on the shard of the staff user
+
+    A LogEntry references the user who made the change, so it has to be
+    stored on their shard; LogEntry.objects.log_action has no router hint
+    and always writes to the default database.
+    """
+
+    def log_action(self, request, object, action_flag, message,
+                   object_repr=None):
+        if isinstance(message, list):
+            message = json.dumps(message)
+        return LogEntry.objects.using(
+            shard_for_user_id(request.user.pk)
+        ).create(
+            user_id=request.user.pk,
+            content_type_id=get_content_type_for_model(object).pk,
+            object_id=str(object.pk),
+            object_repr=(object_repr or str(object))[:200],
+            action_flag=action_flag,
+            change_message=message,
+        )
+
+    def log_addition(self, request, object, message):
+        return self.log_action(request, object, ADDITION, message)
+
+    def log_change(self, request, object, message):
+        return self.log_action(request, object, CHANGE, message)
+
+    def log_deletion(self, request, object, object_repr):
+        return self.log_action(request, object, DELETION, '', object_repr)
+
+
+class UserAdmin(ShardedLogMixin, BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    # '^' makes them prefix searches (istartswith), which can use the
+    # UPPER(...) text_pattern_ops indexes instead of scanning the table
+    search_fields = ('^email', '^name')
+    paginator = EstimatedCountPaginator
+    # the unfiltered total would be another COUNT(*) on every page
+    show_full_result_count = False
     # Each of the brackets is a section
     # first argument is the title
     # Note the ('name',) the comma is so python doesn't think
@@ -28,5 +204,40 @@ class UserAdmin(BaseUserAdmin):
                 }),
     )
 
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if is_sharded():
+            return (ShardListFilter,) + tuple(list_filter)
+        return list_filter
+
+    def get_object(self, request, object_id, from_field=None):
+        # the change, password and delete pages open the user on its shard
+        try:
+            shard = shard_for_user_id(int(object_id))
+        except ValueError:
+            shard = None
+        user = None
+        if shard is not None and from_field is None:
+            user = self.get_queryset(request).using(shard).filter(
+                pk=int(object_id)
+            ).first()
+        # users not rebalanced yet are still where they were created
+        return user or super().get_object(request, object_id, from_field)
+
+
+class GroupAdmin(ShardedLogMixin, BaseGroupAdmin):
+    pass
+
+
+class TokenAdmin(ShardedLogMixin, BaseTokenAdmin):
+    pass
+
 
 admin.site.register(models.User, UserAdmin)
+admin.site.unregister(Group)
+admin.site.register(Group, GroupAdmin)
+admin.site.unregister(Token)
+admin.site.register(Token, TokenAdmin)
@@ -1,5 +1,24 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from django.utils.module_loading import autodiscover_modules
+        from core import hashing, routers, tasks
+        from core.metrics import LazyCollector, registry
+
+        # the tasks.py of every app registers its @task functions
+        autodiscover_modules('tasks')
+
+        connection_created.connect(routers.track_replica_latency)
+        connection_created.connect(routers.track_primary_writes)
+        registry.register_collector(hashing.collect_metrics)
+        registry.register_collector(routers.collect_metrics)
+        # only once the pooled backend is in use
+        registry.register_collector(
+            LazyCollector('core.db.backends.postgresql_pool.base')
+        )
+        registry.register_collector(tasks.collect_metrics)
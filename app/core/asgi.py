@@ -0,0 +1,212 @@
+import asyncio
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# request bodies bigger than this are spooled to disk while they are read
+MAX_IN_MEMORY_BODY = 1024 * 1024
+# response bytes a pool thread may get ahead of the client before it waits,
+# only long streams (exports) ever reach it
+MAX_BUFFERED_RESPONSE = 1024 * 1024
+
+
+class ResponseAborted(Exception):
+    """The client went away, the response iteration can stop"""
+
+
+class SendWindow:
+    """Bound the response bytes produced but not yet sent to the client
+
+    The pool thread acquires the size of each chunk before queueing it and
+    the event loop releases it once sent, so the thread only waits when a
+    client is more than `size` bytes behind.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pending = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, length):
+        with self._condition:
+            # a chunk bigger than the window still goes through alone
+            while self.pending and self.pending + length > self.size and \
+                    not self.closed:
+                self._condition.wait()
+            if self.closed:
+                raise ResponseAborted()
+            self.pending += length
+
+    def release(self, length):
+        with self._condition:
+            self.pending -= length
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class WsgiToAsgi:
+    """Serve a WSGI application (i.e. django) to an ASGI server
+
+    The event loop only deals with the network: it reads the request body,
+    and sends the response chunks. The django request itself, including
+    every ORM query, runs on a bounded thread pool. The thread hands the
+    response over to the event loop without waiting for the client, so a
+    slow client only costs a coroutine instead of a whole worker.
+    """
+
+    def __init__(self, wsgi_application, max_workers=None):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='asgi'
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type %r' % scope['type'])
+
+        body = await self.read_body(receive)
+        environ = self.build_environ(scope, body)
+        loop = asyncio.get_event_loop()
+        messages = asyncio.Queue()
+        window = SendWindow(MAX_BUFFERED_RESPONSE)
+
+        def put(message):
+            # runs on the pool thread
+            window.acquire(len(message.get('body', b'')))
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+
+        done = loop.run_in_executor(
+            self.executor, self.run_wsgi, environ, put,
+            lambda: loop.call_soon_threadsafe(messages.put_nowait, None),
+        )
+        try:
+            while True:
+                message = await messages.get()
+                if message is None:
+                    break
+                await send(message)
+                window.release(len(message.get('body', b'')))
+            await done
+        finally:
+            # stops the pool thread if sending failed
+            window.close()
+            body.close()
+
+    async def lifespan(self, receive, send):
+        """Acknowledge the server startup and shutdown events"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        """Read the whole request body without blocking a thread"""
+        body = tempfile.SpooledTemporaryFile(max_size=MAX_IN_MEMORY_BODY)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        return body
+
+    def build_environ(self, scope, body):
+        """Translate an ASGI http scope to a WSGI environ"""
+        # WSGI wants the path as "bytes in a str", i.e. latin-1 decoded
+        path = scope['path'].encode('utf-8').decode('latin-1')
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': path,
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+            environ['REMOTE_PORT'] = str(scope['client'][1])
+
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                key = name
+            else:
+                key = 'HTTP_' + name
+            if key in environ:
+                # repeated headers are folded into one, as HTTP allows
+                value = environ[key] + ',' + value
+            environ[key] = value
+        return environ
+
+    def run_wsgi(self, environ, put, finished):
+        """Call the WSGI application, runs on a pool thread
+
+        put queues a message for the event loop, finished tells it the
+        response is complete (or failed).
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        try:
+            result = self.wsgi_application(environ, start_response)
+            started = False
+            try:
+                for chunk in result:
+                    if not started:
+                        put(self.start_message(response))
+                        started = True
+                    if chunk:
+                        put({
+                            'type': 'http.response.body',
+                            'body': chunk,
+                            'more_body': True,
+                        })
+                if not started:
+                    put(self.start_message(response))
+                put({'type': 'http.response.body', 'body': b''})
+            except ResponseAborted:
+                pass
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            finished()
+
+    def start_message(self, response):
+        return {
+            'type': 'http.response.start',
+            'status': response['status'],
+            'headers': response['headers'],
+        }
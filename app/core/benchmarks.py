@@ -0,0 +1,270 @@
+import itertools
+import time
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.hashing import get_hashing_executor
+from core.loadtest import percentile
+from core.metrics import RequestStats
+from core.middleware import brotli
+from core.renderers import FastJSONRenderer
+from core.sharding import shard_for_user_id
+from user.serializers import UserListSerializer
+
+
+BENCHMARK_PASSWORD = 'benchpass'
+
+# name -> setup function, see @benchmark below
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark
+
+    The decorated function does the (untimed) setup and returns the
+    operation to time, a callable without arguments.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+_counter = itertools.count()
+
+
+def create_user(**extra_fields):
+    """Create a user with a unique email for the benchmarks"""
+    return get_user_model().objects.create_user(
+        email='bench-%d-%f@example.com' % (next(_counter), time.time()),
+        password=BENCHMARK_PASSWORD,
+        name='Bench User',
+        **extra_fields
+    )
+
+
+def token_client(user):
+    """APIClient authenticated the way the mobile clients are"""
+    # get_or_create() has no hint of the user, sharded it has to be told
+    # where
+    token, _ = Token.objects.using(
+        shard_for_user_id(user.pk)
+    ).get_or_create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+    return client
+
+
+def expect(response, status_code):
+    if response.status_code != status_code:
+        raise AssertionError('%s returned %s instead of %s' % (
+            response.request['PATH_INFO'], response.status_code, status_code,
+        ))
+
+
+@benchmark('password_hashing')
+def password_hashing():
+    executor = get_hashing_executor()
+    return lambda: executor.make_password(BENCHMARK_PASSWORD)
+
+
+@benchmark('user_create')
+def user_create():
+    client = APIClient()
+    url = reverse('user:create')
+
+    def operation():
+        expect(client.post(url, {
+            'email': 'bench-new-%d-%f@example.com' % (
+                next(_counter), time.time()
+            ),
+            'password': BENCHMARK_PASSWORD,
+            'name': 'Bench User',
+        }), 201)
+    return operation
+
+
+@benchmark('token_issue')
+def token_issue():
+    user = create_user()
+    client = APIClient()
+    url = reverse('user:token')
+    payload = {'email': user.email, 'password': BENCHMARK_PASSWORD}
+    return lambda: expect(client.post(url, payload), 200)
+
+
+@benchmark('me_retrieve')
+def me_retrieve():
+    client = token_client(create_user())
+    url = reverse('user:me')
+    return lambda: expect(client.get(url), 200)
+
+
+@benchmark('me_patch')
+def me_patch():
+    client = token_client(create_user())
+    url = reverse('user:me')
+    names = itertools.cycle(['Bench One', 'Bench Two'])
+    return lambda: expect(client.patch(url, {'name': next(names)}), 200)
+
+
+@benchmark('admin_user_list')
+def admin_user_list(users=200):
+    rows = (
+        {'email': 'bench-list-%d-%d@example.com' % (next(_counter), index),
+         'name': 'Listed %d' % index}
+        for index in range(users)
+    )
+    # bulk_create_users is a generator, the users are created as it is
+    # consumed
+    for _ in get_user_model().objects.bulk_create_users(rows):
+        pass
+    client = Client()
+    client.force_login(create_user(is_staff=True, is_superuser=True))
+    url = reverse('admin:core_user_changelist')
+    return lambda: expect(client.get(url), 200)
+
+
+@benchmark('user_serializer')
+def user_serializer():
+    user = create_user()
+    return lambda: UserListSerializer(user).data
+
+
+@benchmark('user_serializer_drf')
+def user_serializer_drf():
+    """The same as user_serializer without the compiled read path"""
+    class DRFUserListSerializer(UserListSerializer):
+        compiled_read = False
+
+    user = create_user()
+    return lambda: DRFUserListSerializer(user).data
+
+
+def measure(operation, iterations, warmup=0):
+    """Time operation and count its queries, return the summary"""
+    for _ in range(warmup):
+        operation()
+
+    stats = RequestStats()
+    latencies = []
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats.db_wrapper))
+        start = time.perf_counter()
+        for _ in range(iterations):
+            op_start = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - op_start)
+        duration = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / duration if duration else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'queries_per_op': stats.db_queries / iterations if iterations else 0,
+    }
+
+
+def run_benchmarks(names=None, iterations=100, warmup=10):
+    """Run the named benchmarks (all of them by default)"""
+    results = {}
+    for name in names or sorted(BENCHMARKS):
+        operation = BENCHMARKS[name]()
+        results[name] = measure(operation, iterations, warmup)
+    return results
+
+
+def wire_endpoints(users=100):
+    """Return {name: callable(client, **headers) -> response} to measure"""
+    rows = (
+        {'email': 'bench-wire-%d-%d@example.com' % (next(_counter), index),
+         'name': 'Wire %d' % index}
+        for index in range(users)
+    )
+    for _ in get_user_model().objects.bulk_create_users(rows):
+        pass
+    staff = create_user(is_staff=True)
+    client = token_client(staff)
+    me_url = reverse('user:me')
+    list_url = reverse('user:list')
+    token_url = reverse('user:token')
+    credentials = {'email': staff.email, 'password': BENCHMARK_PASSWORD}
+    return {
+        'me': lambda **headers: client.get(me_url, **headers),
+        'list': lambda **headers: client.get(
+            list_url, {'page_size': users}, **headers
+        ),
+        'token': lambda **headers: APIClient().post(
+            token_url, credentials, **headers
+        ),
+    }
+
+
+def measure_wire(iterations=100):
+    """Bytes on the wire and JSON render time of the user endpoints
+
+    The sizes are the bodies sent for each Accept-Encoding, the render
+    times compare FastJSONRenderer with DRF's JSONRenderer on the data of
+    the endpoint.
+    """
+    encodings = ['identity', 'gzip'] + (['br'] if brotli else [])
+    renderers = {'fast': FastJSONRenderer(), 'drf': JSONRenderer()}
+    results = {}
+    for name, request in wire_endpoints().items():
+        result = {}
+        for encoding in encodings:
+            response = request(HTTP_ACCEPT_ENCODING=encoding)
+            expect(response, 200)
+            result[encoding + '_bytes'] = len(response.content)
+        for label, renderer in renderers.items():
+            start = time.perf_counter()
+            for _ in range(iterations):
+                renderer.render(response.data)
+            result[label + '_render_us'] = (
+                (time.perf_counter() - start) / iterations * 1e6
+            )
+        results[name] = result
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """Compare results with a baseline, return the regressions found
+
+    A benchmark regresses when its throughput dropped by more than
+    `threshold` (0.2 is 20%) or when it makes more queries per operation.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        floor = previous['ops_per_sec'] * (1 - threshold)
+        if result['ops_per_sec'] < floor:
+            regressions.append(
+                '%s: %.1f ops/sec, baseline %.1f (-%.0f%%)' % (
+                    name, result['ops_per_sec'], previous['ops_per_sec'],
+                    100 * (1 - result['ops_per_sec'] /
+                           previous['ops_per_sec']),
+                )
+            )
+        # allow for rounding of the per operation average
+        if result['queries_per_op'] > previous['queries_per_op'] + 0.01:
+            regressions.append(
+                '%s: %.2f queries/op, baseline %.2f' % (
+                    name, result['queries_per_op'],
+                    previous['queries_per_op'],
+                )
+            )
+    return regressions
@@ -0,0 +1,160 @@
+import os
+import threading
+
+from django.db.backends.postgresql import base as postgresql
+from psycopg2 import extensions
+
+from core.db.pool import ConnectionPool, PoolTimeout
+
+
+Database = postgresql.Database
+
+DEFAULT_POOL = {
+    'MAX_SIZE': 10,
+    # seconds before a connection is closed and replaced by a fresh one
+    'MAX_LIFETIME': 1800,
+    # seconds a request waits for a free connection
+    'TIMEOUT': 30,
+    # connections idle for longer than this are pinged before being reused
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pools():
+    """Return the (alias, pool) pairs of the current process"""
+    pid = os.getpid()
+    with _pools_lock:
+        return [
+            (alias, pool) for (pool_pid, alias, _), pool in _pools.items()
+            if pool_pid == pid
+        ]
+
+
+def _check_connection(connection):
+    """Health check of an idle psycopg2 connection"""
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not connection.autocommit:
+            # do not leave a transaction open on an idle connection
+            connection.rollback()
+        return True
+    except Database.Error:
+        return False
+
+
+def _reset_connection(connection):
+    """Clear what the previous request left on a pooled connection
+
+    DISCARD ALL drops the temporary tables, prepared statements, SET
+    parameters, advisory locks... of the session; django sets what it
+    needs again when it sets the connection up.
+    """
+    if connection.closed:
+        return False
+    try:
+        status = connection.get_transaction_status()
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        # DISCARD can not run inside a transaction block
+        autocommit = connection.autocommit
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('DISCARD ALL')
+        finally:
+            connection.autocommit = autocommit
+        return True
+    except Database.Error:
+        return False
+
+
+class DatabaseWrapper(postgresql.DatabaseWrapper):
+    """PostgreSQL backend handing out connections from a bounded pool
+
+    Closing a connection (which django does at the end of every request
+    unless CONN_MAX_AGE keeps it) gives it back to the pool instead of
+    closing the socket, so requests skip the connection setup cost.
+    The pool is configured with the POOL entry of the database settings.
+    """
+
+    _pool = None
+
+    def get_pool(self, conn_params):
+        # pools are per process, a forked worker must not reuse the
+        # sockets of its parent. The connection parameters are part of the
+        # key because the test runner connects to the 'postgres' database
+        # under the same alias.
+        key = (os.getpid(), self.alias, repr(sorted(conn_params.items())))
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                conf = dict(DEFAULT_POOL)
+                conf.update(self.settings_dict.get('POOL') or {})
+                pool = ConnectionPool(
+                    connect=lambda: Database.connect(**conn_params),
+                    close=lambda connection: connection.close(),
+                    check=_check_connection,
+                    reset=_reset_connection,
+                    max_size=conf['MAX_SIZE'],
+                    max_lifetime=conf['MAX_LIFETIME'],
+                    timeout=conf['TIMEOUT'],
+                    health_check_interval=conf['HEALTH_CHECK_INTERVAL'],
+                )
+                _pools[key] = pool
+            return pool
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        try:
+            connection = pool.acquire()
+        except PoolTimeout as exc:
+            # raised as a driver error so django wraps it in OperationalError
+            raise Database.OperationalError(str(exc))
+
+        # same isolation level handling as the stock backend
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+
+        # remember where the connection comes from to give it back there
+        self._pool = pool
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        pool = self._pool
+        if pool is None:
+            return super()._close()
+
+        connection = self.connection
+        discard = bool(connection.closed)
+        if not discard:
+            try:
+                # never hand out a connection in the middle of a transaction
+                status = connection.get_transaction_status()
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Database.Error:
+                discard = True
+        pool.release(connection, discard=discard)
+
+
+def collect_metrics():
+    """Gauges of the connection pools, see core.metrics"""
+    return [
+        ('db_pool_' + key, {'alias': alias}, value)
+        for alias, pool in get_pools()
+        for key, value in pool.stats().items()
+    ]
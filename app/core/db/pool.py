@@ -0,0 +1,173 @@
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available in time"""
+
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections
+
+    Idle connections are handed out most recently used first. Connections
+    older than max_lifetime are recycled, and the ones that have been idle
+    for more than health_check_interval seconds are checked with `check`
+    before being handed out again. `reset` clears the session state the
+    previous user left on a connection that is reused. Both run outside
+    of the lock and drop the connection when they return False.
+    """
+
+    def __init__(self, connect, close, check=None, reset=None, max_size=10,
+                 max_lifetime=1800, timeout=30, health_check_interval=30,
+                 clock=time.monotonic):
+        self._connect = connect
+        self._close = close
+        self._check = check
+        self._reset = reset
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._clock = clock
+        self._cond = threading.Condition()
+        # (connection, created_at, released_at), the most recent is last
+        self._idle = []
+        # id(connection) -> created_at of the connections handed out
+        self._in_use = {}
+        self.size = 0
+        self.created = 0
+        self.recycled = 0
+        self.failed_checks = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self):
+        """Return a connection, waiting up to `timeout` for a free one"""
+        start = self._clock()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                while True:
+                    idle = self._pop_idle()
+                    if idle is not None:
+                        break
+                    if self.size < self.max_size:
+                        # reserve the slot now, connect outside of the lock
+                        self.size += 1
+                        break
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            'No database connection available after %ss'
+                            % self.timeout
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if idle is None:
+                connection, created_at = self._open(), None
+                break
+            # the slot stays reserved while the connection is checked
+            connection, created_at, released_at = idle
+            if self._usable(connection, released_at):
+                break
+            with self._cond:
+                self.failed_checks += 1
+                self.size -= 1
+                self._cond.notify()
+            self._close_quietly(connection)
+
+        with self._cond:
+            if created_at is None:
+                created_at = self._clock()
+                self.created += 1
+            self._in_use[id(connection)] = created_at
+            elapsed = self._clock() - start
+            if waited:
+                self.waits += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+        return connection
+
+    def _open(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+            raise
+
+    def _pop_idle(self):
+        """Return the most recent idle entry or None, lock must be held"""
+        now = self._clock()
+        while self._idle:
+            connection, created_at, released_at = self._idle.pop()
+            if now - created_at >= self.max_lifetime:
+                self.recycled += 1
+                self._discard(connection)
+                continue
+            return connection, created_at, released_at
+        return None
+
+    def _usable(self, connection, released_at):
+        """Check and reset an idle connection, without the lock"""
+        if (self._check is not None and
+                self._clock() - released_at >= self.health_check_interval
+                and not self._check(connection)):
+            return False
+        return self._reset is None or self._reset(connection)
+
+    def _discard(self, connection):
+        self.size -= 1
+        self._close_quietly(connection)
+
+    def _close_quietly(self, connection):
+        try:
+            self._close(connection)
+        except Exception:
+            # it is most likely broken already, nothing else to do
+            pass
+
+    def release(self, connection, discard=False):
+        """Give a connection back, discard it if it is not reusable"""
+        with self._cond:
+            created_at = self._in_use.pop(id(connection), None)
+            if created_at is None:
+                # not one of ours (e.g. handed out before a fork)
+                return
+            now = self._clock()
+            if discard or now - created_at >= self.max_lifetime:
+                if not discard:
+                    self.recycled += 1
+                self._discard(connection)
+            else:
+                self._idle.append((connection, created_at, now))
+            self._cond.notify()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def stats(self):
+        """Return the size and wait time metrics of the pool"""
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'created': self.created,
+                'recycled': self.recycled,
+                'failed_checks': self.failed_checks,
+                'timeouts': self.timeouts,
+                'waits': self.waits,
+                'wait_seconds_total': self.wait_time,
+                'wait_seconds_max': self.max_wait_time,
+            }
@@ -0,0 +1,23 @@
+import math
+
+from django.utils.translation import gettext as _
+from rest_framework import exceptions
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from core.hashing import HashingBusy, get_hashing_executor
+
+
+def exception_handler(exc, context):
+    """DRF exception handler also answering for the hashing pool
+
+    Any view hashing a password (login, signup, password change) can hit
+    a full hashing queue, the client is told to back off for as long as
+    a caller waits for a slot instead of getting a 500.
+    """
+    if isinstance(exc, HashingBusy):
+        exc = exceptions.Throttled(
+            wait=math.ceil(get_hashing_executor().queue_timeout) or 1,
+            detail=_('Too many requests are waiting for the password '
+                     'hashing, try again later.'),
+        )
+    return drf_exception_handler(exc, context)
@@ -0,0 +1,279 @@
+import os
+import threading
+import time
+# the executors are loaded by the first access to futures.XPoolExecutor,
+# the process one imports multiprocessing
+from concurrent import futures
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.hashers import make_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+DEFAULT_PASSWORD_HASHING = {
+    # 'thread', 'process' or 'inline' (hash on the request thread)
+    'EXECUTOR': 'thread',
+    'WORKERS': 4,
+    # hashes allowed to wait for a free worker before callers get rejected
+    'MAX_QUEUE': 64,
+    # seconds a caller waits for a queue slot before HashingBusy is raised
+    'QUEUE_TIMEOUT': 5,
+}
+
+
+def _init_worker():
+    """Make sure django is configured in spawned (non forked) workers"""
+    if not apps.ready:
+        django.setup()
+
+
+# (pid, workers) -> ProcessPoolExecutor, see get_process_pool
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def get_process_pool(workers):
+    """Return the process pool of this process with that many workers
+
+    Created on first use and kept, like the executor of
+    get_hashing_executor: starting the processes costs more than hashing
+    a small batch. The pid is part of the key so a forked server worker
+    starts its own.
+    """
+    key = (os.getpid(), workers)
+    with _process_pools_lock:
+        executor = _process_pools.get(key)
+        if executor is None:
+            executor = _process_pools[key] = futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+            )
+        return executor
+
+
+def _drop_process_pool(executor):
+    with _process_pools_lock:
+        for key, pool in list(_process_pools.items()):
+            if pool is executor:
+                del _process_pools[key]
+    executor.shutdown()
+
+
+class PasswordHasherPool:
+    """Hashes batches of raw passwords across a pool of processes
+
+    PBKDF2 is CPU bound, so spreading a batch over several processes scales
+    with the number of cores. With workers=0 everything is hashed inline.
+    The processes are shared by every PasswordHasherPool of the process
+    (see get_process_pool) and outlive the with block.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._executor = None
+
+    def __enter__(self):
+        import multiprocessing
+        # daemonic processes (multiprocessing pool workers, like those of
+        # the parallel test runner) can not have children, they hash inline
+        if self.workers != 0 and not multiprocessing.current_process().daemon:
+            self._executor = get_process_pool(self.workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor = None
+
+    def __call__(self, passwords):
+        """Return the encoded version of each password, in order"""
+        passwords = list(passwords)
+        if self._executor is None or len(passwords) < 2:
+            return [make_password(password) for password in passwords]
+
+        workers = self._executor._max_workers
+        chunksize = max(1, len(passwords) // (workers * 4))
+        try:
+            return list(self._executor.map(
+                make_password, passwords, chunksize=chunksize
+            ))
+        except futures.BrokenExecutor:
+            # a worker died (OOM killer...), the next batch gets a new pool
+            _drop_process_pool(self._executor)
+            self._executor = None
+            return [make_password(password) for password in passwords]
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full for longer than the timeout"""
+
+
+def _timed(func, *args):
+    """Run func in the worker and also return how long it took"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class HashingExecutor:
+    """Runs password hashing on a bounded pool of threads or processes
+
+    At most workers + max_queue hashes are accepted at a time, the callers
+    above that wait up to queue_timeout seconds for a slot and then get a
+    HashingBusy error. This way a login storm queues up on the pool instead
+    of piling up CPU bound work on every request thread.
+    """
+
+    def __init__(self, kind='thread', workers=4, max_queue=64,
+                 queue_timeout=5):
+        if kind not in ('thread', 'process', 'inline'):
+            raise ValueError('Unknown hashing executor %r' % kind)
+        self.kind = kind
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_time = 0.0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def _get_executor(self):
+        # created lazily so pre-forked workers each get their own pool
+        with self._lock:
+            if self._executor is None:
+                if self.kind == 'process':
+                    self._executor = futures.ProcessPoolExecutor(
+                        max_workers=self.workers, initializer=_init_worker
+                    )
+                else:
+                    self._executor = futures.ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='hashing',
+                    )
+            return self._executor
+
+    def submit(self, func, *args):
+        """Run func(*args) on the pool and wait for its result"""
+        if self.kind == 'inline':
+            start = time.perf_counter()
+            result, elapsed = _timed(func, *args)
+            self._record(elapsed, time.perf_counter() - start)
+            return result
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy('Password hashing queue is full')
+
+        start = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(_timed, func, *args)
+            result, elapsed = future.result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+        self._record(elapsed, time.perf_counter() - start)
+        return result
+
+    def _record(self, hash_time, total_time):
+        with self._lock:
+            self.completed += 1
+            self.hash_time += hash_time
+            self.total_time += total_time
+            self.max_time = max(self.max_time, total_time)
+
+    def make_password(self, password, salt=None, hasher='default'):
+        """Pool backed version of django's make_password"""
+        if password is None:
+            # unusable password, there is nothing to hash
+            return make_password(None)
+        return self.submit(make_password, password, salt, hasher)
+
+    def check_password(self, password, encoded, setter=None):
+        """Pool backed version of django's check_password"""
+        if password is None or not hashers.is_password_usable(encoded):
+            return False
+
+        is_correct = self.submit(hashers.check_password, password, encoded)
+        if is_correct and setter is not None:
+            # the setter usually saves the user, so it has to run here and
+            # not in the worker. Deciding if the hash must be upgraded is
+            # cheap, only the hashing itself is offloaded.
+            preferred = hashers.get_hasher('default')
+            hasher = hashers.identify_hasher(encoded)
+            if (hasher.algorithm != preferred.algorithm or
+                    preferred.must_update(encoded)):
+                setter(password)
+        return is_correct
+
+    def stats(self):
+        """Return the queue depth and latency metrics of the executor"""
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                'kind': self.kind,
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'queue_depth': max(0, self.in_flight - self.workers),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_hash_seconds': self.hash_time / completed,
+                'avg_latency_seconds': self.total_time / completed,
+                'max_latency_seconds': self.max_time,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+_hashing_executor = None
+
+
+def get_hashing_executor():
+    """Return the process wide executor built from PASSWORD_HASHING"""
+    global _hashing_executor
+    if _hashing_executor is None:
+        conf = dict(DEFAULT_PASSWORD_HASHING)
+        conf.update(getattr(settings, 'PASSWORD_HASHING', {}))
+        _hashing_executor = HashingExecutor(
+            kind=conf['EXECUTOR'],
+            workers=conf['WORKERS'],
+            max_queue=conf['MAX_QUEUE'],
+            queue_timeout=conf['QUEUE_TIMEOUT'],
+        )
+    return _hashing_executor
+
+
+@receiver(setting_changed)
+def reset_hashing_executor(**kwargs):
+    """Rebuild the executor when the tests override its settings"""
+    global _hashing_executor
+    if kwargs['setting'] in ('PASSWORD_HASHING', 'PASSWORD_HASHERS'):
+        if _hashing_executor is not None:
+            _hashing_executor.shutdown()
+        _hashing_executor = None
+        # their processes were set up with the previous hashers
+        for executor in list(_process_pools.values()):
+            _drop_process_pool(executor)
+
+
+def collect_metrics():
+    """Gauges of the hashing executor, see core.metrics"""
+    if _hashing_executor is None:
+        return []
+    return [
+        ('password_hashing_' + key, {}, value)
+        for key, value in _hashing_executor.stats().items()
+        if key != 'kind'
+    ]
@@ -0,0 +1,166 @@
+"""Import time profiling, see the importtime command
+
+Only the standard library is imported here: the module is loaded before
+django in the profiled process, so that django's imports are measured too.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+
+ImportTiming = namedtuple('ImportTiming', 'module self cumulative parent')
+
+
+class _TimedLoader:
+    """Wraps the loader of a module to time its execution"""
+
+    def __init__(self, loader, profiler, name):
+        self.loader = loader
+        self.profiler = profiler
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.profiler.enter(self.name)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.exit()
+
+
+class ImportProfiler:
+    """Times every import, like python -X importtime
+
+    -X importtime misses the modules loaded by importlib.import_module,
+    which is how django loads the apps, models, admin modules and
+    urlconfs. This finder sees them too: it wraps the loader of each
+    module found by the other finders.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._stack = []
+        self.timings = []
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        # namespace packages and old style loaders are not timed
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self, name)
+        return spec
+
+    def enter(self, name):
+        # [module, start, time spent importing its own imports]
+        self._stack.append([name, self._clock(), 0.0])
+
+    def exit(self):
+        name, start, children = self._stack.pop()
+        cumulative = self._clock() - start
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None:
+            parent[2] += cumulative
+        self.timings.append(ImportTiming(
+            name, cumulative - children, cumulative,
+            parent[0] if parent is not None else None,
+        ))
+
+
+def _load(target, modules):
+    import django
+    if target == 'wsgi':
+        from django.core.wsgi import get_wsgi_application
+        get_wsgi_application()
+    else:
+        django.setup(set_prefix=False)
+        if target == 'urls':
+            from django.urls import get_resolver
+            get_resolver().url_patterns
+    for module in modules:
+        __import__(module)
+
+
+def _profile(target, modules):
+    """Import target in this (fresh) process, print the timings as JSON"""
+    profiler = ImportProfiler()
+    profiler.install()
+    try:
+        _load(target, modules)
+    finally:
+        profiler.uninstall()
+    json.dump([list(timing) for timing in profiler.timings], sys.stdout)
+
+
+def profile_imports(target='setup', modules=(), cwd=None):
+    """Return the ImportTimings of loading target in a fresh interpreter
+
+    target is 'setup' (django.setup(), what every management command
+    does), 'urls' (setup and the URLconf) or 'wsgi' (the application of
+    the web workers). modules are imported afterwards.
+    """
+    env = dict(os.environ)
+    if cwd is not None:
+        env['PYTHONPATH'] = os.pathsep.join(
+            path for path in [cwd, env.get('PYTHONPATH')] if path
+        )
+    script = 'from core.importtime import _profile; _profile(%r, %r)' % (
+        target, list(modules),
+    )
+    output = subprocess.check_output(
+        [sys.executable, '-c', script], env=env, cwd=cwd,
+    )
+    return [ImportTiming(*timing) for timing in json.loads(output.decode())]
+
+
+def package_of(module):
+    return module.partition('.')[0]
+
+
+def summarize(timings, project, top=15):
+    """Return the report sections of timings as {title: [(name, s)]}
+
+    The slowest modules by self time, the packages by the sum of the self
+    times of their modules, and the modules of the project packages by
+    cumulative time, i.e. with everything they imported first.
+    """
+    packages = {}
+    for timing in timings:
+        package = package_of(timing.module)
+        packages[package] = packages.get(package, 0) + timing.self
+    slowest = sorted(timings, key=lambda timing: -timing.self)
+    ours = sorted(
+        (timing for timing in timings
+         if package_of(timing.module) in project),
+        key=lambda timing: -timing.cumulative,
+    )
+    return {
+        'modules (self)': [
+            (timing.module, timing.self) for timing in slowest[:top]
+        ],
+        'packages (self)': sorted(
+            packages.items(), key=lambda item: -item[1]
+        )[:top],
+        'project modules (cumulative)': [
+            (timing.module, timing.cumulative) for timing in ours[:top]
+        ],
+    }
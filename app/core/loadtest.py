@@ -0,0 +1,273 @@
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.test.utils import setup_databases, setup_test_environment, \
+                              teardown_databases, teardown_test_environment
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+
+from core.asgi import WsgiToAsgi
+from core.sharding import shard_for_user_id
+
+
+LOADTEST_PASSWORD = 'loadtestpass'
+
+
+@contextmanager
+def temporary_database(verbosity=0):
+    """Run the block against throwaway test databases"""
+    setup_test_environment()
+    old_config = setup_databases(verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+        teardown_test_environment()
+
+
+def percentile(values, pct):
+    """Return the pct percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, duration, errors=0):
+    """Turn raw latencies (in seconds) into the numbers we report"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / duration if duration else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+class LoadRequest:
+    """A single HTTP request replayed against the application
+
+    The requests are sent to the 'testserver' host, which the test
+    environment set up by temporary_database() allows.
+    """
+
+    def __init__(self, method, path, headers=None, body=b''):
+        self.method = method
+        self.path = path
+        self.headers = headers or {}
+        self.body = body
+
+    @classmethod
+    def json(cls, method, path, data, headers=None):
+        headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        return cls(method, path, headers, json.dumps(data).encode('utf-8'))
+
+    def environ(self):
+        """WSGI environ for the request"""
+        environ = {
+            'REQUEST_METHOD': self.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': self.path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(self.body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(self.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in self.headers.items():
+            key = name.upper().replace('-', '_')
+            if key != 'CONTENT_TYPE':
+                key = 'HTTP_' + key
+            environ[key] = value
+        return environ
+
+    def scope(self):
+        """ASGI http scope for the request"""
+        headers = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in self.headers.items()
+        ]
+        headers.append((b'content-length', str(len(self.body)).encode()))
+        headers.append((b'host', b'testserver'))
+        return {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': self.method,
+            'scheme': 'http',
+            'path': self.path,
+            'root_path': '',
+            'query_string': b'',
+            'headers': headers,
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+
+
+def build_scenarios(requests):
+    """Seed a user and return the requests of each scenario"""
+    user = get_user_model().objects.create_user(
+        email='loadtest-%s@example.com' % uuid.uuid4().hex,
+        password=LOADTEST_PASSWORD,
+        name='Load Test',
+    )
+    # create() has no hint of the user, sharded it has to be told where
+    token = Token.objects.using(shard_for_user_id(user.pk)).create(user=user)
+    auth = {'Authorization': 'Token ' + token.key}
+    return {
+        'create': [
+            LoadRequest.json('POST', reverse('user:create'), {
+                'email': 'loadtest-%s@example.com' % uuid.uuid4().hex,
+                'password': LOADTEST_PASSWORD,
+                'name': 'Load Test',
+            })
+            for _ in range(requests)
+        ],
+        'token': [
+            LoadRequest.json('POST', reverse('user:token'), {
+                'email': user.email,
+                'password': LOADTEST_PASSWORD,
+            })
+            for _ in range(requests)
+        ],
+        'me': [
+            LoadRequest('GET', reverse('user:me'), auth)
+            for _ in range(requests)
+        ],
+    }
+
+
+def run_wsgi(application, requests, clients, workers, client_delay=0.0):
+    """Replay requests with a threaded WSGI server of `workers` threads
+
+    Every client keeps its worker busy until it has read the response, so
+    client_delay (a slow network) holds a worker for that long.
+    """
+    slots = threading.BoundedSemaphore(workers)
+    pending = iter(requests)
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def client():
+        while True:
+            with lock:
+                request = next(pending, None)
+            if request is None:
+                return
+            start = time.perf_counter()
+            status = []
+            with slots:
+                result = application(
+                    request.environ(),
+                    lambda s, headers, exc_info=None: status.append(s),
+                )
+                try:
+                    for _ in result:
+                        pass
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+                time.sleep(client_delay)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not status or int(status[0][:3]) >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, len(errors))
+
+
+def run_asgi(application, requests, clients, client_delay=0.0):
+    """Replay requests against an ASGI application on an event loop
+
+    Here a slow client only keeps a coroutine waiting, the pool threads
+    of the application are free to serve the other clients.
+    """
+    latencies = []
+    errors = []
+
+    async def call(request):
+        sent = False
+        status = []
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                return {'type': 'http.disconnect'}
+            sent = True
+            return {'type': 'http.request', 'body': request.body}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif not message.get('more_body', False):
+                await asyncio.sleep(client_delay)
+
+        start = time.perf_counter()
+        await application(request.scope(), receive, send)
+        latencies.append(time.perf_counter() - start)
+        if not status or status[0] >= 400:
+            errors.append(status)
+
+    async def client(pending):
+        for request in pending:
+            await call(request)
+
+    async def main():
+        pending = iter(requests)
+        await asyncio.gather(*[client(pending) for _ in range(clients)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        start = time.perf_counter()
+        loop.run_until_complete(main())
+        duration = time.perf_counter() - start
+    finally:
+        loop.close()
+    return summarize(latencies, duration, len(errors))
+
+
+def compare(wsgi_application, requests, clients, workers, client_delay=0.0,
+            names=('create', 'token', 'me')):
+    """Run the scenarios in both modes and return the results"""
+    asgi_application = WsgiToAsgi(wsgi_application, max_workers=workers)
+    # each mode gets its own requests, the create ones can only run once
+    wsgi_scenarios = build_scenarios(requests)
+    asgi_scenarios = build_scenarios(requests)
+    results = {}
+    for name in names:
+        results[name] = {
+            'wsgi': run_wsgi(
+                wsgi_application, wsgi_scenarios[name], clients, workers,
+                client_delay,
+            ),
+            'asgi': run_asgi(
+                asgi_application, asgi_scenarios[name], clients, client_delay
+            ),
+        }
+    asgi_application.executor.shutdown()
+    return results
@@ -0,0 +1,89 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import benchmarks
+from core.loadtest import temporary_database
+
+
+class Command(BaseCommand):
+    """Django command running the benchmarks of the user API hot paths"""
+    help = ('Benchmark the user API hot paths on throwaway test databases, '
+            'optionally comparing the results with a saved baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--only', action='append',
+                            choices=sorted(benchmarks.BENCHMARKS),
+                            help='benchmark to run, may be repeated')
+        parser.add_argument('--save-baseline', metavar='PATH',
+                            help='write the results as the new baseline')
+        parser.add_argument('--compare', metavar='PATH',
+                            help='baseline to compare the results with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='tolerated throughput drop, 0.2 is 20%%')
+        parser.add_argument('--wire', action='store_true',
+                            help='report the response sizes per encoding '
+                                 'and the JSON render times instead')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        if options['wire']:
+            return self.handle_wire(options['iterations'])
+
+        with temporary_database():
+            results = benchmarks.run_benchmarks(
+                options['only'], options['iterations'], options['warmup']
+            )
+
+        row = '{:<18} {:>10} {:>9} {:>9} {:>9} {:>10}'
+        self.stdout.write(row.format(
+            'benchmark', 'ops/sec', 'p50 ms', 'p95 ms', 'p99 ms',
+            'queries/op',
+        ))
+        for name, result in sorted(results.items()):
+            self.stdout.write(row.format(
+                name,
+                '%.1f' % result['ops_per_sec'],
+                '%.2f' % result['p50_ms'],
+                '%.2f' % result['p95_ms'],
+                '%.2f' % result['p99_ms'],
+                '%.2f' % result['queries_per_op'],
+            ))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write(
+                'Baseline saved to %s' % options['save_baseline']
+            )
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = benchmarks.find_regressions(
+                results, baseline, options['threshold']
+            )
+            if regressions:
+                raise CommandError(
+                    'Performance regressions:\n  ' + '\n  '.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS('No regression found'))
+
+    def handle_wire(self, iterations):
+        with temporary_database():
+            results = benchmarks.measure_wire(iterations)
+
+        columns = sorted({
+            key for result in results.values() for key in result
+        })
+        row = '{:<8}' + ' {:>16}' * len(columns)
+        self.stdout.write(row.format('endpoint', *columns))
+        for name, result in sorted(results.items()):
+            self.stdout.write(row.format(name, *(
+                '%.1f' % result[column] if column.endswith('_us')
+                else result[column]
+                for column in columns
+            )))
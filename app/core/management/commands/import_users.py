@@ -0,0 +1,58 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.hashing import PasswordHasherPool
+from core.userio import Progress, guess_format, import_users, read_rows
+
+
+class Command(BaseCommand):
+    """Django command creating users from a CSV or NDJSON file"""
+    help = ('Import users from a CSV or JSON/NDJSON file (- for stdin) '
+            'with email, name, password and is_* columns. Existing emails '
+            'are skipped. Uses COPY on postgres.')
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='defaults to the extension of the file')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='rows read, hashed and inserted at a time')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='password hashing processes, 0 hashes '
+                                 'inline (default: one per CPU)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        progress = Progress(self.stderr)
+
+        try:
+            stream = (
+                sys.stdin.buffer if path == '-' else open(path, 'rb')
+            )
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            with PasswordHasherPool(options['workers']) as hasher:
+                import_users(
+                    read_rows(stream, fmt), options['database'],
+                    options['batch_size'], hasher, progress,
+                )
+        except ValueError as exc:
+            # malformed JSON, the rows before it were imported
+            raise CommandError('%s (after %d rows)' % (exc, progress.rows))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        progress.report()
+        self.stdout.write(self.style.SUCCESS('Imported %d users' % (
+            progress.counts.get('created', 0)
+        )))
@@ -0,0 +1,48 @@
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.importtime import profile_imports, summarize
+
+
+class Command(BaseCommand):
+    """Django command reporting what the imports of a process cost"""
+    help = ('Import the app in a fresh interpreter and report the time '
+            'spent per module and per package')
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'target', nargs='?', default='setup',
+            choices=('setup', 'urls', 'wsgi'),
+            help='setup: django.setup(), as every management command; '
+                 'urls: setup and the URLconf; wsgi: the web application',
+        )
+        parser.add_argument('--module', action='append', default=[],
+                            help='also import this module, may be repeated')
+        parser.add_argument('--top', type=int, default=15,
+                            help='lines per section')
+
+    def handle(self, *args, **options):
+        timings = profile_imports(options['target'], options['module'],
+                                  cwd=settings.BASE_DIR)
+        # the apps living in the project directory
+        project = {
+            app_config.name.partition('.')[0]
+            for app_config in apps.get_app_configs()
+            if app_config.path.startswith(settings.BASE_DIR + os.sep)
+        }
+        project.add(settings.SETTINGS_MODULE.partition('.')[0])
+
+        self.stdout.write('%d modules imported in %.1f ms' % (
+            len(timings),
+            sum(timing.self for timing in timings) * 1000,
+        ))
+        for title, rows in summarize(timings, project,
+                                     options['top']).items():
+            self.stdout.write('\n' + title)
+            for name, elapsed in rows:
+                self.stdout.write('  %8.1f ms  %s' % (elapsed * 1000, name))
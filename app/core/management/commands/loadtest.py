@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+
+from core import loadtest
+
+
+class Command(BaseCommand):
+    """Django command comparing the WSGI and ASGI serving modes"""
+    help = ('Replay the user API requests in process against the WSGI and '
+            'the ASGI application and report requests/sec and latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='requests per scenario and mode')
+        parser.add_argument('--clients', type=int, default=32,
+                            help='concurrent clients')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='WSGI worker threads / ASGI pool threads')
+        parser.add_argument('--client-delay', type=float, default=0.0,
+                            help='seconds a (slow) client takes to read a '
+                                 'response')
+        parser.add_argument('--scenario', action='append',
+                            choices=('create', 'token', 'me'),
+                            help='scenario to run, may be repeated')
+        parser.add_argument('--json', dest='json_path',
+                            help='also write the results to this file')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['workers'] < 1:
+            raise CommandError('--clients and --workers must be positive')
+
+        names = options['scenario'] or ('create', 'token', 'me')
+        # never load test the real data, use throwaway test databases
+        with loadtest.temporary_database():
+            results = loadtest.compare(
+                get_wsgi_application(),
+                options['requests'],
+                options['clients'],
+                options['workers'],
+                options['client_delay'],
+                names,
+            )
+
+        row = '{:<8} {:<5} {:>9} {:>9} {:>9} {:>9} {:>7}'
+        self.stdout.write(row.format(
+            'scenario', 'mode', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+            'errors',
+        ))
+        for name, modes in results.items():
+            for mode, result in modes.items():
+                self.stdout.write(row.format(
+                    name, mode,
+                    '%.1f' % result['rps'],
+                    '%.2f' % result['p50_ms'],
+                    '%.2f' % result['p95_ms'],
+                    '%.2f' % result['p99_ms'],
+                    result['errors'],
+                ))
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, indent=2)
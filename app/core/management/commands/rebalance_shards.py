@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.sharding import get_shards, rebalance, sync_auth_tables
+from core.userio import Progress
+
+
+class Command(BaseCommand):
+    """Django command moving the users to the shard they belong to"""
+    help = ('Move the users stored on another shard than the one of their '
+            'email (after USER_SHARDING["SHARDS"] changed, or users '
+            'created before sharding) in batches')
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='users read and moved at a time')
+        parser.add_argument('--source', action='append',
+                            help='only move the users of this database, '
+                                 'repeatable (default: every shard). A '
+                                 'shard removed from the settings is '
+                                 'emptied with --source')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='seconds to pause between two batches')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='count the users to move, move nothing')
+
+    def handle(self, *args, **options):
+        shards = get_shards()
+        if not shards:
+            raise CommandError('USER_SHARDING["SHARDS"] is not set')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        sources = options['source'] or shards
+        for source in sources:
+            if source not in connections.databases:
+                raise CommandError('Unknown database %r' % source)
+        if not options['dry_run']:
+            # the memberships of the users moved point to these
+            for alias in shards:
+                try:
+                    sync_auth_tables(alias)
+                except ValueError as exc:
+                    raise CommandError(exc)
+        progress = Progress(self.stderr)
+
+        for source in sources:
+            moves = rebalance(source, options['batch_size'],
+                              options['dry_run'])
+            for target, count, conflicts in moves:
+                progress.add(**{'%s->%s' % (source, target): count})
+                for user_id in conflicts:
+                    self.stderr.write(self.style.WARNING(
+                        'User %d of %s left in place, an account of %s has '
+                        'the same email' % (user_id, source, target)
+                    ))
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+
+        progress.report()
+        self.stdout.write(self.style.SUCCESS('%s %d user(s)' % (
+            'Would move' if options['dry_run'] else 'Moved', progress.rows
+        )))
@@ -0,0 +1,46 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from core.tasks import Worker, get_broker, tasks_settings
+
+
+class Command(BaseCommand):
+    """Django command running the worker of the post-commit task queue"""
+    help = 'Run the tasks queued by core.tasks until interrupted'
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        conf = tasks_settings()
+        parser.add_argument('--once', action='store_true',
+                            help='run the ready messages once and exit')
+        parser.add_argument('--batch-size', type=int,
+                            default=conf['BATCH_SIZE'])
+        parser.add_argument('--poll-interval', type=float,
+                            default=conf['POLL_INTERVAL'],
+                            help='seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        worker = Worker.from_settings(batch_size=options['batch_size'])
+        if options['once']:
+            while worker.run_once():
+                pass
+        else:
+            stop = threading.Event()
+            # finish the current batch on SIGTERM, what is not acknowledged
+            # would be delivered again anyway
+            signal.signal(signal.SIGTERM, lambda *args: stop.set())
+            self.stdout.write('Running tasks from the %s broker...' % (
+                type(get_broker()).__name__
+            ))
+            try:
+                worker.run(options['poll_interval'], stop)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(self.style.SUCCESS(
+            'Processed %d message(s), %d failed' % (
+                worker.processed, worker.failed,
+            )
+        ))
@@ -0,0 +1,112 @@
+import compileall
+import os
+import signal
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.db import DEFAULT_DB_ALIAS
+from django.urls import get_resolver
+
+from core.server import PreforkServer
+from core.sharding import get_shards, is_sharded, sync_auth_tables
+from core.startup import StartupTimer, ensure_migrated, measure_startup, \
+                         serve_settings
+
+
+class Command(BaseCommand):
+    """Django command booting the app for production, unlike runserver"""
+    help = ('Apply the pending migrations, precompile the bytecode, load '
+            'the WSGI application and serve it from forked workers')
+
+    # the checks run when the image is built, not on every boot
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        conf = serve_settings()
+        parser.add_argument('--bind', default=conf['BIND'],
+                            help='host:port to listen on')
+        parser.add_argument('--workers', type=int, default=conf['WORKERS'],
+                            help='worker processes, 0 is one per CPU')
+        parser.add_argument('--database', action='append',
+                            dest='databases',
+                            help='database to migrate (repeatable), '
+                                 'every user shard by default')
+        parser.add_argument('--no-migrate', action='store_false',
+                            dest='migrate',
+                            help='do not apply the pending migrations')
+        parser.add_argument('--no-compile', action='store_false',
+                            dest='compile',
+                            help='do not precompile the bytecode')
+        parser.add_argument('--startup-report', action='store_true',
+                            help='print how long a fresh process takes to '
+                                 'import, configure and load the app, '
+                                 'and exit')
+
+    def handle(self, *args, **options):
+        if options['startup_report']:
+            for line in measure_startup().report():
+                self.stdout.write(line)
+            return
+
+        host, _, port = options['bind'].rpartition(':')
+        if not host or not port.isdigit():
+            raise CommandError('--bind must be host:port')
+        workers = options['workers'] or os.cpu_count() or 1
+
+        timer = StartupTimer()
+        if options['compile']:
+            with timer.phase('bytecode'):
+                # workers=0 compiles with one process per CPU
+                if not compileall.compile_dir(settings.BASE_DIR, quiet=1,
+                                              workers=0):
+                    self.stderr.write('Some modules could not be compiled')
+        if options['migrate']:
+            with timer.phase('migrations'):
+                # the default database first, the shards copy its auth
+                # tables
+                for using in options['databases'] or get_shards() or [
+                    DEFAULT_DB_ALIAS
+                ]:
+                    done = ensure_migrated(
+                        using, serve_settings()['MIGRATION_STATE'],
+                        lambda using, targets: self.migrate(
+                            using, targets, options['verbosity']
+                        ),
+                    )
+                    self.stdout.write('Migrations (%s): %s' % (using, done))
+                    if is_sharded():
+                        try:
+                            sync_auth_tables(using)
+                        except ValueError as exc:
+                            raise CommandError(exc)
+        with timer.phase('application'):
+            # loaded before forking, the workers share it
+            application = get_internal_wsgi_application()
+            get_resolver().reverse_dict
+
+        server = PreforkServer(
+            application, host.strip('[]'), int(port), workers,
+            stdout=self.stdout,
+            graceful_timeout=serve_settings()['GRACEFUL_TIMEOUT'],
+        )
+        with timer.phase('fork'):
+            server.start()
+        for line in timer.report():
+            self.stdout.write(line)
+        self.stdout.write('Serving on http://%s:%s with %d worker(s)' % (
+            host, server.address[1], workers,
+        ))
+
+        signal.signal(signal.SIGTERM, server.stop)
+        signal.signal(signal.SIGINT, server.stop)
+        try:
+            server.serve()
+        finally:
+            server.close()
+
+    def migrate(self, using, targets, verbosity):
+        for target in targets or [()]:
+            call_command('migrate', *target, database=using,
+                         interactive=False, verbosity=verbosity)
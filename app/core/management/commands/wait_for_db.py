@@ -1,21 +1,135 @@
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
 from django.db import connections
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
     """Django command to pause execution util database is available"""
+    help = ('Wait until the databases accept connections and answer a '
+            'query, retrying with jittered exponential backoff')
+
+    # the checks import the URLconf, and with it DRF and every view, which
+    # only slows down a container waiting for its database
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='database alias to wait for, may be repeated '
+                 '(default: "default")',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='wait for every database in settings.DATABASES',
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=60,
+            help='overall deadline in seconds',
+        )
+        parser.add_argument(
+            '--initial-delay', type=float, default=0.1,
+            help='first backoff delay in seconds',
+        )
+        parser.add_argument(
+            '--max-delay', type=float, default=5,
+            help='longest backoff delay in seconds',
+        )
+
+    def ping(self, alias, timeout=None):
+        """Open a real connection to the database and run a cheap query
+
+        Raises OperationalError when there is no answer within timeout
+        seconds: a host dropping the packets would otherwise hang the
+        connection attempt for minutes. The attempt is left behind on its
+        own daemon thread.
+        """
+        done = threading.Event()
+        errors = []
+
+        def probe():
+            connection = connections[alias]
+            try:
+                # connections[alias] alone is lazy, it does not connect
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                # the connection belongs to this short lived thread
+                connection.close()
+                done.set()
+
+        threading.Thread(
+            target=probe, name='wait-for-db-%s' % alias, daemon=True
+        ).start()
+        if not done.wait(timeout):
+            raise OperationalError(
+                'No answer within %.2f seconds' % timeout
+            )
+        if errors:
+            raise errors[0]
+
+    def wait_for(self, alias, deadline, initial_delay, max_delay):
+        """Retry ping() until it succeeds, return (seconds, attempts)"""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            # leave time for a few more attempts in case this one hangs
+            remaining = deadline - time.monotonic()
+            try:
+                self.ping(alias, max(0, min(remaining, max(1, remaining / 3))))
+                return time.monotonic() - start, attempt
+            except OperationalError as exc:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CommandError(
+                        'Database "%s" unavailable after %d attempts: %s'
+                        % (alias, attempt, exc)
+                    )
+                # "full jitter" backoff, so restarting containers do not
+                # hit the database in lock step
+                delay = min(max_delay, initial_delay * 2 ** (attempt - 1))
+                delay = min(random.uniform(0, delay), remaining)
+                self.stdout.write(
+                    'Database "%s" unavailable, waiting %.2f seconds...'
+                    % (alias, delay)
+                )
+                time.sleep(delay)
 
     def handle(self, *args, **options):
+        if options['all']:
+            aliases = list(settings.DATABASES)
+        else:
+            aliases = options['databases'] or ['default']
+
         self.stdout.write('Waiting for database...')
-        db_conn = None
-        while not db_conn:
-            try:
-                db_conn = connections['default']
-            except OperationalError:
-                self.stdout.write('Database unavailable, waiting 1 second...')
-                time.sleep(1)
+        start = time.monotonic()
+        deadline = start + options['timeout']
+        # every alias is probed on its own thread so the total wait is the
+        # one of the slowest database, not the sum of all of them
+        with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+            futures = [
+                (alias, executor.submit(
+                    self.wait_for, alias, deadline,
+                    options['initial_delay'], options['max_delay'],
+                ))
+                for alias in aliases
+            ]
+            for alias, future in futures:
+                elapsed, attempts = future.result()
+                self.stdout.write(
+                    'Database "%s" ready in %.2f seconds (%d attempts)'
+                    % (alias, elapsed, attempts)
+                )
 
-        self.stdout.write(self.style.SUCCESS('Database available'))
+        self.stdout.write(self.style.SUCCESS(
+            'Database available in %.2f seconds' % (time.monotonic() - start)
+        ))
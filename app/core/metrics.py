@@ -0,0 +1,199 @@
+import bisect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+
+class Histogram:
+    """Cumulative histogram in the style of a prometheus histogram"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # the last slot is the +Inf bucket
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yield (upper bound, count of observations <= bound)"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in sorted(labels.items())
+    )
+
+
+class Registry:
+    """In process store of the histograms and gauge collectors"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._buckets = {}
+        self._collectors = []
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._buckets[name] = buckets
+            histogram.observe(value)
+
+    def histogram(self, name, **labels):
+        """Return the histogram for name and labels, None if unused"""
+        return self._histograms.get((name, tuple(sorted(labels.items()))))
+
+    def register_collector(self, collector):
+        """Register a callable returning (name, labels, value) gauges"""
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """Return every metric in the prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            collectors = list(self._collectors)
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            labels = dict(labels)
+            if name not in seen:
+                seen.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            for bound, count in histogram.cumulative():
+                lines.append('%s_bucket%s %s' % (
+                    name, _format_labels(dict(labels, le=bound)), count
+                ))
+            lines.append('%s_sum%s %s' % (
+                name, _format_labels(labels), histogram.sum
+            ))
+            lines.append('%s_count%s %s' % (
+                name, _format_labels(labels), histogram.count
+            ))
+
+        for collector in collectors:
+            for name, labels, value in collector():
+                if name not in seen:
+                    seen.add(name)
+                    lines.append('# TYPE %s gauge' % name)
+                lines.append('%s%s %s' % (name, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class LazyCollector:
+    """Collects the metrics of a module, once something imported it
+
+    Registering it does not import the module, so the processes that never
+    use it (management commands...) do not pay for its imports.
+    """
+
+    def __init__(self, module):
+        self.module = module
+
+    def __call__(self):
+        module = sys.modules.get(self.module)
+        return module.collect_metrics() if module is not None else []
+
+    def __eq__(self, other):
+        return isinstance(other, LazyCollector) and other.module == self.module
+
+    def __hash__(self):
+        return hash(self.module)
+
+
+class RequestStats:
+    """What one request spent its time on"""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self._serializer_depth = 0
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        """Execute wrapper counting and timing the queries"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.db_queries += 1
+
+
+_local = threading.local()
+
+
+def current_stats():
+    """Return the stats of the request handled by this thread, if any"""
+    return getattr(_local, 'stats', None)
+
+
+def set_current_stats(stats):
+    _local.stats = stats
+
+
+@contextmanager
+def serializer_timer():
+    """Add the time spent in the block to the request serializer time"""
+    stats = current_stats()
+    if stats is None:
+        yield
+        return
+    # nested serializer calls must only be counted once
+    stats._serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats._serializer_depth -= 1
+        if not stats._serializer_depth:
+            stats.serializer_time += time.perf_counter() - start
+
+
+class TimedSerializerMixin:
+    """Count the time spent validating, saving and serializing"""
+
+    def is_valid(self, *args, **kwargs):
+        with serializer_timer():
+            return super().is_valid(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        with serializer_timer():
+            return super().save(*args, **kwargs)
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super().data
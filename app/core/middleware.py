@@ -0,0 +1,261 @@
+import gzip
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+from core import metrics, routers
+from core.metrics import COUNT_BUCKETS, SIZE_BUCKETS
+from core.profiling import SamplingProfiler
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+
+DEFAULT_PERF_PROFILER = {
+    'ENABLED': False,
+    # fraction of the requests that get profiled
+    'SAMPLE_RATE': 1.0,
+    # seconds between two stack samples
+    'INTERVAL': 0.005,
+    # requests slower than this (in seconds) get their samples dumped
+    'THRESHOLD': 0.5,
+    'DIR': '/tmp/profiles',
+}
+
+DEFAULT_RESPONSE_COMPRESSION = {
+    # smaller bodies gain less than the compression costs
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    # 0-11, the higher levels are far too slow for dynamic responses
+    'BROTLI_QUALITY': 4,
+}
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/x-ndjson',
+    'application/javascript', 'application/xml',
+)
+
+
+class ReadYourWritesMiddleware:
+    """Keep a client on the primary database for a while after a write
+
+    The pin is a short lived cookie, so it follows the client whichever
+    process serves its next requests. Token clients often ignore cookies:
+    the user who wrote is also pinned in READ_YOUR_WRITES_CACHE, which the
+    token authentication checks (see core.routers.pin_user).
+    """
+    cookie_name = 'db_primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.unpin()
+        if request.COOKIES.get(self.cookie_name):
+            routers.pin_to_primary()
+        try:
+            response = self.get_response(request)
+            if routers.has_written():
+                window = getattr(settings, 'READ_YOUR_WRITES_WINDOW', 5)
+                response.set_cookie(
+                    self.cookie_name, '1', max_age=window, httponly=True,
+                )
+                # DRF sets the user it authenticated on the django request
+                user = getattr(request, 'user', None)
+                if user is not None and user.is_authenticated:
+                    routers.pin_user(user.pk, window)
+        finally:
+            routers.unpin()
+        return response
+
+
+class ClosingIterator:
+    """Iterate over a streaming body and call callback once it is closed
+
+    The WSGI server closes the response (and so this) when the body is
+    sent or the client went away, even if it was never iterated.
+    """
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        callback, self.callback = self.callback, None
+        if callback is not None:
+            callback()
+
+
+class PerformanceMiddleware:
+    """Record per view wall time, DB usage, serializer time and size
+
+    The numbers go into the histograms of core.metrics.registry, labelled
+    with the resolved URL name (e.g. "user:me"). With PERF_PROFILER
+    enabled, slow requests also get their stack samples written out as
+    flame graph data. Streaming responses are timed until their body is
+    sent.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.profiler_conf = dict(DEFAULT_PERF_PROFILER)
+        self.profiler_conf.update(getattr(settings, 'PERF_PROFILER', {}))
+
+    def __call__(self, request):
+        stats = metrics.RequestStats()
+        metrics.set_current_stats(stats)
+        profiler = self.start_profiler()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(stats.db_wrapper)
+                    )
+                response = self.get_response(request)
+        except BaseException:
+            if profiler is not None:
+                profiler.stop()
+            raise
+        finally:
+            metrics.set_current_stats(None)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        registry = metrics.registry
+        registry.observe('http_request_db_queries', stats.db_queries,
+                         buckets=COUNT_BUCKETS, view=view)
+        registry.observe('http_request_db_seconds', stats.db_time, view=view)
+        registry.observe('http_request_serializer_seconds',
+                         stats.serializer_time, view=view)
+
+        def finish():
+            if profiler is not None:
+                profiler.stop()
+            wall = time.perf_counter() - start
+            registry.observe('http_request_duration_seconds', wall, view=view)
+            if profiler is not None and \
+                    wall >= self.profiler_conf['THRESHOLD']:
+                profiler.dump(self.profiler_conf['DIR'], view)
+
+        if response.streaming:
+            # most of the work happens while the body is sent
+            response.streaming_content = ClosingIterator(
+                response.streaming_content, finish
+            )
+        else:
+            registry.observe('http_response_size_bytes', len(response.content),
+                             buckets=SIZE_BUCKETS, view=view)
+            finish()
+        return response
+
+    def start_profiler(self):
+        conf = self.profiler_conf
+        if not conf['ENABLED'] or random.random() >= conf['SAMPLE_RATE']:
+            return None
+        return SamplingProfiler(
+            threading.get_ident(), interval=conf['INTERVAL']
+        ).start()
+
+
+def accepted_encodings(header):
+    """Return {coding: q} for an Accept-Encoding header"""
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class CompressionMiddleware:
+    """Compress the responses with brotli or gzip, as the client prefers
+
+    Brotli needs the optional brotli package. Bodies smaller than
+    RESPONSE_COMPRESSION['MIN_SIZE'] and types that are already compressed
+    are sent as they are, streaming responses are gzipped on the fly.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = dict(DEFAULT_RESPONSE_COMPRESSION)
+        self.conf.update(getattr(settings, 'RESPONSE_COMPRESSION', {}))
+
+    def choose_encoding(self, request, streaming):
+        accepted = accepted_encodings(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        default = accepted.get('*', 0.0)
+        candidates = ['gzip'] if streaming or brotli is None else [
+            'br', 'gzip'
+        ]
+        # on a tie the first one wins, brotli compresses better
+        best = max(
+            candidates, key=lambda coding: accepted.get(coding, default)
+        )
+        return best if accepted.get(best, default) > 0 else None
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        content_type = response.get('Content-Type', '')
+        if (response.has_header('Content-Encoding') or
+                not content_type.startswith(COMPRESSIBLE_TYPES)):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        too_small = (
+            not response.streaming and
+            len(response.content) < self.conf['MIN_SIZE']
+        )
+        if too_small:
+            return response
+        encoding = self.choose_encoding(request, response.streaming)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(
+                response.streaming_content
+            )
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(
+                    response.content, quality=self.conf['BROTLI_QUALITY']
+                )
+            else:
+                compressed = gzip.compress(
+                    response.content, self.conf['GZIP_LEVEL']
+                )
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # the bytes differ from the identity ones, a strong ETag can not
+        # be shared by both (same as django.middleware.gzip)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+# the admin searches with UPPER(col::text) LIKE UPPER('prefix%'), these
+# indexes serve that lookup; text_pattern_ops makes LIKE usable whatever
+# the collation of the database
+INDEXES = (
+    ('core_user_email_upper_like',
+     'UPPER("email"::text) text_pattern_ops'),
+    ('core_user_name_upper_like',
+     'UPPER("name"::text) text_pattern_ops'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # building an index on a big table must not block the signups
+    for name, expression in INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS "%s" ON "core_user" (%s)'
+            % (name, expression)
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS "%s"' % name)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
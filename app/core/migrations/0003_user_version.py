@@ -0,0 +1,63 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# rows filled per UPDATE, each in its own transaction
+BATCH_SIZE = 5000
+
+
+def fill_columns(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    users = User.objects.using(schema_editor.connection.alias)
+    now = timezone.now()
+    last = None
+    while True:
+        batch = users.filter(version__isnull=True).order_by('pk')
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        ids = list(batch.values_list('pk', flat=True)[:BATCH_SIZE])
+        if not ids:
+            return
+        users.filter(pk__in=ids).update(version=1, updated_at=now)
+        last = ids[-1]
+
+
+class Migration(migrations.Migration):
+    """Add the version and updated_at of the users
+
+    A column with a default rewrites the whole table under an ACCESS
+    EXCLUSIVE lock before postgres 11. The columns are added nullable
+    (instant), filled in batches that do not hold the lock, and only then
+    made NOT NULL, which just scans the table.
+    """
+    # every batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('core', '0002_user_search_indexes'),
+    ]
+
+    operations = [
+        # not auto_now yet, Django would give the column a DEFAULT now()
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='version',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(fill_columns, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+
+# Django 2.1 has neither expression nor partial indexes in Meta.indexes,
+# so they are created here for the vendors we run on. Note that on sqlite a
+# table rebuild (AlterField...) drops them, add them back after one.
+INDEXES = {
+    'postgresql': (
+        # case insensitive login, see UserManager.get_by_natural_key
+        ('core_user_email_lower', '(LOWER("email"))'),
+        # the few staff and inactive users, for the admin filters
+        ('core_user_staff', '("id") WHERE "is_staff"'),
+        ('core_user_inactive', '("id") WHERE NOT "is_active"'),
+    ),
+    'sqlite': (
+        ('core_user_email_lower', '(LOWER("email"))'),
+        # the admin prefix search is a case insensitive LIKE on sqlite,
+        # which only uses NOCASE indexes (0002 covers postgres)
+        ('core_user_email_nocase', '("email" COLLATE NOCASE)'),
+        ('core_user_name_nocase', '("name" COLLATE NOCASE)'),
+        ('core_user_staff', '("id") WHERE "is_staff" = 1'),
+        ('core_user_inactive', '("id") WHERE "is_active" = 0'),
+    ),
+}
+
+
+def create_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    # building an index on a big table must not block the signups
+    concurrently = (
+        'CONCURRENTLY ' if connection.vendor == 'postgresql' else ''
+    )
+    for name, definition in INDEXES.get(connection.vendor, ()):
+        schema_editor.execute(
+            'CREATE INDEX %sIF NOT EXISTS "%s" ON "core_user" %s'
+            % (concurrently, name, definition)
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    for name, _ in INDEXES.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute('DROP INDEX IF EXISTS "%s"' % name)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0003_user_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,46 @@
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+lookup_indexes = import_module('core.migrations.0004_user_lookup_indexes')
+
+
+def recreate_lookup_indexes(apps, schema_editor):
+    # the sqlite table rebuild of AlterField drops them
+    if schema_editor.connection.vendor == 'sqlite':
+        lookup_indexes.create_indexes(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+    """Widen core_user.id to bigint for the sharded ids
+
+    On postgres the type change rewrites core_user and its indexes under
+    an ACCESS EXCLUSIVE lock, every read and write of the users waits for
+    it. "manage.py serve" does not apply it (see run_on_boot): run
+    "manage.py migrate core 0006" on each database in a quiet window, or
+    stage it by hand (add a bigint column, fill it in batches with a
+    trigger copying new rows, swap it in, then "migrate core 0006 --fake").
+    Sharded ids stay below 2**31 until about 8 million ids were handed out
+    (see core.sharding.new_user_id).
+    """
+    # see core.startup.ensure_migrated
+    run_on_boot = False
+
+    dependencies = [
+        ('core', '0005_user_sharding'),
+    ]
+
+    operations = [
+        # run backwards after the reversed AlterField
+        migrations.RunPython(migrations.RunPython.noop,
+                             recreate_lookup_indexes),
+        # sharded user ids are spread out, see core.sharding.new_user_id
+        migrations.AlterField(
+            model_name='user',
+            name='id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(recreate_lookup_indexes,
+                             migrations.RunPython.noop),
+    ]
@@ -1,7 +1,17 @@
-from django.db import models
+import sqlite3
+
+from django.db import IntegrityError, connections, models, router, \
+                      transaction
+from django.db.models.expressions import CombinedExpression
+from django.db.models.functions import Lower
+from django.db.models.sql import UpdateQuery
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
                                         PermissionsMixin
 
+from core.hashing import get_hashing_executor
+from core.sharding import new_user_id, shard_for_email
+
 
 class UserManager(BaseUserManager):
     """password default to None in case we want to create a non active
@@ -15,11 +25,33 @@ class UserManager(BaseUserManager):
         """with email normalized, i.e. lowecase in the hostname part"""
         user = self.model(email=self.normalize_email(email), **extra_fields)
         user.set_password(password)
-        user.save(using=self._db)
+        user.save(using=self._db or shard_for_email(user.email))
         """using=self._db is just to support multiple dbs"""
 
         return user
 
+    def get_by_natural_key(self, email):
+        """Return the user with this email, ignoring its case
+
+        The lookup is on LOWER(email), which the core_user_email_lower
+        index serves. If two accounts only differ by case the exact match
+        wins. Sharded, only the shard of the email is searched.
+        """
+        if email is None:
+            raise self.model.DoesNotExist
+        manager = self if self._db else self.db_manager(
+            shard_for_email(email)
+        )
+        users = list(manager.annotate(email_lower=Lower('email')).filter(
+            email_lower=email.lower()
+        )[:2])
+        if len(users) == 1:
+            return users[0]
+        for user in users:
+            if user.email == email:
+                return user
+        raise self.model.DoesNotExist
+
     def create_superuser(self, email, password=None):
         """Creates and saves a super user"""
         user = self.create_user(email, password)
@@ -31,15 +63,175 @@ class UserManager(BaseUserManager):
 
         return user
 
+    def bulk_create_users(self, rows, batch_size=500, hasher=None):
+        """Creates users in batches, yields (row, created) for each row
+
+        rows is an iterable of dicts with an 'email', an optional
+        'password' and any extra field. Rows whose email is already taken
+        (or repeated in the input) are reported with created=False.
+        hasher is an optional callable hashing a list of passwords, e.g. a
+        core.hashing.PasswordHasherPool.
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield from self._bulk_create_batch(batch, hasher)
+                batch = []
+        if batch:
+            yield from self._bulk_create_batch(batch, hasher)
+
+    def _bulk_create_batch(self, rows, hasher):
+        """Insert a single batch of rows with one bulk INSERT per shard"""
+        emails = [self.normalize_email(row['email']) for row in rows]
+        passwords = [row.get('password') for row in rows]
+        if hasher is None:
+            hashed = [make_password(password) for password in passwords]
+        else:
+            hashed = hasher(passwords)
+
+        using = self._db or router.db_for_write(self.model)
+        # sharded, each shard gets the rows of its emails
+        shards = {}
+        for index, email in enumerate(emails):
+            shard = None if self._db else shard_for_email(email)
+            shards.setdefault(shard or using, []).append(index)
+        created = [False] * len(rows)
+        for using, indexes in shards.items():
+            inserted = self._insert_new(
+                using, [rows[index] for index in indexes],
+                [emails[index] for index in indexes],
+                [hashed[index] for index in indexes],
+            )
+            for index, is_new in zip(indexes, inserted):
+                created[index] = is_new
+
+        for row, is_new in zip(rows, created):
+            yield row, is_new
+
+    def _insert_new(self, using, rows, emails, hashed):
+        """INSERT the rows whose email is free in using, return created"""
+        users = self.db_manager(using)
+        # a concurrent request may insert one of the emails between our
+        # lookup and the INSERT, in that case just look them up again
+        for attempt in range(2):
+            existing = set(
+                users.filter(email__in=emails).values_list('email', flat=True)
+            )
+            created = []
+            new_users = []
+            for row, email, password in zip(rows, emails, hashed):
+                is_new = email not in existing
+                created.append(is_new)
+                if is_new:
+                    existing.add(email)
+                    extra_fields = {
+                        key: value for key, value in row.items()
+                        if key not in ('email', 'password')
+                    }
+                    new_users.append(self.model(
+                        id=new_user_id(email), email=email,
+                        password=password, **extra_fields
+                    ))
+            try:
+                with transaction.atomic(using=using):
+                    users.bulk_create(
+                        new_users, batch_size=len(new_users) or None
+                    )
+                break
+            except IntegrityError:
+                if attempt:
+                    raise
+        return created
+
 
 # create the models
 class User(AbstractBaseUser, PermissionsMixin):
     """Custom user model that supports using email instead of username"""
+    # sharded ids are spread out, see core.sharding.new_user_id
+    id = models.BigAutoField(primary_key=True)
     email = models.EmailField(max_length=255, unique=True)
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # bumped by every save, the ETag of the user API is derived from it
+    # (note that QuerySet.update() bypasses both)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.id is None:
+            # whoever creates the user (create_user, the admin add form...)
+            # the id is unique across the shards and names the user's shard
+            self.id = new_user_id(self.email)
+            if self.id is not None and not args:
+                # there is nothing to UPDATE first
+                kwargs.setdefault('force_insert', True)
+        updating = not self._state.adding
+        if updating:
+            # incremented by the database, two concurrent saves can not
+            # both write the same version
+            self.version = models.F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {
+                    'updated_at', 'version'
+                }
+        super().save(*args, **kwargs)
+        if isinstance(self.version, CombinedExpression):
+            # the database could not return it with the UPDATE
+            self.refresh_from_db(fields=['version'])
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        """UPDATE ... RETURNING the version the database computed"""
+        connection = connections[using]
+        returning = connection.vendor == 'postgresql' or (
+            connection.vendor == 'sqlite' and
+            sqlite3.sqlite_version_info >= (3, 35)
+        )
+        if not values or not returning or \
+                not isinstance(self.version, CombinedExpression):
+            return super()._do_update(
+                base_qs, using, pk_val, values, update_fields, forced_update
+            )
+        query = base_qs.filter(pk=pk_val).query.chain(UpdateQuery)
+        query.add_update_fields(values)
+        sql, params = query.get_compiler(using).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute('%s RETURNING %s' % (
+                sql, connection.ops.quote_name('version')
+            ), params)
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        self.version = row[0]
+        return True
+
+    # both hashing methods go through the hashing executor so the CPU heavy
+    # part runs on a bounded worker pool instead of the request thread
+    def set_password(self, raw_password):
+        self.password = get_hashing_executor().make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """Return True if raw_password is right, upgrading old hashes"""
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # password hash upgrades shouldn't be considered password changes
+            self._password = None
+            self.save(update_fields=['password'])
+
+        return get_hashing_executor().check_password(
+            raw_password, self.password, setter
+        )
+
+
+class IdSequence(models.Model):
+    """Named counter handing out blocks of ids, see core.sharding"""
+    name = models.CharField(max_length=100, primary_key=True)
+    next_value = models.BigIntegerField()
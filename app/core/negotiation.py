@@ -0,0 +1,35 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class CachedContentNegotiation(DefaultContentNegotiation):
+    """Content negotiation remembering the renderer picked per Accept header
+
+    Clients send the same handful of Accept headers over and over, so the
+    parsing and matching of the header is done once per (renderers, format,
+    Accept) combination.
+    """
+    max_entries = 256
+    _selected = {}
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        key = (
+            tuple(type(renderer) for renderer in renderers),
+            format_suffix or request.query_params.get(
+                self.settings.URL_FORMAT_OVERRIDE
+            ),
+            request.META.get('HTTP_ACCEPT'),
+        )
+        selected = self._selected.get(key)
+        if selected is None:
+            # errors (406, unknown format) are raised before caching
+            renderer, media_type = super().select_renderer(
+                request, renderers, format_suffix
+            )
+            if len(self._selected) >= self.max_entries:
+                # bogus Accept headers must not grow the cache forever
+                self._selected.clear()
+            selected = self._selected[key] = (
+                renderers.index(renderer), media_type
+            )
+        index, media_type = selected
+        return renderers[index], media_type
@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class _Sampler:
+    """One daemon thread taking the samples of every running profiler
+
+    A thread per profiled request would cost a thread start per request
+    and, under load, as many threads competing for the GIL as there are
+    requests in flight.
+    """
+
+    def __init__(self):
+        self._profilers = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, profiler):
+        with self._condition:
+            self._profilers.add(profiler)
+            # also restarts it in a forked child, where it is not running
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='sampling-profiler', daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def remove(self, profiler):
+        # the samples are taken under the lock, none comes in after this
+        with self._condition:
+            self._profilers.discard(profiler)
+
+    def _run(self):
+        with self._condition:
+            while True:
+                if not self._profilers:
+                    self._condition.wait()
+                    continue
+                now = time.perf_counter()
+                frames = None
+                for profiler in self._profilers:
+                    if profiler._due > now:
+                        continue
+                    if frames is None:
+                        frames = sys._current_frames()
+                    profiler._sample(frames.get(profiler.thread_id))
+                    profiler._due = now + profiler.interval
+                # the frames keep every local of every thread alive
+                del frames
+                self._condition.wait(
+                    min(p._due for p in self._profilers) - time.perf_counter()
+                )
+
+
+_sampler = _Sampler()
+
+
+class SamplingProfiler:
+    """Periodically samples the stack of one thread
+
+    The samples are kept as collapsed stacks ("a;b;c count" lines), the
+    input format of flamegraph.pl and most flame graph viewers. All the
+    profilers of a process share one sampling thread.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._due = None
+
+    def start(self):
+        self._due = time.perf_counter() + self.interval
+        _sampler.add(self)
+        return self
+
+    def stop(self):
+        _sampler.remove(self)
+
+    def _sample(self, frame):
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s:%s:%d' % (
+                os.path.basename(code.co_filename), code.co_name,
+                frame.f_lineno,
+            ))
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Return the samples in the collapsed stack format"""
+        return ''.join(
+            '%s %d\n' % (stack, count)
+            for stack, count in self.samples.most_common()
+        )
+
+    def dump(self, directory, name):
+        """Write the samples to directory and return the file path"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '%s-%d-%s.folded' % (
+            time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+            name.replace(':', '-').replace('/', '-'),
+        ))
+        with open(path, 'w') as output:
+            output.write(self.collapsed())
+        return path
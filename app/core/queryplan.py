@@ -0,0 +1,96 @@
+import re
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# statements worth explaining, the others (INSERT, SAVEPOINT...) have no
+# plan to regress
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def explain(connection, sql, params):
+    """Return the lines of the plan the database picks for a query"""
+    prefix = (
+        'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    # sqlite returns (id, parent, notused, detail), postgres one text column
+    return [row[-1] for row in rows]
+
+
+def full_scans(vendor, plan, tables):
+    """Return the lines of plan that read the whole of one of tables"""
+    if vendor == 'sqlite':
+        # "SCAN core_user" without "USING ... INDEX" reads every row, while
+        # "SCAN core_user USING INDEX x" only walks the (partial) index
+        patterns = [
+            re.compile(r'\bSCAN (TABLE )?%s\b(?!.*\bUSING\b)' % table)
+            for table in tables
+        ]
+    else:
+        patterns = [
+            re.compile(r'\bSeq Scan on %s\b' % table) for table in tables
+        ]
+    return [
+        line for line in plan
+        if any(pattern.search(line) for pattern in patterns)
+    ]
+
+
+class QueryPlanRecorder:
+    """Records the queries that touch tables, to explain them afterwards
+
+    The queries can not be explained while they run, the recorder is an
+    execute wrapper which only keeps their SQL and parameters.
+    """
+
+    def __init__(self, tables, using=DEFAULT_DB_ALIAS):
+        self.tables = tables
+        self.connection = connections[using]
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if (not many and sql.lstrip().upper().startswith(EXPLAINED) and
+                any(table in sql for table in self.tables)):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def record(self):
+        with self.connection.execute_wrapper(self):
+            yield self
+
+    def full_scans(self):
+        """Return [(sql, plan)] of the recorded queries doing a full scan"""
+        found = []
+        for sql, params in self.queries:
+            plan = explain(self.connection, sql, params)
+            if full_scans(self.connection.vendor, plan, self.tables):
+                found.append((sql, plan))
+        return found
+
+
+@contextmanager
+def assert_no_full_scans(tables, using=DEFAULT_DB_ALIAS):
+    """Fail if a query of the block reads the whole of one of tables
+
+    Only meaningful on tables holding enough rows for the planner to
+    prefer an index, the tests seed them first.
+    """
+    recorder = QueryPlanRecorder(tables, using)
+    with recorder.record():
+        yield recorder
+    if not recorder.queries:
+        raise AssertionError('No query touched %s' % ', '.join(tables))
+    found = recorder.full_scans()
+    if found:
+        raise AssertionError('Full scan of %s in:\n%s' % (
+            ', '.join(tables),
+            '\n'.join(
+                '%s\n    %s' % (sql, '\n    '.join(plan))
+                for sql, plan in found
+            ),
+        ))
@@ -0,0 +1,43 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer using orjson when it is installed
+
+    The output is the same as DRF's compact JSON: the types orjson does not
+    know (lazy strings, Decimal...) and the datetimes go through DRF's
+    encoder. Indented output, installs without orjson and the data orjson
+    refuses (non string keys, integers over 64 bits...) fall back to the
+    pure python JSONRenderer. orjson writes NaN and the infinities as null,
+    where DRF's strict JSON raises ValueError.
+    """
+    accelerated = orjson is not None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (not self.accelerated or data is None or
+                self.ensure_ascii or not self.compact or
+                self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data, default=_encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # like DRF, escape the separators that are invalid in javascript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+                b'\xe2\x80\xa9', b'\\u2029'
+            )
+        return ret
@@ -0,0 +1,276 @@
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from core import sharding
+
+
+# models whose reads may be served by a replica
+REPLICATED_MODELS = {('core', 'user'), ('authtoken', 'token')}
+
+# weight of the newest sample in the replica latency moving average
+LATENCY_ALPHA = 0.2
+
+USER_PIN_KEY = 'db-primary-pin:%s'
+
+_local = threading.local()
+_latency = {}
+_latency_lock = threading.Lock()
+
+
+def pin_to_primary():
+    """Send every read of the current request to the primary"""
+    _local.pinned = True
+
+
+def wrote_to_primary():
+    """Remember the current request wrote, which also pins its reads"""
+    _local.pinned = True
+    _local.wrote = True
+
+
+def is_pinned():
+    return getattr(_local, 'pinned', False)
+
+
+def has_written():
+    return getattr(_local, 'wrote', False)
+
+
+def unpin():
+    """Reset the pinning state, called at the end of every request"""
+    _local.pinned = False
+    _local.wrote = False
+
+
+def _user_pins():
+    # None: there is no replica to keep anyone away from
+    if not getattr(settings, 'DATABASE_REPLICAS', None):
+        return None
+    return caches[getattr(settings, 'READ_YOUR_WRITES_CACHE', 'default')]
+
+
+def pin_user(user_pk, window):
+    """Keep the reads of a user on the primary for window seconds
+
+    For the clients that do not send cookies back (token clients), see
+    ReadYourWritesMiddleware.
+    """
+    pins = _user_pins()
+    if pins is not None:
+        pins.set(USER_PIN_KEY % user_pk, True, window)
+
+
+def pin_if_user_wrote(user_pk):
+    """Pin the current request if the user wrote recently, see pin_user"""
+    pins = _user_pins()
+    if pins is not None and not is_pinned() and \
+            pins.get(USER_PIN_KEY % user_pk):
+        pin_to_primary()
+
+
+def record_latency(alias, seconds):
+    """Feed the moving average used by the least latency strategy"""
+    with _latency_lock:
+        previous = _latency.get(alias)
+        if previous is None:
+            _latency[alias] = seconds
+        else:
+            _latency[alias] = (
+                LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * previous
+            )
+
+
+def get_latencies():
+    with _latency_lock:
+        return dict(_latency)
+
+
+def track_replica_latency(sender, connection, **kwargs):
+    """connection_created receiver timing the queries sent to replicas"""
+    if connection.alias not in getattr(settings, 'DATABASE_REPLICAS', ()):
+        return
+    # connection_created fires on every (re)connect of the same wrapper
+    if getattr(connection, '_latency_tracked', False):
+        return
+    connection._latency_tracked = True
+
+    def timed(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            record_latency(connection.alias, time.perf_counter() - start)
+
+    connection.execute_wrappers.append(timed)
+
+
+def _routed_tables():
+    from django.apps import apps
+    return {
+        apps.get_model(app_label, model_name)._meta.db_table
+        for app_label, model_name in REPLICATED_MODELS
+    }
+
+
+def track_primary_writes(sender, connection, **kwargs):
+    """connection_created receiver pinning the request after a write
+
+    Watching the statements catches every kind of write (save, delete,
+    update(), bulk_create...) and only those, where db_for_write is also
+    asked for plain queries such as get_or_create's lookup.
+    """
+    if connection.alias != 'default':
+        return
+    if getattr(connection, '_writes_tracked', False):
+        return
+    connection._writes_tracked = True
+    tables = _routed_tables()
+
+    def tracked(execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE') and \
+                any(table in sql for table in tables):
+            wrote_to_primary()
+        return result
+
+    connection.execute_wrappers.append(tracked)
+
+
+class ReplicaRouter:
+    """Route reads of users and tokens to the read replicas
+
+    Replicas are picked round robin or by lowest observed query latency
+    (DATABASE_REPLICA_STRATEGY). Reads inside a transaction on the primary
+    stay there. Once a request writes one of the routed models, the rest
+    of the request reads from the primary, and
+    ReadYourWritesMiddleware keeps that client on the primary for
+    READ_YOUR_WRITES_WINDOW seconds so it never reads stale data.
+    """
+
+    def __init__(self, replicas=None, strategy=None):
+        if replicas is None:
+            replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if strategy is None:
+            strategy = getattr(
+                settings, 'DATABASE_REPLICA_STRATEGY', 'round_robin'
+            )
+        if strategy not in ('round_robin', 'least_latency'):
+            raise ValueError('Unknown replica strategy %r' % strategy)
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self._cycle = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+
+    def is_routed(self, model):
+        return (model._meta.app_label, model._meta.model_name) in \
+            REPLICATED_MODELS
+
+    def choose_replica(self):
+        if self.strategy == 'least_latency':
+            latencies = get_latencies()
+            # replicas we know nothing about yet get tried first
+            return min(
+                self.replicas, key=lambda alias: latencies.get(alias, 0)
+            )
+        with self._lock:
+            return next(self._cycle)
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or not self.is_routed(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # follow the object we come from (e.g. token.user)
+            return instance._state.db
+        # a transaction must see its own writes, and replicas lag
+        if is_pinned() or connections['default'].in_atomic_block:
+            return 'default'
+        return self.choose_replica()
+
+    def db_for_write(self, model, **hints):
+        # the writes themselves pin, see track_primary_writes
+        if not self.is_routed(model):
+            return None
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        databases = {'default'} | set(self.replicas)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema through replication
+        if db in self.replicas:
+            return False
+        return None
+
+
+# the shards hold copies of these with the same ids, see
+# core.sharding.sync_auth_tables
+SHARED_MODELS = {
+    ('auth', 'group'), ('auth', 'permission'), ('contenttypes', 'contenttype'),
+}
+
+
+class ShardRouter:
+    """Route the users, their tokens and memberships to their shard
+
+    Only objects tell where they belong (through their id, email or token
+    key), so the router places the writes and follows the object hints;
+    the queries that start from an email, id or key (UserManager,
+    user.tokens, user.authentication...) pick their shard themselves.
+    Anything else falls through to the next router. Does nothing unless
+    USER_SHARDING['SHARDS'] is set.
+    Users may be related to the groups and permissions of any shard, the
+    shards share their ids. Memberships are stored with the user: add them
+    from the user's side (user.groups.add(), not group.user_set.add()).
+    """
+
+    def shard_of(self, instance):
+        db = instance._state.db
+        if db in sharding.get_shards():
+            return db
+        label = (instance._meta.app_label, instance._meta.model_name)
+        if label == ('core', 'user'):
+            if instance.pk is not None:
+                return sharding.shard_for_user_id(instance.pk)
+            if instance.email:
+                return sharding.shard_for_email(instance.email)
+        elif label == ('authtoken', 'token'):
+            # the user comes first, DRF gives new tokens random keys
+            if instance.user_id is not None:
+                return sharding.shard_for_user_id(instance.user_id)
+            return sharding.shard_for_token(instance.key)
+        return None
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is None or not sharding.is_sharded():
+            return None
+        return self.shard_of(instance)
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        shards = sharding.get_shards()
+        if obj1._state.db in shards and obj2._state.db in shards:
+            return obj1._state.db == obj2._state.db or any(
+                (obj._meta.app_label, obj._meta.model_name) in SHARED_MODELS
+                for obj in (obj1, obj2)
+            )
+        return None
+
+
+def collect_metrics():
+    """Gauges of the replica latencies, see core.metrics"""
+    return [
+        ('db_replica_latency_seconds', {'alias': alias}, seconds)
+        for alias, seconds in sorted(get_latencies().items())
+    ]
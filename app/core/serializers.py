@@ -0,0 +1,86 @@
+import threading
+from collections.abc import Mapping
+from operator import attrgetter
+
+from rest_framework import fields as drf_fields
+
+
+def _boolean(value):
+    # same as BooleanField.to_representation for the values models hold
+    return bool(value)
+
+
+# field classes whose to_representation does not depend on the serializer
+# they are bound to, and how to convert their values (None keeps the
+# field's own to_representation)
+COMPILABLE_FIELDS = {
+    drf_fields.CharField: str,
+    drf_fields.EmailField: str,
+    drf_fields.SlugField: str,
+    drf_fields.URLField: str,
+    drf_fields.IntegerField: int,
+    drf_fields.BooleanField: _boolean,
+    drf_fields.ReadOnlyField: None,
+    drf_fields.DateTimeField: None,
+    drf_fields.DateField: None,
+}
+
+
+_compiled = {}
+_compile_lock = threading.Lock()
+
+
+def compile_fields(serializer_class):
+    """Return the (name, getter, convert) accessors of a serializer class
+
+    The fields are introspected once, on a throwaway instance, instead of
+    on every serializer instance. None means the class has a field that
+    can not be compiled and must go through DRF.
+    """
+    try:
+        return _compiled[serializer_class]
+    except KeyError:
+        pass
+    with _compile_lock:
+        accessors = []
+        for field in serializer_class().fields.values():
+            if field.write_only:
+                continue
+            if (type(field) not in COMPILABLE_FIELDS or
+                    field.source == '*' or len(field.source_attrs) != 1):
+                accessors = None
+                break
+            convert = COMPILABLE_FIELDS[type(field)]
+            accessors.append((
+                field.field_name,
+                attrgetter(field.source),
+                convert or field.to_representation,
+            ))
+        _compiled[serializer_class] = (
+            tuple(accessors) if accessors is not None else None
+        )
+    return _compiled[serializer_class]
+
+
+class CompiledReadMixin:
+    """Serialize instances through accessors compiled once per class
+
+    Only used when reading an instance with the fields the class declares,
+    a serializer whose fields were looked at or changed (validation,
+    dynamic field selection, ...) goes through DRF as usual.
+    """
+    compiled_read = True
+
+    def to_representation(self, instance):
+        if (not self.compiled_read or hasattr(self, '_fields') or
+                isinstance(instance, Mapping)):
+            return super().to_representation(instance)
+        accessors = compile_fields(type(self))
+        if accessors is None:
+            return super().to_representation(instance)
+
+        ret = {}
+        for name, getter, convert in accessors:
+            value = getter(instance)
+            ret[name] = None if value is None else convert(value)
+        return ret
@@ -0,0 +1,133 @@
+import os
+import signal
+import threading
+import time
+
+from django.core.servers.basehttp import ThreadedWSGIServer, \
+                                        WSGIRequestHandler
+from django.db import connections
+
+
+def close_connections():
+    """Close the DB connections (and pools) a forked child must not share"""
+    connections.close_all()
+    try:
+        from core.db.backends.postgresql_pool.base import get_pools
+    except ImportError:
+        # psycopg2 is not installed
+        return
+    for _, pool in get_pools():
+        pool.close_all()
+
+
+class WorkerWSGIServer(ThreadedWSGIServer):
+    """The threaded server of runserver, finishing its requests on exit"""
+    # a stopping worker waits for the request threads instead of killing
+    # them half way, see PreforkServer._drain
+    daemon_threads = False
+    # socketserver would keep every thread to join them, unbounded
+    block_on_close = False
+
+
+class PreforkServer:
+    """Serves a WSGI application from `workers` forked processes
+
+    The application is loaded once, before forking, so the workers share
+    its memory and start answering right away. Each worker accepts on the
+    same listening socket and handles its requests in threads. A worker
+    that dies is replaced, a stopping one finishes its requests in flight
+    for up to `graceful_timeout` seconds.
+
+    The workers use django's basehttp (wsgiref) server, which django does
+    not recommend for production: it has no limit on the request size or
+    duration and a thread is held by every slow client. Keep it behind a
+    reverse proxy buffering the requests (nginx...), or serve app.wsgi
+    with gunicorn where that matters.
+    """
+
+    def __init__(self, application, host, port, workers, stdout=None,
+                 graceful_timeout=8):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.stdout = stdout
+        self.graceful_timeout = graceful_timeout
+        self.children = set()
+        self._stopping = False
+        self._server = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def _log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def start(self):
+        """Bind the socket and fork the workers"""
+        self._server = WorkerWSGIServer(
+            (self.host, self.port), WSGIRequestHandler,
+            ipv6=':' in self.host,
+        )
+        self._server.set_app(self.application)
+        # the children would otherwise share the connections of the parent
+        close_connections()
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return
+        # in the worker
+        status = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda *args: threading.Thread(
+                target=self._server.shutdown
+            ).start())
+            self._server.serve_forever()
+            self._drain()
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _drain(self):
+        """Wait for the request threads of a stopping worker"""
+        deadline = time.monotonic() + self.graceful_timeout
+        for thread in threading.enumerate():
+            # the pools and the task worker use daemon threads
+            if thread is threading.current_thread() or thread.daemon:
+                continue
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def serve(self):
+        """Wait for the workers, replacing the ones that die, until stop()"""
+        while self.children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            self.children.discard(pid)
+            if not self._stopping:
+                self._log('Worker %d exited, starting a new one' % pid)
+                # a worker crashing on boot should not spin the CPU
+                time.sleep(0.1)
+                self._spawn()
+
+    def stop(self, *args):
+        """Ask the workers to exit, serve() returns once they did"""
+        self._stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.discard(pid)
+
+    def close(self):
+        if self._server is not None:
+            self._server.server_close()
@@ -0,0 +1,533 @@
+import functools
+import hashlib
+import heapq
+import threading
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+
+DEFAULT_USER_SHARDING = {
+    # aliases of the databases the users are spread over, no sharding when
+    # empty. The aliases are the identity of the shards: renaming one moves
+    # its users somewhere else.
+    'SHARDS': [],
+    # user ids reserved per round trip to the IdSequence table
+    'ID_BLOCK_SIZE': 100,
+}
+
+# the emails hash to one of BUCKETS buckets and the buckets are spread over
+# the shards. The bucket of a user is also the low byte of their id and the
+# first two hex digits of their token, so a user can be found from any of
+# the three. Changing it changes every bucket.
+BUCKETS = 256
+
+
+def sharding_settings():
+    """Return settings.USER_SHARDING with its defaults filled in"""
+    conf = dict(DEFAULT_USER_SHARDING)
+    conf.update(getattr(settings, 'USER_SHARDING', {}))
+    return conf
+
+
+def get_shards():
+    return list(sharding_settings()['SHARDS'])
+
+
+def is_sharded():
+    return bool(sharding_settings()['SHARDS'])
+
+
+def _stable_hash(value):
+    # hash() is salted per process, the buckets must not be
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], 'big')
+
+
+def email_bucket(email):
+    """Return the bucket of an email
+
+    The email is normalized the way UserManager stores it, and lowercased
+    since the logins ignore its case.
+    """
+    from core.models import UserManager
+    return _stable_hash(UserManager.normalize_email(email).lower()) % BUCKETS
+
+
+def id_bucket(user_id):
+    return int(user_id) % BUCKETS
+
+
+def key_bucket(key):
+    """Return the bucket a token key starts with, None if it is malformed"""
+    try:
+        bucket = int(key[:2], 16)
+    except (TypeError, ValueError):
+        return None
+    return bucket if len(key) > 2 else None
+
+
+@functools.lru_cache(maxsize=None)
+def _owner(shards, bucket):
+    # rendezvous hashing, adding or removing a shard only moves the buckets
+    # it gains or loses
+    return max(shards, key=lambda alias: _stable_hash('%s:%d' % (alias,
+                                                                 bucket)))
+
+
+def shard_for_bucket(bucket):
+    """Return the alias of the shard holding a bucket, None if unsharded"""
+    shards = sharding_settings()['SHARDS']
+    if not shards or bucket is None:
+        return None
+    return _owner(tuple(shards), bucket)
+
+
+def shard_for_email(email):
+    if not is_sharded():
+        return None
+    return shard_for_bucket(email_bucket(email))
+
+
+def shard_for_user_id(user_id):
+    if not is_sharded() or user_id is None:
+        return None
+    return shard_for_bucket(id_bucket(user_id))
+
+
+def shard_for_token(key):
+    if not is_sharded():
+        return None
+    return shard_for_bucket(key_bucket(key))
+
+
+def token_key(user_id, key):
+    """Return key carrying the bucket of user_id, unchanged if unsharded"""
+    if not is_sharded() or user_id is None:
+        return key
+    return '%02x%s' % (id_bucket(user_id), key[2:])
+
+
+def reserve_ids(name, count, using='default', start=1):
+    """Reserve count values of the IdSequence name, return (first, end)
+
+    The sequence is created on first use with `start` (a callable) as its
+    first value. The row stays locked until the transaction commits, a
+    reservation made in a longer transaction serializes the others.
+    """
+    from core.models import IdSequence
+    sequences = IdSequence.objects.using(using)
+    with transaction.atomic(using=using):
+        reserved = sequences.filter(name=name).update(
+            next_value=F('next_value') + count
+        )
+        if not reserved:
+            first = start()
+            try:
+                with transaction.atomic(using=using):
+                    sequences.create(name=name, next_value=first + count)
+            except IntegrityError:
+                # created by a concurrent process meanwhile
+                sequences.filter(name=name).update(
+                    next_value=F('next_value') + count
+                )
+        end = sequences.values_list('next_value', flat=True).get(name=name)
+    return end - count, end
+
+
+class IdAllocator:
+    """Hands out the values of an IdSequence, reserving blocks of them"""
+
+    def __init__(self, name, block_size, start=lambda: 1, reserve=None):
+        self.name = name
+        self.block_size = block_size
+        self.start = start
+        self._reserve = reserve or reserve_ids
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve(
+                    self.name, self.block_size, start=self.start
+                )
+            value = self._next
+            self._next += 1
+            return value
+
+
+def _first_user_sequence():
+    # the users created before sharding keep their ids, start past them
+    User = get_user_model()
+    highest = max(
+        User.objects.using(alias).order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        for alias in set(get_shards()) | {'default'}
+    )
+    return highest // BUCKETS + 1
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_id_allocator():
+    """Return the process wide allocator of the user ids"""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = IdAllocator(
+                'core.user', sharding_settings()['ID_BLOCK_SIZE'],
+                start=_first_user_sequence,
+            )
+        return _allocator
+
+
+@receiver(setting_changed)
+def reset_id_allocator(**kwargs):
+    """Drop the allocator when the tests override the sharding settings"""
+    global _allocator
+    if kwargs['setting'] == 'USER_SHARDING':
+        with _allocator_lock:
+            _allocator = None
+
+
+def new_user_id(email):
+    """Return the id of a new user, None to let the database pick it
+
+    Sharded user ids are unique across the shards and end with the bucket
+    of the email: id = sequence * BUCKETS + bucket.
+    """
+    if not is_sharded():
+        return None
+    return get_id_allocator().next() * BUCKETS + email_bucket(email)
+
+
+def is_misplaced(user, alias):
+    """Return True if the user stored in alias belongs somewhere else
+
+    Users created before sharding have ids that don't end with their
+    bucket, they are misplaced wherever they are.
+    """
+    bucket = email_bucket(user.email)
+    return id_bucket(user.pk) != bucket or shard_for_bucket(bucket) != alias
+
+
+def fan_out(queryset):
+    """Return the querysets running queryset on every shard
+
+    Unsharded, that is queryset alone.
+    """
+    shards = get_shards()
+    if not shards:
+        return [queryset]
+    return [queryset.using(alias) for alias in shards]
+
+
+class MergedQuerySet:
+    """The same query on several databases, merged by its ordering
+
+    Covers what the keyset pagination does with a queryset: order_by(),
+    filter() and slicing, every database returning up to the end of the
+    slice. The ordering fields all go the same direction.
+    """
+
+    def __init__(self, querysets, ordering=()):
+        self.querysets = querysets
+        self.ordering = tuple(ordering)
+        self.model = querysets[0].model
+
+    def _chain(self, method, *args, **kwargs):
+        return type(self)(
+            [getattr(queryset, method)(*args, **kwargs)
+             for queryset in self.querysets],
+            self.ordering,
+        )
+
+    def filter(self, *args, **kwargs):
+        return self._chain('filter', *args, **kwargs)
+
+    def order_by(self, *fields):
+        merged = self._chain('order_by', *fields)
+        merged.ordering = fields
+        return merged
+
+    def _merge(self, iterables):
+        names = [field.lstrip('-') for field in self.ordering]
+        return heapq.merge(
+            *iterables,
+            key=lambda obj: tuple(getattr(obj, name) for name in names),
+            reverse=bool(self.ordering) and self.ordering[0].startswith('-')
+        )
+
+    def __iter__(self):
+        return self._merge(self.querysets)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.stop is None:
+            raise TypeError('MergedQuerySet only supports bounded slices')
+        return list(islice(
+            self._merge(queryset[:item.stop] for queryset in self.querysets),
+            item.start, item.stop,
+        ))
+
+
+# The auth tables are shared by the whole site: they live on AUTH_DATABASE,
+# where the admin edits them, and every shard holds a copy with the same
+# ids. The group and permission memberships are stored with the users on
+# their shard and point to those copies.
+AUTH_DATABASE = 'default'
+
+
+def _mirrors():
+    return [alias for alias in get_shards() if alias != AUTH_DATABASE]
+
+
+def check_auth_tables(alias):
+    """Copy the content types and permissions of AUTH_DATABASE to alias
+
+    Databases migrated from the same code create them with the same ids,
+    a shard that differs is only rewritten while it has no user, otherwise
+    ValueError is raised.
+    """
+    from django.contrib.auth.models import Permission
+    from django.contrib.contenttypes.models import ContentType
+
+    tables = ((ContentType, ('id', 'app_label', 'model')),
+              (Permission, ('id', 'content_type_id', 'codename')))
+    if all(
+        set(model.objects.using(AUTH_DATABASE).values_list(*fields)) <=
+        set(model.objects.using(alias).values_list(*fields))
+        for model, fields in tables
+    ):
+        return
+    if get_user_model().objects.using(alias).exists():
+        raise ValueError(
+            'The content types or permissions of %r differ from the ones '
+            'of %r and it already holds users' % (alias, AUTH_DATABASE)
+        )
+    with transaction.atomic(using=alias):
+        Permission.objects.using(alias).all().delete()
+        ContentType.objects.using(alias).all().delete()
+        for model, _ in tables:
+            model.objects.using(alias).bulk_create(
+                model.objects.using(AUTH_DATABASE).all()
+            )
+    ContentType.objects.clear_cache()
+
+
+def mirror_groups(alias, pks=None):
+    """Make the groups (all or pks) of alias those of AUTH_DATABASE"""
+    from django.contrib.auth.models import Group
+
+    groups = Group.objects.using(AUTH_DATABASE)
+    mirrored = Group.objects.using(alias)
+    through = Group.permissions.through.objects
+    if pks is not None:
+        groups = groups.filter(pk__in=pks)
+        mirrored = mirrored.filter(pk__in=pks)
+    rows = dict(groups.values_list('pk', 'name'))
+    with transaction.atomic(using=alias):
+        # deleted groups, or ones renamed out of the way
+        mirrored.exclude(pk__in=rows).delete()
+        Group.objects.using(alias).filter(name__in=rows.values()).exclude(
+            pk__in=rows
+        ).delete()
+        existing = dict(mirrored.values_list('pk', 'name'))
+        for pk, name in rows.items():
+            if pk not in existing:
+                Group.objects.using(alias).create(pk=pk, name=name)
+            elif existing[pk] != name:
+                Group.objects.using(alias).filter(pk=pk).update(name=name)
+        through.using(alias).filter(group_id__in=rows).delete()
+        through.using(alias).bulk_create([
+            Group.permissions.through(group_id=group_id,
+                                      permission_id=permission_id)
+            for group_id, permission_id in through.using(
+                AUTH_DATABASE
+            ).filter(group_id__in=rows).values_list(
+                'group_id', 'permission_id'
+            )
+        ])
+
+
+def sync_auth_tables(alias):
+    """Bring the copy of the auth tables of a shard up to date"""
+    if alias != AUTH_DATABASE:
+        check_auth_tables(alias)
+        mirror_groups(alias)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def mirror_changed_group(sender, instance, using, **kwargs):
+    """Copy the groups the admin changes to the shards"""
+    if using == AUTH_DATABASE and not kwargs.get('raw'):
+        for alias in _mirrors():
+            mirror_groups(alias, [instance.pk])
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def mirror_group_permissions(sender, instance, action, reverse, pk_set,
+                             using, **kwargs):
+    if using != AUTH_DATABASE or not action.startswith('post_'):
+        return
+    if reverse:
+        # changed from the permission side, any group may be concerned
+        pks = None
+    else:
+        pks = [instance.pk]
+    for alias in _mirrors():
+        mirror_groups(alias, pks)
+
+
+def move_users(user_ids, source, target):
+    """Move users of source to target with their tokens
+
+    Returns (moved, conflicts), the number of users moved and the ids of
+    the users left on source because another account of the target has
+    their email (email uniqueness is only enforced within a shard).
+
+    Users keep their id and tokens unless the id does not match their
+    bucket, they then get a new id and their tokens a new key (they have to
+    log in again). Their group and permission memberships and the admin
+    log of their actions go with them, the shards share the ids of groups
+    and permissions (see sync_auth_tables).
+    The users are locked while they move, writes made meanwhile wait for
+    the move and find them gone. The target commits before the source:
+    the users an interrupted run already copied are only deleted from the
+    source by the next one, which recognizes them by their id or token.
+    """
+    from django.contrib.admin.models import LogEntry
+    from rest_framework.authtoken.models import Token
+    from user.tokens import new_key
+
+    User = get_user_model()
+    groups = User.groups.through
+    permissions = User.user_permissions.through
+
+    def copy(model, instance, **fields):
+        values = {field.attname: getattr(instance, field.attname)
+                  for field in model._meta.concrete_fields}
+        values.update(fields)
+        return model(**values)
+
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        users = [
+            user for user in User.objects.using(
+                source
+            ).select_for_update().filter(pk__in=user_ids).order_by('pk')
+            # the email may have changed since the user was picked
+            if is_misplaced(user, source) and
+            shard_for_email(user.email) == target
+        ]
+        old_ids = [user.pk for user in users]
+        tokens = list(Token.objects.using(source).select_for_update().filter(
+            user_id__in=old_ids
+        ))
+        memberships = [
+            list(through.objects.using(source).filter(user_id__in=old_ids))
+            for through in (groups, permissions)
+        ]
+        entries = list(LogEntry.objects.using(source).filter(
+            user_id__in=old_ids
+        ))
+        new_ids = {
+            user.pk: (
+                user.pk if id_bucket(user.pk) == email_bucket(user.email)
+                else new_user_id(user.email)
+            )
+            for user in users
+        }
+
+        conflicts = []
+        if source == target:
+            # only the id changes, the email has to be free again first
+            User.objects.using(source).filter(pk__in=old_ids).delete()
+            copied = set(old_ids)
+            moved = copied
+        else:
+            existing = {
+                user.email: user.pk for user in User.objects.using(
+                    target
+                ).filter(email__in=[user.email for user in users])
+            }
+            existing_keys = set(Token.objects.using(target).filter(
+                user_id__in=existing.values()
+            ).values_list('key', flat=True))
+            copied, moved = set(), set()
+            for user in users:
+                if user.email not in existing:
+                    copied.add(user.pk)
+                    moved.add(user.pk)
+                elif existing[user.email] == user.pk or any(
+                        token.key in existing_keys for token in tokens
+                        if token.user_id == user.pk):
+                    # copied by an interrupted run
+                    moved.add(user.pk)
+                else:
+                    conflicts.append(user.pk)
+
+        User.objects.using(target).bulk_create([
+            copy(User, user, id=new_ids[user.pk])
+            for user in users if user.pk in copied
+        ])
+        Token.objects.using(target).bulk_create([
+            copy(Token, token, user_id=new_ids[token.user_id], key=(
+                token.key if new_ids[token.user_id] == token.user_id
+                else new_key(new_ids[token.user_id])
+            ))
+            for token in tokens if token.user_id in copied
+        ])
+        for through, rows in zip((groups, permissions), memberships):
+            through.objects.using(target).bulk_create([
+                copy(through, row, id=None, user_id=new_ids[row.user_id])
+                for row in rows if row.user_id in copied
+            ])
+        LogEntry.objects.using(target).bulk_create([
+            copy(LogEntry, entry, id=None, user_id=new_ids[entry.user_id])
+            for entry in entries if entry.user_id in copied
+        ])
+
+        if source != target:
+            # the tokens, memberships and log entries go with them,
+            # post_delete drops the tokens from the caches
+            User.objects.using(source).filter(pk__in=moved).delete()
+    return len(moved), conflicts
+
+
+def rebalance(source, batch_size=500, dry_run=False):
+    """Move the misplaced users of source to their shard, a batch at a time
+
+    Yields (target, count, conflicts) for every group of users moved, see
+    move_users, each batch is moved in its own transactions.
+    """
+    users = get_user_model().objects.using(source).order_by('pk')
+    last = None
+    while True:
+        batch = users if last is None else users.filter(pk__gt=last)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        last = batch[-1].pk
+
+        moves = defaultdict(list)
+        for user in batch:
+            if is_misplaced(user, source):
+                moves[shard_for_email(user.email)].append(user)
+        for target, moved in sorted(moves.items()):
+            count, conflicts = len(moved), []
+            if not dry_run:
+                count, conflicts = move_users(
+                    [user.pk for user in moved], source, target
+                )
+            yield target, count, conflicts
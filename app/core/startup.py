@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from importlib import import_module
+
+from django.conf import settings
+
+
+DEFAULT_SERVE = {
+    'BIND': '0.0.0.0:8000',
+    # worker processes forked by "manage.py serve", 0 is one per CPU
+    'WORKERS': 0,
+    # seconds a stopping worker waits for its requests in flight, below
+    # the 10 seconds docker stop gives before killing the container
+    'GRACEFUL_TIMEOUT': 8,
+    # file remembering the migration state of each database, the next boot
+    # skips migrate when nothing changed
+    'MIGRATION_STATE': os.path.join(
+        tempfile.gettempdir(), 'app-migration-state.json'
+    ),
+}
+
+
+def serve_settings():
+    """Return settings.SERVE with its defaults filled in"""
+    conf = dict(DEFAULT_SERVE)
+    conf.update(getattr(settings, 'SERVE', {}))
+    return conf
+
+
+class StartupTimer:
+    """Times the named phases of a boot, in order"""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.phases.append((name, self._clock() - start))
+
+    @property
+    def total(self):
+        return sum(elapsed for _, elapsed in self.phases)
+
+    def report(self):
+        """Return the lines of the breakdown, the slowest phase marked"""
+        slowest = max(self.phases, key=lambda phase: phase[1], default=None)
+        lines = [
+            '%-16s %8.1f ms%s' % (
+                name, elapsed * 1000,
+                '  <- slowest' if (name, elapsed) == slowest else '',
+            )
+            for name, elapsed in self.phases
+        ]
+        lines.append('%-16s %8.1f ms' % ('total', self.total * 1000))
+        return lines
+
+
+def migration_files_fingerprint():
+    """Return a hash of the migration files of every installed app"""
+    from django.apps import apps
+    from django.db.migrations.loader import MigrationLoader
+
+    digest = hashlib.sha256()
+    for app_config in apps.get_app_configs():
+        module_name, _ = MigrationLoader.migrations_module(app_config.label)
+        if module_name is None:
+            continue
+        try:
+            # only the package, not the migrations themselves
+            module = import_module(module_name)
+        except ImportError:
+            continue
+        if getattr(module, '__file__', None) is None:
+            continue
+        directory = os.path.dirname(module.__file__)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.py'):
+                continue
+            digest.update(('%s/%s\0' % (app_config.label, name)).encode())
+            with open(os.path.join(directory, name), 'rb') as migration:
+                digest.update(migration.read())
+    return digest.hexdigest()
+
+
+def applied_migrations(connection):
+    """Return how many migrations are recorded as applied, None if none"""
+    from django.db.migrations.recorder import MigrationRecorder
+
+    recorder = MigrationRecorder(connection)
+    if not recorder.has_table():
+        return None
+    return recorder.migration_qs.count()
+
+
+def _load_state(path):
+    try:
+        with open(path) as state:
+            return json.load(state)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(path, state):
+    try:
+        with open(path, 'w') as out:
+            json.dump(state, out)
+    except OSError:
+        # a read only file system only costs a migration check per boot
+        pass
+
+
+def ensure_migrated(using, state_path, migrate):
+    """Apply the pending migrations of a database, return what was done
+
+    The migration graph is only loaded (which imports every migration)
+    when the migration files or the number of applied migrations changed
+    since the last boot, otherwise the check is one query. Returns
+    'skipped', 'up to date' or 'migrated'.
+
+    Migrations flagged `run_on_boot = False` (ones locking a big table,
+    left to run by hand) are not applied, nor anything planned after them.
+    The result then names the first of them and the next boot checks
+    again. migrate(using, targets) applies the migrations, targets being
+    the (app_label, name) to migrate to, None for all of them.
+    """
+    from django.db import connections
+    from django.db.migrations.executor import MigrationExecutor
+
+    connection = connections[using]
+    fingerprint = migration_files_fingerprint()
+    state = _load_state(state_path)
+    current = {
+        'fingerprint': fingerprint,
+        'applied': applied_migrations(connection),
+    }
+    # an empty database has nothing applied, it is never skipped
+    if current['applied'] and state.get(using) == current:
+        return 'skipped'
+
+    executor = MigrationExecutor(connection)
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    manual = next((
+        index for index, (migration, _) in enumerate(plan)
+        if not getattr(migration, 'run_on_boot', True)
+    ), None)
+    if manual is None:
+        if plan:
+            migrate(using, None)
+    elif manual:
+        # each app up to its last migration before the manual one
+        targets = {}
+        for migration, _ in plan[:manual]:
+            targets[migration.app_label] = migration.name
+        migrate(using, sorted(targets.items()))
+    done = 'migrated' if plan[:manual] else 'up to date'
+    if manual is not None:
+        # not remembered, so every boot reminds of it
+        migration = plan[manual][0]
+        return '%s, %s.%s left to apply by hand' % (
+            done, migration.app_label, migration.name,
+        )
+    current['applied'] = applied_migrations(connection)
+    state[using] = current
+    _save_state(state_path, state)
+    return done
+
+
+def _measure():
+    """Time the boot phases of a fresh interpreter, print them as JSON"""
+    timer = StartupTimer()
+    with timer.phase('import'):
+        import django
+        from django.core.handlers.wsgi import WSGIHandler
+        from django.urls import get_resolver
+    with timer.phase('settings'):
+        from django.conf import settings as lazy_settings
+        lazy_settings.INSTALLED_APPS
+    with timer.phase('app registry'):
+        django.setup(set_prefix=False)
+    with timer.phase('url resolver'):
+        # imports the urlconfs and their views, builds the reverse map
+        get_resolver().reverse_dict
+    with timer.phase('middleware'):
+        WSGIHandler()
+    json.dump(timer.phases, sys.stdout)
+
+
+def measure_startup():
+    """Return a StartupTimer with the boot phases of a new process
+
+    The current process is already set up, a fresh interpreter with the
+    same settings and path is timed instead.
+    """
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+    env['PYTHONPATH'] = os.pathsep.join(
+        path for path in [settings.BASE_DIR, env.get('PYTHONPATH')] if path
+    )
+    script = 'from core.startup import _measure; _measure()'
+    output = subprocess.check_output(
+        [sys.executable, '-c', script], env=env, cwd=settings.BASE_DIR,
+    )
+    timer = StartupTimer()
+    timer.phases = [tuple(phase) for phase in json.loads(output.decode())]
+    return timer
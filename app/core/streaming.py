@@ -0,0 +1,116 @@
+import codecs
+import json
+import re
+
+
+_decoder = json.JSONDecoder()
+# the whitespace JSON allows between tokens
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def _iter_text(stream, chunk_size):
+    """Read a byte stream chunk by chunk and decode it as utf-8"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_json_records(stream, chunk_size=64 * 1024, max_record_size=1 << 20):
+    """Yield the items of a JSON array or NDJSON byte stream one at a time
+
+    Only one record (plus the unread part of the current chunk) is kept in
+    memory, so the size of the payload does not matter.
+    """
+    chunks = _iter_text(stream, chunk_size)
+    buffer = ''
+    # sniff the format from the first non blank character
+    for chunk in chunks:
+        buffer = (buffer + chunk).lstrip()
+        if buffer:
+            break
+    if not buffer:
+        return
+
+    if buffer[0] == '[':
+        records = _iter_array(buffer[1:], chunks, max_record_size)
+    else:
+        records = _iter_lines(buffer, chunks, max_record_size)
+    for record in records:
+        yield record
+
+
+def _iter_array(buffer, chunks, max_record_size):
+    """Incrementally parse the items of a JSON array
+
+    The parsed records are skipped with an offset instead of copying the
+    rest of the buffer after each of them, the buffer is only compacted
+    when the next chunk is appended.
+    """
+    expect_value = True
+    first = True
+    pos = 0
+    while True:
+        pos = _whitespace.match(buffer, pos).end()
+        if pos == len(buffer):
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Unexpected end of JSON array')
+            buffer, pos = chunk, 0
+            continue
+
+        if not expect_value:
+            if buffer[pos] == ']':
+                return
+            if buffer[pos] != ',':
+                raise ValueError('Expected "," or "]" in JSON array')
+            pos += 1
+            expect_value = True
+            continue
+
+        if first and buffer[pos] == ']':
+            return
+
+        try:
+            record, end = _decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # most likely the record is split across two chunks
+            chunk = next(chunks, None)
+            if chunk is None or len(buffer) - pos > max_record_size:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield record
+        pos = end
+        expect_value = False
+        first = False
+
+
+def _iter_lines(buffer, chunks, max_record_size):
+    """Parse newline delimited JSON, one record per line"""
+    while True:
+        lines = buffer.split('\n')
+        # the last piece may be an incomplete line
+        buffer = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+        if len(buffer) > max_record_size:
+            raise ValueError('NDJSON record too large')
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        buffer += chunk
+
+    if buffer.strip():
+        yield json.loads(buffer)
@@ -0,0 +1,408 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TASKS = {
+    # 'sqlite' keeps the queue in the file at PATH, 'memory' in the process
+    'BROKER': 'sqlite',
+    'PATH': 'tasks.sqlite3',
+    # start a worker thread in the process enqueueing the tasks, instead of
+    # (or on top of) running the run_tasks command
+    'WORKER_THREAD': False,
+    'BATCH_SIZE': 100,
+    # seconds a worker owns the messages it reserved, if it dies they are
+    # delivered again once the lease is over
+    'LEASE': 300,
+    # a failing message is retried after RETRY_DELAY * 2 ** attempts
+    'MAX_RETRIES': 5,
+    'RETRY_DELAY': 10,
+    'POLL_INTERVAL': 1,
+}
+
+
+def tasks_settings():
+    """Return settings.TASKS with its defaults filled in"""
+    conf = dict(DEFAULT_TASKS)
+    conf.update(getattr(settings, 'TASKS', {}))
+    return conf
+
+
+Message = namedtuple('Message', 'id name payload attempts')
+
+
+class MemoryBroker:
+    """Queue kept in the memory of the process, lost when it exits"""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ids = 0
+        # id -> [name, payload, attempts, available_at, locked_until]
+        self._messages = OrderedDict()
+        self._dead = {}
+
+    def push(self, name, payload):
+        with self._lock:
+            self._ids += 1
+            self._messages[self._ids] = [name, payload, 0, 0, 0]
+
+    def reserve(self, limit, lease):
+        now = self._clock()
+        reserved = []
+        with self._lock:
+            for message_id, entry in self._messages.items():
+                if len(reserved) >= limit:
+                    break
+                name, payload, attempts, available_at, locked_until = entry
+                if available_at <= now and locked_until <= now:
+                    entry[4] = now + lease
+                    reserved.append(
+                        Message(message_id, name, payload, attempts)
+                    )
+        return reserved
+
+    def ack(self, ids):
+        with self._lock:
+            for message_id in ids:
+                self._messages.pop(message_id, None)
+
+    def retry(self, ids, delay):
+        now = self._clock()
+        with self._lock:
+            for message_id in ids:
+                entry = self._messages[message_id]
+                entry[2] += 1
+                entry[3] = now + delay
+                entry[4] = 0
+
+    def bury(self, ids):
+        """Move messages that keep failing out of the queue"""
+        with self._lock:
+            for message_id in ids:
+                self._dead[message_id] = self._messages.pop(message_id)
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._messages), 'dead': len(self._dead)}
+
+
+class SQLiteBroker:
+    """Durable queue in a SQLite file shared by the processes of one host
+
+    Messages are only deleted once a worker acknowledged them, so each one
+    is delivered at least once (and more than once if a worker dies
+    half-way through, the tasks have to be idempotent).
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS task_queue ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' name TEXT NOT NULL,'
+                ' payload TEXT NOT NULL,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' available_at REAL NOT NULL,'
+                ' locked_until REAL NOT NULL DEFAULT 0,'
+                ' dead INTEGER NOT NULL DEFAULT 0)'
+            )
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS task_queue_ready '
+                'ON task_queue (dead, available_at)'
+            )
+
+    def _connection(self):
+        # sqlite3 connections can not be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+            )
+        return _Transaction(db)
+
+    def push(self, name, payload):
+        with self._connection() as db:
+            db.execute(
+                'INSERT INTO task_queue (name, payload, available_at) '
+                'VALUES (?, ?, ?)',
+                (name, json.dumps(payload), self._clock()),
+            )
+
+    def reserve(self, limit, lease):
+        now = self._clock()
+        with self._connection() as db:
+            rows = db.execute(
+                'SELECT id, name, payload, attempts FROM task_queue '
+                'WHERE dead = 0 AND available_at <= ? AND locked_until <= ? '
+                'ORDER BY id LIMIT ?',
+                (now, now, limit),
+            ).fetchall()
+            db.executemany(
+                'UPDATE task_queue SET locked_until = ? WHERE id = ?',
+                [(now + lease, row[0]) for row in rows],
+            )
+        return [
+            Message(message_id, name, json.loads(payload), attempts)
+            for message_id, name, payload, attempts in rows
+        ]
+
+    def ack(self, ids):
+        with self._connection() as db:
+            db.executemany(
+                'DELETE FROM task_queue WHERE id = ?',
+                [(message_id,) for message_id in ids],
+            )
+
+    def retry(self, ids, delay):
+        with self._connection() as db:
+            db.executemany(
+                'UPDATE task_queue SET attempts = attempts + 1,'
+                ' available_at = ?, locked_until = 0 WHERE id = ?',
+                [(self._clock() + delay, message_id) for message_id in ids],
+            )
+
+    def bury(self, ids):
+        """Flag messages that keep failing, they stay in the file"""
+        with self._connection() as db:
+            db.executemany(
+                'UPDATE task_queue SET dead = 1 WHERE id = ?',
+                [(message_id,) for message_id in ids],
+            )
+
+    def stats(self):
+        with self._connection() as db:
+            counts = dict(db.execute(
+                'SELECT dead, COUNT(*) FROM task_queue GROUP BY dead'
+            ).fetchall())
+        return {'pending': counts.get(0, 0), 'dead': counts.get(1, 0)}
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT around a block, ROLLBACK on errors"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        # IMMEDIATE takes the write lock up front, two workers can not
+        # reserve the same messages
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+BROKERS = {
+    'memory': lambda conf: MemoryBroker(),
+    'sqlite': lambda conf: SQLiteBroker(conf['PATH']),
+}
+
+_broker = None
+_worker_thread = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the broker of settings.TASKS, creating it on first use"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            conf = tasks_settings()
+            _broker = BROKERS[conf['BROKER']](conf)
+        return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(**kwargs):
+    """Rebuild the broker when the tests override its settings"""
+    global _broker
+    if kwargs['setting'] == 'TASKS':
+        _broker = None
+
+
+# name -> Task, filled by the @task decorator
+TASKS = {}
+
+
+class Task:
+    """A function run by the workers, see @task"""
+
+    def __init__(self, func, name, batch, max_retries):
+        self.func = func
+        self.name = name
+        self.batch = batch
+        self.max_retries = max_retries
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, payload, using=None):
+        """Queue the task once the current transaction commits"""
+        enqueue(self.name, payload, using=using)
+
+
+def task(name=None, batch=False, max_retries=None):
+    """Register a function as a task
+
+    The function receives the JSON payload given to delay(), or the list
+    of the payloads of every queued message of the task when batch=True,
+    which lets it handle many events with a few queries.
+    """
+    def register(func):
+        registered = Task(
+            func, name or '%s.%s' % (func.__module__, func.__name__),
+            batch, max_retries,
+        )
+        TASKS[registered.name] = registered
+        return registered
+    return register
+
+
+def enqueue(name, payload, using=None):
+    """Push a message once the transaction of `using` commits
+
+    Nothing is queued if the transaction is rolled back, and the request
+    does not wait for the task. Outside of a transaction it is pushed
+    right away. A broker failure is logged, not raised: the transaction
+    has committed already, the request must not fail after the fact.
+    """
+    def push():
+        try:
+            get_broker().push(name, payload)
+        except Exception:
+            logger.exception('Could not queue task %s %r', name, payload)
+            return
+        if tasks_settings()['WORKER_THREAD']:
+            start_worker_thread()
+    transaction.on_commit(push, using=using)
+
+
+class Worker:
+    """Runs the queued messages, batching the messages of batch tasks"""
+
+    def __init__(self, broker, batch_size=100, lease=300, max_retries=5,
+                 retry_delay=10):
+        self.broker = broker
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.processed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_settings(cls, broker=None, **overrides):
+        conf = tasks_settings()
+        kwargs = {
+            'batch_size': conf['BATCH_SIZE'],
+            'lease': conf['LEASE'],
+            'max_retries': conf['MAX_RETRIES'],
+            'retry_delay': conf['RETRY_DELAY'],
+        }
+        kwargs.update(overrides)
+        return cls(broker or get_broker(), **kwargs)
+
+    def run_once(self):
+        """Run the messages ready now, return how many were reserved"""
+        messages = self.broker.reserve(self.batch_size, self.lease)
+        by_name = OrderedDict()
+        for message in messages:
+            by_name.setdefault(message.name, []).append(message)
+
+        for name, group in by_name.items():
+            registered = TASKS.get(name)
+            if registered is None:
+                logger.error('Unknown task %s, dropping %d message(s)',
+                             name, len(group))
+                self.broker.bury([message.id for message in group])
+                continue
+            chunks = [group] if registered.batch else [[m] for m in group]
+            for chunk in chunks:
+                self._run(registered, chunk)
+        return len(messages)
+
+    def _run(self, registered, messages):
+        # the worker is long lived, do what the request handler does
+        close_old_connections()
+        try:
+            if registered.batch:
+                registered([message.payload for message in messages])
+            else:
+                registered(messages[0].payload)
+        except Exception:
+            if len(messages) > 1:
+                # one bad message must not hold back the whole batch, run
+                # them one at a time so only the failing ones are retried
+                logger.warning('Batch of %s failed, running its %d '
+                               'messages one by one', registered.name,
+                               len(messages), exc_info=True)
+                for message in messages:
+                    self._run(registered, [message])
+                return
+            logger.exception('Task %s failed', registered.name)
+            self.failed += len(messages)
+            self._failed(registered, messages)
+        else:
+            self.processed += len(messages)
+            self.broker.ack([message.id for message in messages])
+
+    def _failed(self, registered, messages):
+        max_retries = registered.max_retries
+        if max_retries is None:
+            max_retries = self.max_retries
+        # failed batches are split up, this is a single message
+        message, = messages
+        if message.attempts >= max_retries:
+            self.broker.bury([message.id])
+        else:
+            self.broker.retry([message.id],
+                              self.retry_delay * 2 ** message.attempts)
+
+    def run(self, poll_interval=1, stop=None):
+        """Run messages until stop (a threading.Event) is set"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(poll_interval)
+
+
+def start_worker_thread():
+    """Start the in process worker thread, if it is not running yet"""
+    global _worker_thread
+    with _broker_lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return _worker_thread
+        worker = Worker.from_settings(broker=_broker)
+        _worker_thread = threading.Thread(
+            target=worker.run,
+            kwargs={'poll_interval': tasks_settings()['POLL_INTERVAL']},
+            name='task-worker', daemon=True,
+        )
+        _worker_thread.start()
+        return _worker_thread
+
+
+def collect_metrics():
+    """Gauges of the task queue, see core.metrics"""
+    if _broker is None:
+        return []
+    return [
+        ('task_queue_' + key, {}, value)
+        for key, value in _broker.stats().items()
+    ]
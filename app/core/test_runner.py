@@ -0,0 +1,142 @@
+import time
+import unittest
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner, ParallelTestSuite, \
+                              RemoteTestResult, RemoteTestRunner, \
+                              default_test_processes
+from django.test.utils import override_settings
+
+
+DEFAULT_TEST_RUNNER_OPTIONS = {
+    # hasher put first in PASSWORD_HASHERS while the tests run, the
+    # production one (pbkdf2) costs tens of ms per user created or logged
+    # in. None keeps the production hashers.
+    'FAST_HASHER': 'django.contrib.auth.hashers.MD5PasswordHasher',
+    # processes running the tests, each with its own copy of the test
+    # databases. 0 is one per CPU, --parallel overrides it.
+    'PARALLEL': 0,
+    # number of slowest tests reported at the end, 0 disables the report
+    'SLOWEST': 10,
+}
+
+
+def test_runner_settings():
+    """Return settings.TEST_RUNNER_OPTIONS with its defaults filled in"""
+    conf = dict(DEFAULT_TEST_RUNNER_OPTIONS)
+    conf.update(getattr(settings, 'TEST_RUNNER_OPTIONS', {}))
+    return conf
+
+
+class TimedTextTestResult(unittest.TextTestResult):
+    """Records how long each test took, see TestRunner"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # test id -> seconds
+        self.durations = {}
+
+    def startTest(self, test):
+        self._started = time.perf_counter()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        # in parallel runs the worker already reported the duration, the
+        # events replayed here all happen at once
+        self.durations.setdefault(
+            test.id(), time.perf_counter() - self._started
+        )
+        super().stopTest(test)
+
+    def addDuration(self, test, elapsed):
+        self.durations[test.id()] = elapsed
+
+
+class TimedRemoteTestResult(RemoteTestResult):
+    """Sends the duration of each test from a worker to the main process"""
+
+    def startTest(self, test):
+        self._started = time.perf_counter()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        self.events.append((
+            'addDuration', self.test_index,
+            time.perf_counter() - self._started,
+        ))
+        super().stopTest(test)
+
+
+class TimedRemoteTestRunner(RemoteTestRunner):
+    resultclass = TimedRemoteTestResult
+
+
+class TimedParallelTestSuite(ParallelTestSuite):
+    runner_class = TimedRemoteTestRunner
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner with a cheap hasher, parallel runs and timings
+
+    The options default to settings.TEST_RUNNER_OPTIONS, --parallel and
+    --slowest override them for one run.
+    """
+
+    parallel_test_suite = TimedParallelTestSuite
+
+    def __init__(self, slowest=None, **kwargs):
+        super().__init__(**kwargs)
+        conf = test_runner_settings()
+        self.fast_hasher = conf['FAST_HASHER']
+        self.slowest = conf['SLOWEST'] if slowest is None else slowest
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--slowest', type=int, metavar='N',
+            help='Report the N slowest tests, 0 disables the report.',
+        )
+        parser.set_defaults(
+            parallel=test_runner_settings()['PARALLEL'] or
+            default_test_processes(),
+        )
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._hashers = None
+        if self.fast_hasher:
+            # the other hashers still verify the hashes made with them
+            self._hashers = override_settings(PASSWORD_HASHERS=[
+                self.fast_hasher
+            ] + [
+                hasher for hasher in settings.PASSWORD_HASHERS
+                if hasher != self.fast_hasher
+            ])
+            self._hashers.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        if self._hashers is not None:
+            self._hashers.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def get_resultclass(self):
+        return super().get_resultclass() or TimedTextTestResult
+
+    def run_suite(self, suite, **kwargs):
+        result = super().run_suite(suite, **kwargs)
+        durations = getattr(result, 'durations', None)
+        if self.slowest and durations:
+            result.stream.writeln(self.report(durations, self.slowest))
+        return result
+
+    @staticmethod
+    def report(durations, slowest):
+        """Return the text listing the slowest tests of durations"""
+        lines = ['', 'Slowest tests (%.2fs in total):' % sum(
+            durations.values()
+        )]
+        ranked = sorted(durations.items(), key=lambda item: -item[1])
+        for test_id, elapsed in ranked[:slowest]:
+            lines.append('%8.3fs  %s' % (elapsed, test_id))
+        return '\n'.join(lines)
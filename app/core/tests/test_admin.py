@@ -1,25 +1,32 @@
+from unittest.mock import patch
+
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.admin import EstimatedCountPaginator, UserAdmin
+
 
 class AdminSiteTests(TestCase):
-    ''' Set up function, sets things up before tests run'''
-    def setUp(self):
-        self.client = Client()
-        self.admin_user = get_user_model().objects.create_superuser(
+    ''' Set up function, creates the users once for all the tests'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = get_user_model().objects.create_superuser(
             email='admin@gmail.com',
             password='password123'
         )
-        """ use the client to log the user in
-            instead of having to code it ourselves"""
-        self.client.force_login(self.admin_user)
-        self.user = get_user_model().objects.create_user(
+        cls.user = get_user_model().objects.create_user(
             email='test@gmail.com',
             password="password123",
             name="Test user full name"
         )
 
+    def setUp(self):
+        self.client = Client()
+        """ use the client to log the user in
+            instead of having to code it ourselves"""
+        self.client.force_login(self.admin_user)
+
     def test_users_listed(self):
         """Test that users are listed on user page"""
         """ generates the urls to that feature """
@@ -44,3 +51,37 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    @patch.object(UserAdmin, 'list_per_page', 2)
+    def test_users_keyset_pagination(self):
+        """Test the changelist pages with ?after=<id> without counting"""
+        for index in range(3):
+            get_user_model().objects.create_user(
+                email='page%d@gmail.com' % index, password='password123'
+            )
+        url = reverse('admin:core_user_changelist')
+
+        res = self.client.get(url)
+        cl = res.context['cl']
+        self.assertEqual(cl.next_after, self.user.id)
+        self.assertContains(res, '?after=%d' % self.user.id)
+
+        with self.assertNumQueries(4):
+            # session, user, groups filter and the page itself, no COUNT
+            res = self.client.get(url, {'after': cl.next_after})
+        emails = [user.email for user in res.context['cl'].result_list]
+        self.assertEqual(emails, ['page0@gmail.com', 'page1@gmail.com'])
+
+    def test_users_search_by_prefix(self):
+        """Test the search matches the start of the email"""
+        url = reverse('admin:core_user_changelist')
+        res = self.client.get(url, {'q': 'TEST@'})
+
+        self.assertEqual(list(res.context['cl'].result_list), [self.user])
+
+    def test_filtered_count_is_capped(self):
+        """Test the paginator stops counting filtered rows at the cap"""
+        queryset = get_user_model().objects.filter(is_active=True)
+        paginator = EstimatedCountPaginator(queryset, 1)
+        with patch.object(EstimatedCountPaginator, 'count_limit', 1):
+            self.assertEqual(paginator.count, 1)
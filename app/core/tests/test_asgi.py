@@ -0,0 +1,162 @@
+import asyncio
+import json
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.wsgi import get_wsgi_application
+from django.test import (
+    SimpleTestCase, TransactionTestCase, override_settings,
+)
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+
+from core.asgi import ResponseAborted, SendWindow, WsgiToAsgi
+from core.loadtest import LoadRequest, compare
+
+
+# the signups commit, keep their tasks out of the on disk queue
+@override_settings(TASKS={'BROKER': 'memory'})
+class WsgiToAsgiTests(TransactionTestCase):
+    """Test the user API served through the ASGI bridge"""
+
+    def setUp(self):
+        self.application = WsgiToAsgi(get_wsgi_application(), max_workers=2)
+
+    def tearDown(self):
+        self.application.executor.shutdown()
+
+    def call(self, request, chunks=None):
+        """Run a request through the ASGI app, return (status, body)"""
+        chunks = list(chunks or [request.body])
+        messages = []
+
+        async def receive():
+            if not chunks:
+                return {'type': 'http.disconnect'}
+            body = chunks.pop(0)
+            return {'type': 'http.request', 'body': body,
+                    'more_body': bool(chunks)}
+
+        async def send(message):
+            messages.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                self.application(request.scope(), receive, send)
+            )
+        finally:
+            loop.close()
+
+        body = b''.join(m.get('body', b'') for m in messages[1:])
+        self.assertFalse(messages[-1].get('more_body', False))
+        return messages[0]['status'], body
+
+    def test_create_token_and_me(self):
+        """Test the three user endpoints work over ASGI"""
+        payload = {'email': 'asgi@gmail.com', 'password': 'testpass'}
+        request = LoadRequest.json(
+            'POST', reverse('user:create'), dict(payload, name='Asgi')
+        )
+        body = request.body
+        # the body may arrive in several messages
+        status, _ = self.call(request, [body[:10], body[10:]])
+        self.assertEqual(status, 201)
+
+        status, body = self.call(
+            LoadRequest.json('POST', reverse('user:token'), payload)
+        )
+        self.assertEqual(status, 200)
+        token = json.loads(body.decode())['token']
+
+        status, body = self.call(LoadRequest(
+            'GET', reverse('user:me'), {'Authorization': 'Token ' + token}
+        ))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode())['email'], payload['email'])
+
+    def test_unauthorized(self):
+        """Test errors are passed through with their status"""
+        status, _ = self.call(LoadRequest('GET', reverse('user:me')))
+        self.assertEqual(status, 401)
+
+
+class SlowClientTests(SimpleTestCase):
+
+    def test_slow_clients_do_not_hold_the_threads(self):
+        """Test the pool thread is free before the client read the body"""
+        def wsgi_application(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'ok']
+
+        application = WsgiToAsgi(wsgi_application, max_workers=1)
+        self.addCleanup(application.executor.shutdown)
+        bodies = []
+
+        async def call():
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                if message['type'] == 'http.response.body':
+                    await asyncio.sleep(0.2)
+                    bodies.append(message['body'])
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/'}
+            await application(scope, receive, send)
+
+        async def main():
+            await asyncio.gather(*[call() for _ in range(4)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.perf_counter()
+            loop.run_until_complete(main())
+            elapsed = time.perf_counter() - start
+        finally:
+            loop.close()
+
+        self.assertEqual(bodies.count(b'ok'), 4)
+        # one thread waiting on each client in turn would take 4 * 0.4s
+        self.assertLess(elapsed, 1)
+
+    def test_send_window_waits_for_the_client(self):
+        """Test the thread waits once a client is a window behind"""
+        window = SendWindow(10)
+        window.acquire(8)
+        acquired = threading.Event()
+
+        def produce():
+            window.acquire(8)
+            acquired.set()
+
+        thread = threading.Thread(target=produce)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        window.release(8)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+        window.close()
+        with self.assertRaises(ResponseAborted):
+            window.acquire(1)
+
+
+@override_settings(TASKS={'BROKER': 'memory'})
+class LoadTestHarnessTests(TransactionTestCase):
+
+    def test_compare_modes(self):
+        """Test the harness reports both modes for every scenario"""
+        results = compare(
+            get_wsgi_application(), requests=3, clients=2, workers=2,
+            names=('me',),
+        )
+
+        for mode in ('wsgi', 'asgi'):
+            self.assertEqual(results['me'][mode]['requests'], 3)
+            self.assertEqual(results['me'][mode]['errors'], 0)
+            self.assertGreater(results['me'][mode]['rps'], 0)
+        self.assertTrue(Token.objects.exists())
+        self.assertTrue(get_user_model().objects.exists())
@@ -0,0 +1,47 @@
+from django.test import TestCase, override_settings
+
+from core import benchmarks
+
+
+@override_settings(PASSWORD_HASHING={'EXECUTOR': 'inline'})
+class BenchmarkTests(TestCase):
+
+    def test_run_benchmarks(self):
+        """Test every benchmark runs and reports its numbers"""
+        results = benchmarks.run_benchmarks(iterations=2, warmup=1)
+
+        self.assertEqual(set(results), set(benchmarks.BENCHMARKS))
+        for result in results.values():
+            self.assertEqual(result['iterations'], 2)
+            self.assertGreater(result['ops_per_sec'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(results['password_hashing']['queries_per_op'], 0)
+        self.assertGreater(results['user_create']['queries_per_op'], 0)
+
+    def test_find_regressions(self):
+        """Test throughput drops and extra queries are reported"""
+        baseline = {
+            'fast': {'ops_per_sec': 100, 'queries_per_op': 1},
+            'same': {'ops_per_sec': 100, 'queries_per_op': 1},
+        }
+        results = {
+            'fast': {'ops_per_sec': 70, 'queries_per_op': 2},
+            'same': {'ops_per_sec': 85, 'queries_per_op': 1},
+            'new': {'ops_per_sec': 1, 'queries_per_op': 9},
+        }
+
+        regressions = benchmarks.find_regressions(results, baseline, 0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(r.startswith('fast') for r in regressions))
+
+    def test_measure_wire(self):
+        """Test the sizes and render times of each endpoint are reported"""
+        results = benchmarks.measure_wire(iterations=2)
+
+        self.assertEqual(set(results), {'me', 'list', 'token'})
+        page = results['list']
+        self.assertLess(page['gzip_bytes'], page['identity_bytes'])
+        self.assertGreater(page['fast_render_us'], 0)
+        # too small to be worth compressing
+        self.assertEqual(results['me']['gzip_bytes'],
+                         results['me']['identity_bytes'])
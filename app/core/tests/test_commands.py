@@ -1,23 +1,77 @@
+import threading
 from unittest.mock import patch
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.management.commands.wait_for_db import Command
+
+
+PING = 'core.management.commands.wait_for_db.Command.ping'
+
 
 class CommandTest(TestCase):
 
     def test_wait_for_db_ready(self):
         """Test waiting for db when db is available"""
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.return_value = True
+        with patch(PING) as ping:
+            ping.return_value = None
             call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 1)
+            self.assertEqual(ping.call_args[0][0], 'default')
 
     @patch('time.sleep', return_value=True)
     def test_wait_for_db(self, ts):
         """Test waiting for db"""
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.side_effect = [OperationalError] * 5 + [True]
+        with patch(PING) as ping:
+            ping.side_effect = [OperationalError] * 5 + [None]
             call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 6)
+            self.assertEqual(ping.call_count, 6)
+            self.assertEqual(ts.call_count, 5)
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_backoff(self, ts):
+        """Test the delays grow exponentially and are capped"""
+        with patch(PING) as ping, patch('random.uniform') as uniform:
+            uniform.side_effect = lambda low, high: high
+            ping.side_effect = [OperationalError] * 4 + [None]
+            call_command('wait_for_db', initial_delay=1, max_delay=5)
+
+        delays = [call[0][0] for call in ts.call_args_list]
+        self.assertEqual(delays, [1, 2, 4, 5])
+
+    def test_wait_for_db_timeout(self):
+        """Test the command fails once the deadline has passed"""
+        with patch(PING) as ping:
+            ping.side_effect = OperationalError
+            with self.assertRaises(CommandError):
+                call_command('wait_for_db', timeout=0)
+
+    def test_wait_for_several_databases(self):
+        """Test every requested alias is checked"""
+        with patch(PING) as ping:
+            ping.return_value = None
+            call_command('wait_for_db', databases=['default', 'other'])
+
+        self.assertEqual(
+            sorted(call[0][0] for call in ping.call_args_list),
+            ['default', 'other'],
+        )
+
+    def test_ping_runs_a_query(self):
+        """Test ping really talks to the database"""
+        # ping closes its connection, so run it on its own thread like the
+        # command does instead of closing the one of the test transaction
+        with patch('django.db.backends.utils.CursorWrapper.execute') as ex:
+            Command().ping('default', timeout=5)
+        ex.assert_called_once_with('SELECT 1')
+
+    def test_ping_gives_up_on_a_hung_connection(self):
+        """Test a connection attempt that never answers times out"""
+        hang = threading.Event()
+        self.addCleanup(hang.set)
+        with patch('django.db.backends.utils.CursorWrapper.execute',
+                   side_effect=lambda sql: hang.wait()):
+            with self.assertRaisesMessage(OperationalError, 'No answer'):
+                Command().ping('default', timeout=0.05)
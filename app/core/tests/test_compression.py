@@ -0,0 +1,142 @@
+import gzip
+import json
+from types import SimpleNamespace
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from rest_framework.renderers import JSONRenderer
+
+from core import middleware, renderers
+from core.middleware import CompressionMiddleware, accepted_encodings
+from core.renderers import FastJSONRenderer
+
+
+BODY = json.dumps([{'email': 'user%d@gmail.com' % i} for i in range(100)])
+
+
+def respond(response):
+    return CompressionMiddleware(lambda request: response)
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def get(self, response, accept_encoding='gzip, deflate'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return respond(response)(request)
+
+    def test_accepted_encodings(self):
+        """Test the q values of Accept-Encoding are parsed"""
+        self.assertEqual(
+            accepted_encodings('gzip;q=0.5, br, identity;q=bad'),
+            {'gzip': 0.5, 'br': 1.0, 'identity': 0.0},
+        )
+
+    def test_gzip_compressed(self):
+        """Test big JSON responses are gzipped, with a weak ETag"""
+        response = HttpResponse(BODY, content_type='application/json')
+        response['ETag'] = '"1-1-json"'
+
+        response = self.get(response)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"1-1-json"')
+        self.assertEqual(gzip.decompress(response.content).decode(), BODY)
+        self.assertEqual(int(response['Content-Length']),
+                         len(response.content))
+
+    @skipIf(middleware.brotli is None, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        """Test clients accepting both get brotli"""
+        response = self.get(
+            HttpResponse(BODY, content_type='application/json'),
+            'gzip, deflate, br',
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(
+            middleware.brotli.decompress(response.content).decode(), BODY
+        )
+
+    def test_not_accepted(self):
+        """Test nothing is compressed for clients that did not ask for it"""
+        for accept_encoding in ('identity', 'gzip;q=0'):
+            response = self.get(
+                HttpResponse(BODY, content_type='application/json'),
+                accept_encoding,
+            )
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(RESPONSE_COMPRESSION={'MIN_SIZE': 10000})
+    def test_below_threshold(self):
+        """Test bodies smaller than the threshold are sent as they are"""
+        response = self.get(
+            HttpResponse(BODY, content_type='application/json')
+        )
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content.decode(), BODY)
+
+    def test_incompressible_type(self):
+        """Test already compressed types are left alone"""
+        response = self.get(HttpResponse(BODY, content_type='image/png'))
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_gzip(self):
+        """Test streaming responses are gzipped chunk by chunk"""
+        lines = (line + '\n' for line in BODY.split(','))
+        response = self.get(StreamingHttpResponse(
+            lines, content_type='application/x-ndjson'
+        ))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(body.decode().replace('\n', ','), BODY + ',')
+
+
+class FastJSONRendererTests(TestCase):
+
+    def test_same_output_as_drf(self):
+        """Test the output is byte for byte the one of JSONRenderer"""
+        data = {'email': 'test@gmail.com', 'name': 'Tést ', 'n': [1.5]}
+
+        for context in ({}, {'indent': 2}):
+            self.assertEqual(
+                FastJSONRenderer().render(data, renderer_context=context),
+                JSONRenderer().render(data, renderer_context=context),
+            )
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_falls_back_on_orjson_errors(self):
+        """Test the data orjson refuses is rendered by JSONRenderer"""
+        class JSONEncodeError(TypeError):
+            pass
+
+        def dumps(data, **kwargs):
+            raise JSONEncodeError('Integer exceeds 64-bit range')
+
+        fake = SimpleNamespace(
+            dumps=dumps, JSONEncodeError=JSONEncodeError,
+            OPT_PASSTHROUGH_DATETIME=0,
+        )
+        data = {'id': 2 ** 70, 1: 'one'}
+        with patch.object(renderers, 'orjson', fake), \
+                patch.object(FastJSONRenderer, 'accelerated', True):
+            rendered = FastJSONRenderer().render(data)
+
+        self.assertEqual(rendered, JSONRenderer().render(data))
+
+    @skipIf(renderers.orjson is None, 'orjson is not installed')
+    def test_orjson_refused_data(self):
+        """Test non string keys and big integers render like DRF"""
+        for data in ({1: 'one'}, {'id': 2 ** 70}):
+            self.assertEqual(
+                FastJSONRenderer().render(data), JSONRenderer().render(data)
+            )
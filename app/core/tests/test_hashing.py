@@ -0,0 +1,74 @@
+import threading
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.test import SimpleTestCase
+
+from core.hashing import HashingBusy, HashingExecutor, \
+                         PasswordHasherPool, get_process_pool
+
+
+class HashingExecutorTests(SimpleTestCase):
+
+    def test_make_and_check_password(self):
+        """Test passwords hashed on the pool are valid django hashes"""
+        executor = HashingExecutor(kind='thread', workers=2)
+        encoded = executor.make_password('testpass')
+
+        self.assertTrue(check_password('testpass', encoded))
+        self.assertTrue(executor.check_password('testpass', encoded))
+        self.assertFalse(executor.check_password('wrong', encoded))
+        self.assertFalse(executor.check_password(None, encoded))
+        self.assertEqual(executor.stats()['completed'], 3)
+        executor.shutdown()
+
+    def test_check_password_upgrades_hash(self):
+        """Test the setter is called for hashes using an old algorithm"""
+        executor = HashingExecutor(kind='inline')
+        encoded = make_password('testpass', hasher='pbkdf2_sha1')
+        upgraded = []
+
+        self.assertTrue(
+            executor.check_password('testpass', encoded, upgraded.append)
+        )
+        self.assertEqual(upgraded, ['testpass'])
+
+    def test_full_queue_rejects(self):
+        """Test callers get HashingBusy when the queue stays full"""
+        executor = HashingExecutor(
+            kind='thread', workers=1, max_queue=0, queue_timeout=0.01
+        )
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=executor.submit, args=(slow_hash,))
+        worker.start()
+        started.wait()
+        try:
+            with self.assertRaises(HashingBusy):
+                executor.make_password('testpass')
+            self.assertEqual(executor.stats()['in_flight'], 1)
+        finally:
+            release.set()
+            worker.join()
+
+        self.assertEqual(executor.stats()['rejected'], 1)
+        executor.shutdown()
+
+
+class PasswordHasherPoolTests(SimpleTestCase):
+
+    def test_process_pool_is_reused(self):
+        """Test the batches of the process share one pool of processes"""
+        with PasswordHasherPool(workers=2) as hasher:
+            first = hasher._executor
+            encoded = hasher(['one', 'two'])
+        with PasswordHasherPool(workers=2) as hasher:
+            self.assertIs(hasher._executor, first)
+            hasher(['three', 'four'])
+
+        self.assertIs(get_process_pool(2), first)
+        self.assertTrue(check_password('two', encoded[1]))
@@ -0,0 +1,171 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings,
+)
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.metrics import LazyCollector, Registry, registry
+from core.middleware import PerformanceMiddleware
+from core.profiling import SamplingProfiler
+
+
+ME_URL = reverse('user:me')
+METRICS_URL = reverse('metrics')
+
+
+class RegistryTests(SimpleTestCase):
+
+    def test_render_histogram_and_gauges(self):
+        """Test metrics are rendered in the prometheus text format"""
+        metrics = Registry()
+        metrics.observe('latency_seconds', 0.3, buckets=(0.1, 0.5), view='a')
+        metrics.observe('latency_seconds', 2, buckets=(0.1, 0.5), view='a')
+        metrics.register_collector(lambda: [('cache_hits', {}, 3)])
+
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE latency_seconds histogram', lines)
+        self.assertIn('latency_seconds_bucket{le="0.1",view="a"} 0', lines)
+        self.assertIn('latency_seconds_bucket{le="0.5",view="a"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf",view="a"} 2', lines)
+        self.assertIn('latency_seconds_count{view="a"} 2', lines)
+        self.assertIn('cache_hits 3', lines)
+
+    def test_lazy_collector(self):
+        """Test a module is only collected from once it was imported"""
+        metrics = Registry()
+        metrics.register_collector(LazyCollector('lazy_metrics'))
+        metrics.register_collector(LazyCollector('lazy_metrics'))
+        self.assertNotIn('lazy_gauge', metrics.render())
+
+        module = types.ModuleType('lazy_metrics')
+        module.collect_metrics = lambda: [('lazy_gauge', {}, 1)]
+        with patch.dict(sys.modules, {'lazy_metrics': module}):
+            lines = metrics.render().splitlines()
+        self.assertEqual(lines.count('lazy_gauge 1'), 1)
+
+
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.user = get_user_model().objects.create_user(
+            email='metrics@gmail.com', password='testpass', name='Metrics'
+        )
+
+    def test_request_is_recorded_per_view(self):
+        """Test wall time, queries, serializer time and size are recorded"""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        client.get(ME_URL)
+        client.patch(ME_URL, {'name': 'New name'})
+
+        view = {'view': 'user:me'}
+        duration = registry.histogram('http_request_duration_seconds', **view)
+        self.assertEqual(duration.count, 2)
+        queries = registry.histogram('http_request_db_queries', **view)
+        # the PATCH saves the user
+        self.assertGreater(queries.sum, 0)
+        serializer = registry.histogram(
+            'http_request_serializer_seconds', **view
+        )
+        self.assertGreater(serializer.sum, 0)
+        size = registry.histogram('http_response_size_bytes', **view)
+        self.assertGreater(size.sum, 0)
+
+    def test_metrics_endpoint_requires_staff(self):
+        """Test anonymous users can not scrape the metrics"""
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(PERF_METRICS_TOKEN='scrape-secret')
+    def test_metrics_endpoint_token(self):
+        """Test a scraper can authenticate with the configured token"""
+        APIClient().get(reverse('index'))
+        res = self.client.get(
+            METRICS_URL, HTTP_AUTHORIZATION='Bearer scrape-secret'
+        )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'http_request_duration_seconds_count{view="index"} 1',
+            res.content.decode(),
+        )
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer no')
+        self.assertEqual(res.status_code, 403)
+
+    def test_streaming_is_timed_until_closed(self):
+        """Test a streaming response is timed until its body is sent"""
+        def body():
+            yield b'first'
+            time.sleep(0.05)
+            yield b'second'
+
+        middleware = PerformanceMiddleware(
+            lambda request: StreamingHttpResponse(body())
+        )
+        response = middleware(RequestFactory().get('/'))
+        name = 'http_request_duration_seconds'
+        self.assertIsNone(registry.histogram(name, view='unresolved'))
+
+        self.assertEqual(b''.join(response), b'firstsecond')
+        response.close()
+        duration = registry.histogram(name, view='unresolved')
+        self.assertEqual(duration.count, 1)
+        self.assertGreaterEqual(duration.sum, 0.05)
+
+    def test_slow_requests_are_profiled(self):
+        """Test the profiler dumps flame graph data over the threshold"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        profiler = {'ENABLED': True, 'THRESHOLD': 0, 'DIR': directory,
+                    'INTERVAL': 0.0001}
+        with override_settings(PERF_PROFILER=profiler):
+            self.client.get(reverse('index'))
+
+        dumps = os.listdir(directory)
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].endswith('-index.folded'))
+
+
+class SamplingProfilerTests(SimpleTestCase):
+
+    def test_profilers_share_one_thread(self):
+        """Test concurrent profilers are sampled by the same thread"""
+        profilers = [
+            SamplingProfiler(threading.get_ident(), interval=0.001).start()
+            for _ in range(3)
+        ]
+        time.sleep(0.05)
+        samplers = [
+            thread for thread in threading.enumerate()
+            if thread.name == 'sampling-profiler'
+        ]
+        for profiler in profilers:
+            profiler.stop()
+
+        self.assertEqual(len(samplers), 1)
+        for profiler in profilers:
+            self.assertTrue(profiler.samples)
+        counts = [sum(profiler.samples.values()) for profiler in profilers]
+        time.sleep(0.01)
+        self.assertEqual(
+            counts, [sum(profiler.samples.values()) for profiler in profilers]
+        )
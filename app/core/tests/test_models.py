@@ -1,5 +1,9 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+
+from core.hashing import PasswordHasherPool
 ''' we use get_user_model instead of importing the user model directly
     later on if we change the user model by using get_user_model we only
     have to change the configuration
@@ -40,3 +44,70 @@ class ModelTest(TestCase):
 
         self.assertTrue(user.is_superuser)
         self.assertTrue(user.is_staff)
+
+    def test_bulk_create_users(self):
+        """Test users are created in batches with hashed passwords"""
+        get_user_model().objects.create_user('taken@gmail.com', 'test123')
+        rows = [
+            {'email': 'one@GMAIL.COM', 'password': 'test123', 'name': 'One'},
+            {'email': 'taken@gmail.com', 'password': 'test123'},
+            {'email': 'two@gmail.com'},
+        ]
+        with PasswordHasherPool(workers=2) as hasher:
+            results = list(get_user_model().objects.bulk_create_users(
+                rows, batch_size=2, hasher=hasher
+            ))
+
+        self.assertEqual([created for _, created in results],
+                         [True, False, True])
+        user = get_user_model().objects.get(email='one@gmail.com')
+        self.assertTrue(user.check_password('test123'))
+        self.assertEqual(user.name, 'One')
+        # no password means an unusable one, just like create_user
+        user = get_user_model().objects.get(email='two@gmail.com')
+        self.assertFalse(user.has_usable_password())
+
+    def test_save_bumps_version(self):
+        """Test every save of a user bumps its version"""
+        user = get_user_model().objects.create_user(
+            'test@gmail.com', 'test123'
+        )
+        self.assertEqual(user.version, 1)
+
+        user.name = 'New'
+        user.save(update_fields=['name'])
+        user.refresh_from_db()
+
+        self.assertEqual(user.version, 2)
+
+    def test_concurrent_saves_get_their_own_version(self):
+        """Test two copies of a user saved one after the other"""
+        user = get_user_model().objects.create_user(
+            'test@gmail.com', 'test123'
+        )
+        first = get_user_model().objects.get(pk=user.pk)
+        second = get_user_model().objects.get(pk=user.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            first.save()
+        second.save()
+
+        self.assertEqual((first.version, second.version), (2, 3))
+        # the UPDATE returns the new version, it is not read again
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT "core_user"')
+        ])
+
+    def test_get_by_natural_key_ignores_case(self):
+        """Test the email lookup of the logins ignores its case"""
+        manager = get_user_model().objects
+        user = manager.create_user('Test@gmail.com', 'test123')
+        other = manager.create_user('TEST@gmail.com', 'test123')
+
+        self.assertEqual(manager.get_by_natural_key('Test@gmail.com'), user)
+        self.assertEqual(manager.get_by_natural_key('TEST@gmail.com'), other)
+        other.delete()
+        self.assertEqual(manager.get_by_natural_key('test@GMAIL.com'), user)
+        with self.assertRaises(get_user_model().DoesNotExist):
+            manager.get_by_natural_key('tes@gmail.com')
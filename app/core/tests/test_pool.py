@@ -0,0 +1,188 @@
+import threading
+from unittest import skipUnless
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+
+from core.db.pool import ConnectionPool, PoolTimeout
+from core.tests.utils import FakeClock
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+
+class FakeConnection:
+
+    def __init__(self, number):
+        self.number = number
+        self.healthy = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def make_pool(self, **kwargs):
+        self.clock = FakeClock()
+        self.opened = []
+
+        def connect():
+            connection = FakeConnection(len(self.opened))
+            self.opened.append(connection)
+            return connection
+
+        kwargs.setdefault('max_size', 2)
+        return ConnectionPool(
+            connect=connect,
+            close=lambda connection: connection.close(),
+            check=lambda connection: connection.healthy,
+            clock=self.clock,
+            **kwargs
+        )
+
+    def test_connections_are_reused(self):
+        """Test a released connection is handed out again"""
+        pool = self.make_pool()
+        first = pool.acquire()
+        pool.release(first)
+
+        self.assertIs(pool.acquire(), first)
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    def test_pool_is_bounded(self):
+        """Test callers wait for a free connection and time out"""
+        pool = self.make_pool(max_size=1, timeout=0)
+        pool.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_waiting_caller_gets_released_connection(self):
+        """Test a blocked caller is woken up by a release"""
+        pool = ConnectionPool(
+            connect=object, close=lambda connection: None,
+            max_size=1, timeout=5,
+        )
+        first = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(
+            pool.acquire()
+        ))
+        waiter.start()
+        pool.release(first)
+        waiter.join()
+
+        self.assertEqual(acquired, [first])
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_max_lifetime_recycles(self):
+        """Test connections older than max_lifetime are replaced"""
+        pool = self.make_pool(max_lifetime=60)
+        first = pool.acquire()
+        pool.release(first)
+        self.clock.now = 60
+
+        second = pool.acquire()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.stats()['recycled'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_health_check(self):
+        """Test broken idle connections are dropped"""
+        pool = self.make_pool(health_check_interval=10)
+        first = pool.acquire()
+        pool.release(first)
+        first.healthy = False
+        # recently used connections are trusted without a check
+        self.assertIs(pool.acquire(), first)
+        pool.release(first)
+
+        self.clock.now = 10
+        self.assertIsNot(pool.acquire(), first)
+        self.assertEqual(pool.stats()['failed_checks'], 1)
+
+    def test_check_runs_outside_the_lock(self):
+        """Test other callers are not blocked while a connection is pinged"""
+        blocked = []
+
+        def check(connection):
+            # another thread must be able to use the pool meanwhile
+            other = threading.Thread(target=pool.stats)
+            other.start()
+            other.join(timeout=5)
+            blocked.append(other.is_alive())
+            return True
+        pool = self.make_pool(health_check_interval=0)
+        pool._check = check
+        pool.release(pool.acquire())
+
+        pool.acquire()
+        self.assertEqual(blocked, [False])
+
+    def test_reused_connections_are_reset(self):
+        """Test the session of a reused connection is reset, or dropped"""
+        reset = []
+        pool = self.make_pool(reset=lambda connection: (
+            reset.append(connection) or connection.number > 0
+        ))
+        first = pool.acquire()
+        self.assertEqual(reset, [])
+        pool.release(first)
+
+        second = pool.acquire()
+        self.assertEqual(reset, [first])
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_discard_frees_slot(self):
+        """Test a discarded connection makes room for a new one"""
+        pool = self.make_pool(max_size=1, timeout=0)
+        first = pool.acquire()
+        pool.release(first, discard=True)
+
+        self.assertIsNot(pool.acquire(), first)
+        self.assertTrue(first.closed)
+
+
+@skipUnless(psycopg2, 'psycopg2 is not installed')
+class PooledBackendTests(SimpleTestCase):
+
+    def make_wrapper(self):
+        from core.db.backends.postgresql_pool.base import DatabaseWrapper
+        return DatabaseWrapper({
+            'ENGINE': 'core.db.backends.postgresql_pool',
+            'NAME': 'app', 'USER': 'postgres', 'PASSWORD': '',
+            'HOST': 'pool-test', 'PORT': '', 'OPTIONS': {},
+            'POOL': {'MAX_SIZE': 1, 'TIMEOUT': 0},
+            'TIME_ZONE': None, 'CONN_MAX_AGE': 0, 'AUTOCOMMIT': True,
+            'ATOMIC_REQUESTS': False, 'TEST': {},
+        }, alias='pool-test')
+
+    @patch('psycopg2.connect')
+    def test_close_returns_connection_to_pool(self, connect):
+        """Test closing the wrapper gives the socket back to the pool"""
+        raw = MagicMock(closed=0)
+        raw.get_transaction_status.return_value = (
+            psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        )
+        connect.return_value = raw
+        wrapper = self.make_wrapper()
+        params = wrapper.get_connection_params()
+
+        wrapper.connection = wrapper.get_new_connection(params)
+        wrapper._close()
+        # the aborted transaction is rolled back, the socket stays open
+        raw.rollback.assert_called_once_with()
+        raw.close.assert_not_called()
+
+        other = self.make_wrapper()
+        self.assertIs(other.get_new_connection(params), raw)
+        self.assertEqual(connect.call_count, 1)
@@ -0,0 +1,110 @@
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.queryplan import assert_no_full_scans, full_scans
+from user.authentication import get_token_cache
+
+
+SEEDED_USERS = 5000
+TABLES = ('core_user', 'authtoken_token')
+
+
+class QueryPlanTests(TestCase):
+    """Test the hot user queries use an index on a seeded user table"""
+
+    @classmethod
+    def setUpTestData(cls):
+        password = make_password('password123')
+        get_user_model().objects.bulk_create(
+            get_user_model()(
+                email='Seeded%05d@example.com' % index,
+                name='Seeded User %05d' % index,
+                password=password,
+                # a few staff and inactive users, like in production
+                is_staff=index % 500 == 0,
+                is_active=index % 200 != 1,
+            )
+            for index in range(SEEDED_USERS)
+        )
+        # bulk_create only sets the pks on postgres
+        Token.objects.bulk_create(
+            Token(key=Token().generate_key(), user_id=pk)
+            for pk in get_user_model().objects.values_list('pk', flat=True)
+        )
+        cls.user = get_user_model().objects.create_user(
+            email='planned@example.com', password='password123',
+            name='Planned User',
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.admin_user = get_user_model().objects.create_superuser(
+            email='admin@example.com', password='password123'
+        )
+        # up to date statistics, as autovacuum would have in production
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_full_scans_detected(self):
+        """Test a query on an unindexed column is reported"""
+        plans = {
+            'sqlite': ['SCAN core_user', 'SCAN core_user USING INDEX x'],
+            'postgresql': ['Seq Scan on core_user  (cost=0.00..1.00)',
+                           'Index Scan using x on core_user'],
+        }
+        self.assertEqual(full_scans('sqlite', plans['sqlite'], TABLES),
+                         ['SCAN core_user'])
+        self.assertEqual(
+            full_scans('postgresql', plans['postgresql'], TABLES),
+            ['Seq Scan on core_user  (cost=0.00..1.00)'],
+        )
+
+        with self.assertRaises(AssertionError):
+            with assert_no_full_scans(TABLES):
+                list(get_user_model().objects.filter(name__endswith='1'))
+
+    def test_authenticate(self):
+        """Test the login lookup of the email, whatever its case"""
+        with assert_no_full_scans(TABLES):
+            user = authenticate(
+                email='PLANNED@example.com', password='password123'
+            )
+        self.assertEqual(user, self.user)
+
+    def test_manage_user(self):
+        """Test the token lookup and the update of the me endpoint"""
+        get_token_cache().clear()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('user:me')
+
+        with assert_no_full_scans(TABLES):
+            res = client.get(url)
+        self.assertEqual(res.status_code, 200)
+
+        with assert_no_full_scans(TABLES):
+            res = client.patch(url, {'name': 'Renamed'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_admin_changelist(self):
+        """Test the searches, filters and pages of the user admin
+
+        The first unfiltered page is left out: it reads the table in pk
+        order and sqlite, unlike postgres, counts every row for it.
+        """
+        client = Client()
+        client.force_login(self.admin_user)
+        url = reverse('admin:core_user_changelist')
+
+        for query in ({'q': 'seeded0012'}, {'q': 'Seeded User 0042'},
+                      {'is_staff__exact': '1'}, {'is_active__exact': '0'},
+                      {'after': self.user.pk - 100},
+                      {'is_staff__exact': '1', 'after': 1}):
+            with self.subTest(query=query):
+                with assert_no_full_scans(('core_user',)):
+                    res = client.get(url, query)
+                self.assertEqual(res.status_code, 200)
@@ -0,0 +1,153 @@
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, \
+                        override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core import routers
+from core.middleware import ReadYourWritesMiddleware
+from core.routers import ReplicaRouter
+
+
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        routers.unpin()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_round_robin_reads(self):
+        """Test user and token reads alternate between the replicas"""
+        router = ReplicaRouter(replicas=['replica_0', 'replica_1'])
+        reads = [router.db_for_read(get_user_model()) for _ in range(3)]
+
+        self.assertEqual(reads, ['replica_0', 'replica_1', 'replica_0'])
+        self.assertEqual(router.db_for_read(Token), 'replica_1')
+
+    def test_other_models_are_not_routed(self):
+        """Test models other than users and tokens use the default db"""
+        from django.contrib.auth.models import Group
+        router = ReplicaRouter(replicas=['replica_0'])
+
+        self.assertIsNone(router.db_for_read(Group))
+        self.assertIsNone(router.db_for_write(Group))
+        self.assertFalse(routers.is_pinned())
+
+    def test_no_replicas(self):
+        """Test nothing is routed when no replica is configured"""
+        router = ReplicaRouter(replicas=[])
+        self.assertIsNone(router.db_for_read(get_user_model()))
+
+    def test_least_latency(self):
+        """Test the replica with the lowest average latency is chosen"""
+        router = ReplicaRouter(
+            replicas=['replica_a', 'replica_b'], strategy='least_latency'
+        )
+        routers.record_latency('replica_a', 0.050)
+        routers.record_latency('replica_b', 0.010)
+        self.assertEqual(router.db_for_read(Token), 'replica_b')
+
+        for _ in range(20):
+            routers.record_latency('replica_b', 0.200)
+        self.assertEqual(router.db_for_read(Token), 'replica_a')
+
+    def test_asking_for_the_write_db_does_not_pin(self):
+        """Test lookups that only ask for the write db are not writes"""
+        router = ReplicaRouter(replicas=['replica_0'])
+        self.assertEqual(router.db_for_write(get_user_model()), 'default')
+
+        self.assertFalse(routers.has_written())
+        self.assertEqual(router.db_for_read(get_user_model()), 'replica_0')
+
+    def test_replicas_are_not_migrated(self):
+        router = ReplicaRouter(replicas=['replica_0'])
+        self.assertFalse(router.allow_migrate('replica_0', 'core'))
+        self.assertIsNone(router.allow_migrate('default', 'core'))
+
+
+class PrimaryWritesTests(TestCase):
+
+    def setUp(self):
+        routers.unpin()
+        self.addCleanup(routers.unpin)
+
+    def test_write_pins_reads_to_primary(self):
+        """Test reads after a write in the same request use the primary"""
+        get_user_model().objects.filter(pk=0).exists()
+        self.assertFalse(routers.has_written())
+
+        get_user_model().objects.create_user('test@example.com', 'pass')
+        self.assertTrue(routers.has_written())
+        self.assertTrue(routers.is_pinned())
+
+    def test_updates_pin(self):
+        """Test writes that send no signal pin as well"""
+        get_user_model().objects.filter(pk=0).update(name='test')
+        self.assertTrue(routers.has_written())
+
+    def test_other_writes_do_not_pin(self):
+        from django.contrib.auth.models import Group
+        Group.objects.create(name='test')
+        self.assertFalse(routers.has_written())
+
+    def test_reads_in_a_transaction_use_the_primary(self):
+        """Test reads inside transaction.atomic() stay on the primary"""
+        router = ReplicaRouter(replicas=['replica_0'])
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Token), 'default')
+
+
+class ReadYourWritesMiddlewareTests(SimpleTestCase):
+
+    def test_write_sets_pin_cookie(self):
+        """Test a request that writes pins the client to the primary"""
+        def view(request):
+            routers.wrote_to_primary()
+            return HttpResponse()
+
+        response = ReadYourWritesMiddleware(view)(RequestFactory().get('/'))
+
+        cookie = response.cookies[ReadYourWritesMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertFalse(routers.is_pinned())
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'])
+    def test_write_pins_the_user(self):
+        """Test a client ignoring cookies is pinned through its user"""
+        user = SimpleNamespace(pk=42, is_authenticated=True)
+        self.addCleanup(cache.delete, routers.USER_PIN_KEY % user.pk)
+
+        def view(request):
+            request.user = user
+            routers.wrote_to_primary()
+            return HttpResponse()
+
+        ReadYourWritesMiddleware(view)(RequestFactory().get('/'))
+        routers.pin_if_user_wrote(41)
+        self.assertFalse(routers.is_pinned())
+        routers.pin_if_user_wrote(user.pk)
+        self.assertTrue(routers.is_pinned())
+        routers.unpin()
+
+    def test_pin_cookie_pins_reads(self):
+        """Test the reads of a pinned client go to the primary"""
+        seen = []
+
+        def view(request):
+            seen.append(routers.is_pinned())
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES[ReadYourWritesMiddleware.cookie_name] = '1'
+        response = ReadYourWritesMiddleware(view)(request)
+
+        self.assertEqual(seen, [True])
+        self.assertNotIn(
+            ReadYourWritesMiddleware.cookie_name, response.cookies
+        )
@@ -0,0 +1,102 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework import serializers
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.test import APIRequestFactory
+from rest_framework.request import Request
+
+from core.negotiation import CachedContentNegotiation
+from core.serializers import CompiledReadMixin, compile_fields
+from user.serializers import UserListSerializer, UserSerializer
+
+
+class DRFUserListSerializer(UserListSerializer):
+    compiled_read = False
+
+
+class MethodFieldSerializer(CompiledReadMixin, serializers.ModelSerializer):
+    initials = serializers.SerializerMethodField()
+
+    class Meta:
+        model = get_user_model()
+        fields = ('email', 'initials')
+
+    def get_initials(self, user):
+        return user.name[:1]
+
+
+class CompiledReadTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com', 'testpass', name='Test'
+        )
+
+    def test_same_output_as_drf(self):
+        """Test the compiled path renders exactly what DRF renders"""
+        for last_login in (None, timezone.now()):
+            self.user.last_login = last_login
+            self.assertEqual(
+                dict(UserListSerializer(self.user).data),
+                dict(DRFUserListSerializer(self.user).data),
+            )
+        self.assertEqual(
+            dict(UserSerializer(self.user).data),
+            {'email': 'test@gmail.com', 'name': 'Test'},
+        )
+
+    def test_many(self):
+        """Test lists of instances use the compiled accessors too"""
+        data = UserSerializer([self.user, self.user], many=True).data
+
+        self.assertEqual([item['email'] for item in data],
+                         ['test@gmail.com'] * 2)
+
+    def test_selected_fields_fall_back(self):
+        """Test a serializer with modified fields goes through DRF"""
+        serializer = UserListSerializer(
+            self.user, context={'fields': ('email',)}
+        )
+
+        self.assertEqual(dict(serializer.data), {'email': 'test@gmail.com'})
+
+    def test_uncompilable_fields(self):
+        """Test serializers with method fields are left to DRF"""
+        self.assertIsNone(compile_fields(MethodFieldSerializer))
+        self.assertEqual(
+            dict(MethodFieldSerializer(self.user).data),
+            {'email': 'test@gmail.com', 'initials': 'T'},
+        )
+
+
+class CachedContentNegotiationTests(TestCase):
+
+    def select(self, accept):
+        request = Request(APIRequestFactory().get('/', HTTP_ACCEPT=accept))
+        renderers = [JSONRenderer(), BrowsableAPIRenderer()]
+        renderer, media_type = CachedContentNegotiation().select_renderer(
+            request, renderers
+        )
+        self.assertIn(renderer, renderers)
+        return type(renderer), media_type
+
+    def test_cached_selection(self):
+        """Test the same renderer is picked from the cache"""
+        CachedContentNegotiation._selected.clear()
+        first = self.select('text/html')
+        self.assertEqual(len(CachedContentNegotiation._selected), 1)
+
+        self.assertEqual(self.select('text/html'), first)
+        self.assertEqual(first[0], BrowsableAPIRenderer)
+        self.assertEqual(self.select('*/*')[0], JSONRenderer)
+
+    def test_not_acceptable_not_cached(self):
+        """Test a 406 is raised every time and never cached"""
+        CachedContentNegotiation._selected.clear()
+        for _ in range(2):
+            with self.assertRaises(NotAcceptable):
+                self.select('image/png')
+        self.assertEqual(CachedContentNegotiation._selected, {})
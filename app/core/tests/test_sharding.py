@@ -0,0 +1,417 @@
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.admin.models import CHANGE, LogEntry
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import Client, SimpleTestCase, TestCase, \
+                        override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import sharding
+from core.routers import ShardRouter
+from user.authentication import get_token_cache
+from user.backends import get_permission_cache
+from user.tokens import issue_token, new_key
+
+
+SHARDS = ['default', 'shard_1', 'shard_2']
+
+
+def sharded(shards=SHARDS):
+    return override_settings(USER_SHARDING={'SHARDS': shards,
+                                            'ID_BLOCK_SIZE': 10})
+
+
+class ShardingTests(SimpleTestCase):
+    """Test the buckets and their placement on the shards"""
+
+    def test_email_bucket(self):
+        """Test the bucket ignores the case of the email"""
+        bucket = sharding.email_bucket('test@gmail.com')
+
+        self.assertEqual(sharding.email_bucket('Test@GMAIL.com'), bucket)
+        self.assertTrue(0 <= bucket < sharding.BUCKETS)
+
+    @sharded([])
+    def test_unsharded(self):
+        """Test nothing is placed without shards"""
+        self.assertIsNone(sharding.shard_for_email('test@gmail.com'))
+        self.assertIsNone(sharding.shard_for_user_id(1))
+        self.assertIsNone(sharding.new_user_id('test@gmail.com'))
+        self.assertEqual(sharding.token_key(1, 'a' * 40), 'a' * 40)
+
+    def test_adding_a_shard_only_moves_buckets_to_it(self):
+        with sharded(SHARDS[:2]):
+            before = [sharding.shard_for_bucket(bucket)
+                      for bucket in range(sharding.BUCKETS)]
+        with sharded():
+            after = [sharding.shard_for_bucket(bucket)
+                     for bucket in range(sharding.BUCKETS)]
+
+        self.assertEqual(set(before), set(SHARDS[:2]))
+        moved = {new for old, new in zip(before, after) if old != new}
+        self.assertEqual(moved, {'shard_2'})
+        # roughly its share of the buckets
+        self.assertTrue(40 < after.count('shard_2') < 130)
+
+    @sharded()
+    def test_token_key_names_the_shard(self):
+        user_id = 5 * sharding.BUCKETS + 0xab
+        key = new_key(user_id)
+
+        self.assertEqual(len(key), 40)
+        self.assertTrue(key.startswith('ab'))
+        self.assertEqual(sharding.shard_for_token(key),
+                         sharding.shard_for_user_id(user_id))
+        self.assertIsNone(sharding.shard_for_token('zz' + key[2:]))
+
+    def test_id_allocator_reserves_blocks(self):
+        reserved = []
+
+        def reserve(name, count, start):
+            first = start() + count * len(reserved)
+            reserved.append(first)
+            return first, first + count
+        allocator = sharding.IdAllocator('test', 3, start=lambda: 10,
+                                         reserve=reserve)
+
+        self.assertEqual([allocator.next() for _ in range(4)],
+                         [10, 11, 12, 13])
+        self.assertEqual(reserved, [10, 13])
+
+    @sharded()
+    def test_router_follows_the_objects(self):
+        router = ShardRouter()
+        user = get_user_model()(id=7 * sharding.BUCKETS + 3)
+        shard = sharding.shard_for_bucket(3)
+
+        self.assertEqual(router.db_for_write(get_user_model(),
+                                             instance=user), shard)
+        self.assertEqual(router.db_for_write(Token, instance=Token(
+            key='ff' + 'a' * 38, user_id=user.pk
+        )), shard)
+        self.assertIsNone(router.db_for_read(get_user_model()))
+
+
+@skipUnless(set(SHARDS) <= set(settings.DATABASES),
+            'needs the databases of app.settings_shards')
+@sharded()
+class ShardedUserTests(TestCase):
+    """Test users, logins and tokens on their shards"""
+    multi_db = True
+
+    def setUp(self):
+        get_token_cache().clear()
+
+    def locate(self, email):
+        """Return the aliases holding a user with this email"""
+        return [
+            alias for alias in SHARDS
+            if get_user_model().objects.using(alias).filter(
+                email=email
+            ).exists()
+        ]
+
+    def test_create_user_on_its_shard(self):
+        user = get_user_model().objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+
+        self.assertEqual(self.locate(user.email),
+                         [sharding.shard_for_email(user.email)])
+        self.assertEqual(sharding.id_bucket(user.pk),
+                         sharding.email_bucket(user.email))
+
+    def test_save_without_the_manager(self):
+        """Test users saved directly (e.g. by the admin) get a sharded id"""
+        users = [get_user_model()(email='plain%d@gmail.com' % index)
+                 for index in range(6)]
+        for user in users:
+            user.save()
+
+        self.assertEqual(len({user.pk for user in users}), 6)
+        for user in users:
+            self.assertEqual(sharding.id_bucket(user.pk),
+                             sharding.email_bucket(user.email))
+            self.assertEqual(self.locate(user.email),
+                             [sharding.shard_for_user_id(user.pk)])
+
+    def test_authenticate_and_token(self):
+        """Test logins and token requests find the user's shard"""
+        get_user_model().objects.create_user(
+            email='test@gmail.com', password='testpass', name='Test'
+        )
+        user = authenticate(email='TEST@gmail.com', password='testpass')
+        token = issue_token(user)
+
+        self.assertEqual(Token.objects.using(user._state.db).get(
+            user_id=user.pk
+        ).key, token.key)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = client.get(reverse('user:me'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Test')
+
+    def test_user_change_drops_cached_tokens(self):
+        user = get_user_model().objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+        key = issue_token(user).key
+        get_token_cache().set(key, ('snapshot',))
+
+        user.name = 'New name'
+        user.save()
+
+        self.assertIsNone(get_token_cache().get(key))
+
+    def test_bulk_create_users(self):
+        """Test the rows are spread over the shards in their order"""
+        emails = ['bulk%d@gmail.com' % index for index in range(20)]
+        results = list(get_user_model().objects.bulk_create_users(
+            [{'email': email} for email in emails + emails[:1]]
+        ))
+
+        self.assertEqual([row['email'] for row, _ in results],
+                         emails + emails[:1])
+        self.assertEqual([created for _, created in results],
+                         [True] * 20 + [False])
+        for email in emails:
+            self.assertEqual(self.locate(email),
+                             [sharding.shard_for_email(email)])
+
+    def test_rebalance(self):
+        """Test users move with their token and groups once a shard joins"""
+        with sharded(SHARDS[:2]):
+            users = [
+                get_user_model().objects.create_user(
+                    email='move%d@gmail.com' % index, password='testpass'
+                )
+                for index in range(30)
+            ]
+            keys = {user.pk: issue_token(user).key for user in users}
+        moving = [user for user in users
+                  if sharding.shard_for_email(user.email) == 'shard_2']
+        self.assertTrue(moving)
+        member = moving[0]
+        member.groups.add(Group.objects.create(name='editors'))
+        LogEntry.objects.using(member._state.db).create(
+            user_id=member.pk, action_flag=CHANGE,
+            content_type_id=ContentType.objects.get_for_model(Group).pk,
+        )
+
+        out = StringIO()
+        call_command('rebalance_shards', batch_size=7, stdout=out,
+                     stderr=StringIO())
+
+        self.assertIn('Moved %d user(s)' % len(moving), out.getvalue())
+        for user in users:
+            shard = sharding.shard_for_email(user.email)
+            self.assertEqual(self.locate(user.email), [shard])
+            # ids and tokens are kept
+            self.assertEqual(Token.objects.using(shard).get(
+                user_id=user.pk
+            ).key, keys[user.pk])
+        self.assertEqual(list(get_user_model().objects.using(
+            'shard_2'
+        ).get(pk=member.pk).groups.values_list('name', flat=True)),
+            ['editors'])
+        self.assertTrue(LogEntry.objects.using('shard_2').filter(
+            user_id=member.pk
+        ).exists())
+
+    def misplaced_user(self):
+        """Return a user created before shard_2 joined, that belongs there"""
+        email = next(
+            email for email in (
+                'conflict%d@gmail.com' % index for index in range(100)
+            )
+            if sharding.shard_for_email(email) == 'shard_2'
+        )
+        with sharded(SHARDS[:2]):
+            return get_user_model().objects.create_user(
+                email=email, password='testpass'
+            )
+
+    def test_rebalance_leaves_conflicts_in_place(self):
+        """Test a user whose email is taken on the target is not deleted"""
+        user = self.misplaced_user()
+        source = user._state.db
+        # signed up again once the email belonged to shard_2
+        other = get_user_model().objects.create_user(
+            email=user.email, password='other'
+        )
+        self.assertEqual(other._state.db, 'shard_2')
+
+        err = StringIO()
+        call_command('rebalance_shards', stdout=StringIO(), stderr=err)
+
+        self.assertTrue(get_user_model().objects.using(source).filter(
+            pk=user.pk
+        ).exists())
+        self.assertIn('User %d of %s left in place' % (user.pk, source),
+                      err.getvalue())
+
+    def test_rebalance_finishes_an_interrupted_move(self):
+        """Test a user already copied by an earlier run leaves the source"""
+        user = self.misplaced_user()
+        # the target committed, the source did not
+        get_user_model().objects.using('shard_2').bulk_create([
+            get_user_model()(pk=user.pk, email=user.email,
+                             password=user.password)
+        ])
+
+        err = StringIO()
+        call_command('rebalance_shards', stdout=StringIO(), stderr=err)
+
+        self.assertEqual(self.locate(user.email), ['shard_2'])
+        self.assertNotIn('left in place', err.getvalue())
+
+    def test_groups_are_shared(self):
+        """Test users of any shard can join the groups the admin edits"""
+        permission = Permission.objects.get(codename='change_group')
+        group = Group.objects.create(name='editors')
+        group.permissions.add(permission)
+        users = [
+            get_user_model().objects.create_user(
+                email='member%d@gmail.com' % index, password='testpass'
+            )
+            for index in range(10)
+        ]
+        self.assertGreater(len({user._state.db for user in users}), 1)
+
+        for user in users:
+            user.groups.add(group)
+            user = authenticate(email=user.email, password='testpass')
+            self.assertTrue(user.has_perm('auth.change_group'))
+        group.permissions.clear()
+        get_permission_cache().clear()
+        self.assertFalse(authenticate(
+            email=users[-1].email, password='testpass'
+        ).has_perm('auth.change_group'))
+
+    def test_rebalance_users_created_before_sharding(self):
+        """Test the users of the unsharded database get a sharded id"""
+        with sharded([]):
+            user = get_user_model().objects.create_user(
+                email='legacy@gmail.com', password='testpass'
+            )
+            old_key = issue_token(user).key
+
+        call_command('rebalance_shards', stdout=StringIO(),
+                     stderr=StringIO())
+
+        shard = sharding.shard_for_email(user.email)
+        self.assertEqual(self.locate(user.email), [shard])
+        moved = get_user_model().objects.using(shard).get(email=user.email)
+        self.assertEqual(sharding.id_bucket(moved.pk),
+                         sharding.email_bucket(user.email))
+        token = Token.objects.using(shard).get(user_id=moved.pk)
+        self.assertNotEqual(token.key, old_key)
+        self.assertEqual(sharding.shard_for_token(token.key), shard)
+        self.assertEqual(authenticate(email=user.email, password='testpass'),
+                         moved)
+
+    def create_users(self, count):
+        users = [
+            get_user_model().objects.create_user(
+                email='list%d@gmail.com' % index, password='testpass'
+            )
+            for index in range(count)
+        ]
+        self.assertEqual(len({user._state.db for user in users}), 3)
+        return users
+
+    def test_list_merges_the_shards(self):
+        """Test the staff list pages through the users of every shard"""
+        users = self.create_users(12)
+        client = APIClient()
+        client.force_authenticate(users[0])
+        users[0].is_staff = True
+        users[0].save()
+
+        emails, url = [], reverse('user:list') + '?page_size=5&fields=email'
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            emails += [row['email'] for row in response.data['results']]
+            url = response.data['next']
+
+        # in the order of the ids, whatever their shard
+        self.assertEqual(emails, [user.email for user in sorted(
+            users, key=lambda user: user.pk
+        )])
+
+    def test_exports_read_every_shard(self):
+        users = self.create_users(12)
+        users[0].is_staff = True
+        users[0].save()
+        client = APIClient()
+        client.force_authenticate(users[0])
+        out = StringIO()
+
+        response = client.get(reverse('user:list'),
+                              {'export': 'csv', 'fields': 'email'})
+        with patch('sys.stdout', out):
+            call_command('export_users', '-', format='csv',
+                         stderr=StringIO())
+
+        self.assertEqual(b''.join(response.streaming_content).decode(
+        ).split()[1:], [user.email for user in sorted(
+            users, key=lambda user: user.pk
+        )])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'email')
+        self.assertEqual(sorted(line.split(',')[0] for line in lines[1:]),
+                         sorted(user.email for user in users))
+
+    def test_admin_reads_and_logs_on_the_shards(self):
+        users = self.create_users(12)
+        staff = users[0]
+        staff.is_staff = staff.is_superuser = True
+        staff.save()
+        other = next(user for user in users
+                     if user._state.db != staff._state.db)
+        client = Client()
+        client.force_login(staff)
+
+        response = client.get(reverse('admin:core_user_changelist'),
+                              {'shard': other._state.db})
+        self.assertContains(response, other.email)
+        response = client.post(
+            reverse('admin:core_user_change', args=[other.pk]),
+            {'email': other.email, 'name': 'Renamed', 'is_active': 'on',
+             'last_login_0': '', 'last_login_1': ''}
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_user_model().objects.using(
+            other._state.db
+        ).get(pk=other.pk).name, 'Renamed')
+        self.assertTrue(LogEntry.objects.using(staff._state.db).filter(
+            user_id=staff.pk, object_id=str(other.pk)
+        ).exists())
+
+    def test_dry_run(self):
+        with sharded(SHARDS[:1]):
+            for index in range(10):
+                get_user_model().objects.create_user(
+                    email='stay%d@gmail.com' % index
+                )
+        out = StringIO()
+
+        call_command('rebalance_shards', dry_run=True, stdout=out,
+                     stderr=StringIO())
+
+        self.assertIn('Would move', out.getvalue())
+        self.assertEqual(
+            get_user_model().objects.using('default').count(), 10
+        )
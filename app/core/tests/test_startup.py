@@ -0,0 +1,186 @@
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+
+from core.importtime import ImportTiming, profile_imports, summarize
+from core.server import PreforkServer
+from core.startup import StartupTimer, ensure_migrated, measure_startup, \
+                         migration_files_fingerprint
+from core.tests.utils import FakeClock
+
+
+class StartupTests(TestCase):
+    """Test the migration check and the timings of manage.py serve"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_path = os.path.join(directory.name, 'state.json')
+        self.migrated = []
+
+    def ensure_migrated(self):
+        return ensure_migrated(
+            'default', self.state_path,
+            lambda using, targets: self.migrated.append((using, targets)),
+        )
+
+    def test_timer_report(self):
+        """Test the breakdown lists the phases and marks the slowest"""
+        clock = FakeClock()
+        timer = StartupTimer(clock=clock)
+        for name, elapsed in (('import', 0.2), ('url resolver', 0.05)):
+            with timer.phase(name):
+                clock.now += elapsed
+
+        self.assertEqual(timer.report(), [
+            'import              200.0 ms  <- slowest',
+            'url resolver         50.0 ms',
+            'total               250.0 ms',
+        ])
+
+    def test_unchanged_migrations_skipped(self):
+        """Test the migration graph is only loaded when something changed"""
+        self.assertEqual(self.ensure_migrated(), 'up to date')
+
+        with patch('django.db.migrations.executor.MigrationExecutor') as ex:
+            self.assertEqual(self.ensure_migrated(), 'skipped')
+            ex.assert_not_called()
+        self.assertEqual(self.migrated, [])
+
+        with patch('core.startup.migration_files_fingerprint',
+                   return_value='changed'):
+            self.assertEqual(self.ensure_migrated(), 'up to date')
+
+    def test_pending_migrations_applied(self):
+        """Test migrate runs when the database is behind"""
+        with patch('django.db.migrations.executor.MigrationExecutor.'
+                   'migration_plan', return_value=[('migration', False)]):
+            self.assertEqual(self.ensure_migrated(), 'migrated')
+        self.assertEqual(self.migrated, [('default', None)])
+
+    def test_manual_migrations_left_out(self):
+        """Test a boot stops before the migrations flagged run_on_boot"""
+        def migration(app_label, name, run_on_boot=True):
+            return SimpleNamespace(app_label=app_label, name=name,
+                                   run_on_boot=run_on_boot)
+        plan = [(migration('auth', '0010'), False),
+                (migration('core', '0005'), False),
+                (migration('core', '0006', run_on_boot=False), False),
+                (migration('core', '0007'), False)]
+
+        with patch('django.db.migrations.executor.MigrationExecutor.'
+                   'migration_plan', return_value=plan):
+            self.assertEqual(self.ensure_migrated(),
+                             'migrated, core.0006 left to apply by hand')
+            self.assertEqual(self.migrated, [
+                ('default', [('auth', '0010'), ('core', '0005')])
+            ])
+            # remembered as nothing, checked again on the next boot
+            self.assertEqual(self.ensure_migrated(),
+                             'migrated, core.0006 left to apply by hand')
+
+    def test_fingerprint_is_stable(self):
+        """Test the fingerprint only depends on the migration files"""
+        self.assertEqual(migration_files_fingerprint(),
+                         migration_files_fingerprint())
+
+    def test_measure_startup(self):
+        """Test the boot phases of a fresh process are timed"""
+        timer = measure_startup()
+
+        self.assertEqual(
+            [name for name, _ in timer.phases],
+            ['import', 'settings', 'app registry', 'url resolver',
+             'middleware'],
+        )
+        self.assertGreater(timer.total, 0)
+
+
+def hello(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode()]
+
+
+def slow(environ, start_response):
+    # outlasts the 0.5s poll of serve_forever, which returns on shutdown
+    time.sleep(1)
+    return hello(environ, start_response)
+
+
+class PreforkServerTests(SimpleTestCase):
+
+    def test_workers_serve_requests(self):
+        """Test the forked workers answer and exit on stop()"""
+        server = PreforkServer(hello, '127.0.0.1', 0, workers=2)
+        server.start()
+        self.addCleanup(server.close)
+        try:
+            host, port = server.address
+            with urlopen('http://%s:%d/' % (host, port), timeout=10) as res:
+                pid = int(res.read())
+            self.assertIn(pid, server.children)
+        finally:
+            server.stop()
+            server.serve()
+        self.assertEqual(server.children, set())
+
+    def test_stop_finishes_requests_in_flight(self):
+        """Test a stopping worker answers the request it is handling"""
+        server = PreforkServer(slow, '127.0.0.1', 0, workers=1)
+        server.start()
+        self.addCleanup(server.close)
+        responses = []
+
+        def request():
+            url = 'http://%s:%d/' % server.address
+            with urlopen(url, timeout=10) as res:
+                responses.append(res.status)
+        client = threading.Thread(target=request)
+        client.start()
+        time.sleep(0.2)
+        server.stop()
+        server.serve()
+        client.join()
+
+        self.assertEqual(responses, [200])
+
+
+class ImportTimeTests(SimpleTestCase):
+    """Test the import profiling of the importtime command"""
+
+    def test_summarize(self):
+        """Test the sections rank the modules, packages and our modules"""
+        timings = [
+            ImportTiming('rest_framework.fields', 0.03, 0.03, 'user.views'),
+            ImportTiming('rest_framework', 0.001, 0.001, 'user.views'),
+            ImportTiming('user.views', 0.002, 0.033, None),
+            ImportTiming('csv', 0.004, 0.004, None),
+        ]
+        summary = summarize(timings, {'user'}, top=2)
+
+        self.assertEqual(summary['modules (self)'], [
+            ('rest_framework.fields', 0.03), ('csv', 0.004),
+        ])
+        self.assertEqual(summary['packages (self)'][0],
+                         ('rest_framework', 0.031))
+        self.assertEqual(summary['project modules (cumulative)'],
+                         [('user.views', 0.033)])
+
+    def test_setup_does_not_import_drf_views(self):
+        """Test the management commands do not load DRF and the views"""
+        modules = {
+            timing.module
+            for timing in profile_imports('setup', cwd=settings.BASE_DIR)
+        }
+
+        self.assertIn('core.models', modules)
+        for module in ('rest_framework.authentication', 'user.views',
+                       'multiprocessing'):
+            self.assertNotIn(module, modules)
@@ -0,0 +1,48 @@
+import io
+
+from django.test import SimpleTestCase
+
+from core.streaming import iter_json_records
+
+
+class IterJsonRecordsTests(SimpleTestCase):
+
+    def parse(self, text, chunk_size=3):
+        """Parse text using tiny chunks so records span several reads"""
+        stream = io.BytesIO(text.encode('utf-8'))
+        return list(iter_json_records(stream, chunk_size=chunk_size))
+
+    def test_json_array(self):
+        """Test the items of a JSON array are returned in order"""
+        records = self.parse(' [{"a": 1}, {"b": "é"} ,{"c": [1, 2]}] ')
+        self.assertEqual(records, [{'a': 1}, {'b': 'é'}, {'c': [1, 2]}])
+
+    def test_many_records_per_chunk(self):
+        """Test a chunk holding many records is parsed from an offset"""
+        text = '[%s]' % ', '.join('{"n": %d}' % n for n in range(500))
+        for chunk_size in (7, 64 * 1024):
+            records = self.parse(text, chunk_size=chunk_size)
+            self.assertEqual(records, [{'n': n} for n in range(500)])
+
+    def test_empty_inputs(self):
+        """Test an empty body or array returns no records"""
+        self.assertEqual(self.parse(''), [])
+        self.assertEqual(self.parse('[ ]'), [])
+
+    def test_ndjson(self):
+        """Test newline delimited JSON is parsed line by line"""
+        records = self.parse('{"a": 1}\n\n{"b": 2}\r\n{"c": 3}')
+        self.assertEqual(records, [{'a': 1}, {'b': 2}, {'c': 3}])
+
+    def test_truncated_array(self):
+        """Test a truncated array raises after yielding the good records"""
+        records = iter_json_records(io.BytesIO(b'[{"a": 1}, {"b"'))
+        self.assertEqual(next(records), {'a': 1})
+        with self.assertRaises(ValueError):
+            next(records)
+
+    def test_record_too_large(self):
+        """Test a single record can not grow the buffer without limit"""
+        stream = io.BytesIO(b'[{"a": "' + b'x' * 100 + b'"}]')
+        with self.assertRaises(ValueError):
+            list(iter_json_records(stream, chunk_size=8, max_record_size=32))
@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import tempfile
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from core import tasks
+from core.tests.utils import FakeClock
+
+
+calls = []
+
+
+@tasks.task('tests.record')
+def record(payload):
+    calls.append(payload)
+
+
+@tasks.task('tests.record_batch', batch=True)
+def record_batch(payloads):
+    calls.append(payloads)
+
+
+@tasks.task('tests.record_or_fail', batch=True, max_retries=1)
+def record_or_fail(payloads):
+    if any(payload.get('fail') for payload in payloads):
+        raise RuntimeError('boom')
+    calls.extend(payloads)
+
+
+@tasks.task('tests.fail', max_retries=1)
+def fail(payload):
+    raise RuntimeError('boom')
+
+
+def run_on_commit_hooks():
+    """Run what transaction.on_commit queued in the TestCase transaction"""
+    hooks, connection.run_on_commit = connection.run_on_commit, []
+    for _, hook in hooks:
+        hook()
+
+
+class BrokerTestsMixin:
+
+    def test_reserve_and_ack(self):
+        """Test reserved messages are hidden until their lease expires"""
+        self.broker.push('tests.record', {'n': 1})
+        self.broker.push('tests.record', {'n': 2})
+
+        messages = self.broker.reserve(10, lease=30)
+        self.assertEqual([m.payload for m in messages], [{'n': 1}, {'n': 2}])
+        self.assertEqual(self.broker.reserve(10, lease=30), [])
+
+        self.broker.ack([messages[0].id])
+        # the worker holding the second message died, it comes back
+        self.clock.now += 31
+        again = self.broker.reserve(10, lease=30)
+        self.assertEqual([m.payload for m in again], [{'n': 2}])
+
+    def test_retry_and_bury(self):
+        """Test retried messages wait for their delay, buried ones are gone"""
+        self.broker.push('tests.record', {'n': 1})
+        message, = self.broker.reserve(10, lease=30)
+
+        self.broker.retry([message.id], delay=10)
+        self.assertEqual(self.broker.reserve(10, lease=30), [])
+        self.clock.now += 10
+        message, = self.broker.reserve(10, lease=30)
+        self.assertEqual(message.attempts, 1)
+
+        self.broker.bury([message.id])
+        self.clock.now += 60
+        self.assertEqual(self.broker.reserve(10, lease=30), [])
+        self.assertEqual(self.broker.stats(), {'pending': 0, 'dead': 1})
+
+
+class MemoryBrokerTests(BrokerTestsMixin, TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.broker = tasks.MemoryBroker(clock=self.clock)
+
+
+class SQLiteBrokerTests(BrokerTestsMixin, TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.broker = tasks.SQLiteBroker(
+            os.path.join(directory.name, 'tasks.sqlite3'), clock=self.clock
+        )
+
+
+@override_settings(TASKS={'BROKER': 'memory'})
+class WorkerTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+        # a fresh queue for every test
+        tasks.reset_broker(setting='TASKS')
+        self.broker = tasks.get_broker()
+        self.worker = tasks.Worker(self.broker, retry_delay=0)
+
+    def test_enqueued_after_commit(self):
+        """Test nothing is queued before the transaction commits"""
+        record.delay({'n': 1})
+        self.assertEqual(self.broker.stats()['pending'], 0)
+
+        run_on_commit_hooks()
+        self.assertEqual(self.broker.stats()['pending'], 1)
+        self.assertEqual(self.worker.run_once(), 1)
+        self.assertEqual(calls, [{'n': 1}])
+        self.assertEqual(self.broker.stats()['pending'], 0)
+
+    def test_broker_failure_is_logged(self):
+        """Test a broker error does not fail the committed request"""
+        with patch.object(self.broker, 'push',
+                          side_effect=sqlite3.OperationalError('readonly')), \
+                self.assertLogs('core.tasks', 'ERROR'):
+            record.delay({'n': 1})
+            run_on_commit_hooks()
+
+        self.assertEqual(self.broker.stats()['pending'], 0)
+
+    def test_batch_task(self):
+        """Test the messages of a batch task are handled in one call"""
+        for n in range(3):
+            self.broker.push('tests.record_batch', {'n': n})
+        self.broker.push('tests.record', {'n': 'single'})
+
+        self.worker.run_once()
+
+        self.assertIn([{'n': 0}, {'n': 1}, {'n': 2}], calls)
+        self.assertIn({'n': 'single'}, calls)
+        self.assertEqual(self.worker.processed, 4)
+
+    def test_failing_task_retried_then_buried(self):
+        """Test a failing message is retried up to max_retries"""
+        self.broker.push('tests.fail', {})
+
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.worker.run_once()
+            self.assertEqual(self.broker.stats(), {'pending': 1, 'dead': 0})
+            self.worker.run_once()
+        self.assertEqual(self.broker.stats(), {'pending': 0, 'dead': 1})
+        self.assertEqual(self.worker.failed, 2)
+
+    def test_failing_batch_split(self):
+        """Test only the failing message of a batch is retried"""
+        for payload in ({'n': 0}, {'fail': True}, {'n': 2}):
+            self.broker.push('tests.record_or_fail', payload)
+
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.worker.run_once()
+
+        self.assertEqual(calls, [{'n': 0}, {'n': 2}])
+        self.assertEqual((self.worker.processed, self.worker.failed), (2, 1))
+        self.assertEqual(self.broker.stats(), {'pending': 1, 'dead': 0})
+
+    def test_unknown_task_buried(self):
+        """Test messages of tasks that do not exist are set aside"""
+        self.broker.push('tests.missing', {})
+
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.worker.run_once()
+
+        self.assertEqual(self.broker.stats(), {'pending': 0, 'dead': 1})
@@ -0,0 +1,61 @@
+import io
+import unittest
+
+from django.contrib.auth.hashers import get_hasher
+from django.test import SimpleTestCase
+
+from core.test_runner import DEFAULT_TEST_RUNNER_OPTIONS, TestRunner, \
+                             TimedRemoteTestResult, TimedTextTestResult
+
+
+def sample_test():
+    # defined here so the test runner does not collect it
+    class Sample(unittest.TestCase):
+
+        def test_one(self):
+            pass
+    return Sample('test_one')
+
+
+class TestRunnerTests(SimpleTestCase):
+    """Test the timings and the hasher of core.test_runner"""
+
+    def test_fast_hasher_enabled(self):
+        """Test the tests hash with the fast hasher"""
+        fast_hasher = DEFAULT_TEST_RUNNER_OPTIONS['FAST_HASHER']
+        self.assertEqual(
+            '%s.%s' % (type(get_hasher()).__module__,
+                       type(get_hasher()).__name__),
+            fast_hasher,
+        )
+
+    def test_durations_recorded(self):
+        """Test the result records the duration of each test"""
+        test = sample_test()
+        result = TimedTextTestResult(
+            unittest.runner._WritelnDecorator(io.StringIO()), False, 0
+        )
+        test.run(result)
+
+        self.assertEqual(list(result.durations), [test.id()])
+
+    def test_remote_durations_replayed(self):
+        """Test the parallel workers send the durations of their tests"""
+        result = TimedRemoteTestResult()
+        sample_test().run(result)
+
+        names = [event[0] for event in result.events]
+        self.assertEqual(
+            names, ['startTest', 'addSuccess', 'addDuration', 'stopTest']
+        )
+        self.assertEqual(result.events[2][1], 0)
+
+    def test_report(self):
+        """Test the report lists the slowest tests first"""
+        report = TestRunner.report({'a': 0.1, 'b': 2.0, 'c': 0.5}, 2)
+
+        self.assertEqual(report.splitlines()[1:], [
+            'Slowest tests (2.60s in total):',
+            '   2.000s  b',
+            '   0.500s  c',
+        ])
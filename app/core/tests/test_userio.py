@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from core.tests.utils import FakeClock
+from core.userio import Progress
+
+
+class UserImportExportTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(content)
+        return path
+
+    def call(self, *args, **options):
+        out, err = StringIO(), StringIO()
+        call_command(*args, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv(self):
+        """Test users are created from a CSV file, duplicates skipped"""
+        get_user_model().objects.create_user('taken@gmail.com', 'testpass')
+        path = self.write('users.csv', (
+            'email,name,password,is_staff\n'
+            'one@GMAIL.COM,One,testpass,true\n'
+            'two@gmail.com,Two,,\n'
+            'taken@gmail.com,Taken,testpass,\n'
+            'not-an-email,Bad,testpass,\n'
+            'three@gmail.com,Three,testpass,0\n'
+        ))
+
+        out, err = self.call('import_users', path, batch_size=2, workers=0)
+
+        self.assertIn('Imported 3 users', out)
+        self.assertIn('3 created, 1 invalid, 1 skipped', err)
+        self.assertIn('rows/sec', err)
+        one = get_user_model().objects.get(email='one@gmail.com')
+        self.assertTrue(one.is_staff)
+        self.assertTrue(one.is_active)
+        self.assertTrue(one.check_password('testpass'))
+        two = get_user_model().objects.get(email='two@gmail.com')
+        self.assertFalse(two.has_usable_password())
+
+    def test_import_ndjson(self):
+        """Test users are created from an NDJSON file"""
+        rows = [
+            {'email': 'one@gmail.com', 'password': 'testpass'},
+            {'email': 'two@gmail.com', 'is_active': False},
+        ]
+        path = self.write(
+            'users.ndjson', '\n'.join(json.dumps(row) for row in rows)
+        )
+
+        self.call('import_users', path, workers=0)
+
+        self.assertFalse(
+            get_user_model().objects.get(email='two@gmail.com').is_active
+        )
+        self.assertEqual(get_user_model().objects.count(), 2)
+
+    def test_import_missing_file(self):
+        """Test a missing file is reported as a command error"""
+        with self.assertRaises(CommandError):
+            self.call('import_users', os.path.join(self.directory, 'no.csv'))
+
+    def test_export_round_trip(self):
+        """Test an exported file imports back the same users"""
+        get_user_model().objects.create_user('one@gmail.com', 'testpass',
+                                             name='One, "quoted"')
+        get_user_model().objects.create_superuser('admin@gmail.com', 'pass')
+        for fmt in ('csv', 'ndjson'):
+            path = os.path.join(self.directory, 'users.' + fmt)
+            out, _ = self.call('export_users', path, chunk_size=1)
+            self.assertIn('Exported 2 users', out)
+
+            with open(path, encoding='utf-8') as exported:
+                self.assertNotIn('pbkdf2', exported.read())
+            before = list(get_user_model().objects.order_by('email').values(
+                'email', 'name', 'is_staff', 'is_superuser'
+            ))
+            get_user_model().objects.all().delete()
+            self.call('import_users', path, workers=0)
+            after = list(get_user_model().objects.order_by('email').values(
+                'email', 'name', 'is_staff', 'is_superuser'
+            ))
+            self.assertEqual(after, before)
+
+
+class ProgressTests(TestCase):
+
+    def test_progress_rate(self):
+        """Test the rows/sec rate is reported periodically"""
+        clock = FakeClock()
+        stream = StringIO()
+        progress = Progress(stream, every=2, clock=clock)
+
+        progress.add(created=10)
+        self.assertEqual(stream.getvalue(), '')
+        clock.now = 2
+        progress.add(created=10, skipped=10)
+
+        self.assertEqual(stream.getvalue(),
+                         '30 rows (20 created, 10 skipped), 15 rows/sec')
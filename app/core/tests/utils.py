@@ -0,0 +1,8 @@
+class FakeClock:
+    """Clock we can move forward by hand"""
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,244 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+
+from core.sharding import get_shards, is_sharded
+from core.streaming import iter_json_records
+
+
+# the columns written by export_users and read back by import_users, which
+# also reads an optional raw 'password'
+USER_COLUMNS = ('email', 'name', 'is_active', 'is_staff', 'is_superuser')
+TRUE_VALUES = {'1', 't', 'true', 'y', 'yes'}
+FALSE_VALUES = {'0', 'f', 'false', 'n', 'no'}
+
+
+def guess_format(path, default='csv'):
+    """Return 'csv' or 'ndjson' from the extension of path"""
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.json', '.ndjson', '.jsonl')):
+        return 'ndjson'
+    return default
+
+
+def read_rows(stream, fmt):
+    """Yield the rows of a binary CSV or JSON/NDJSON stream as dicts"""
+    if fmt == 'csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        yield from csv.DictReader(text)
+    else:
+        yield from iter_json_records(stream)
+
+
+def _flag(value, default):
+    # a missing column or an empty CSV cell
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError('Invalid boolean %r' % value)
+
+
+def clean_row(row):
+    """Return the row with the user columns normalized, raise ValueError"""
+    email = (row.get('email') or '').strip()
+    if not email or '@' not in email:
+        raise ValueError('Invalid email %r' % email)
+    return {
+        'email': get_user_model().objects.normalize_email(email),
+        'name': (row.get('name') or '').strip()[:255],
+        'password': row.get('password') or None,
+        'is_active': _flag(row.get('is_active'), True),
+        'is_staff': _flag(row.get('is_staff'), False),
+        'is_superuser': _flag(row.get('is_superuser'), False),
+    }
+
+
+class Progress:
+    """Reports the rows handled and the rate to a stream every `every` s"""
+
+    def __init__(self, stream, every=2, clock=time.monotonic):
+        self.stream = stream
+        self.every = every
+        self._clock = clock
+        self.start = self._last = clock()
+        self.counts = {}
+
+    def add(self, **counts):
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        if self._clock() - self._last >= self.every:
+            self.report()
+
+    @property
+    def rows(self):
+        return sum(self.counts.values())
+
+    def rate(self):
+        elapsed = self._clock() - self.start
+        return self.rows / elapsed if elapsed else 0.0
+
+    def report(self):
+        self._last = self._clock()
+        details = ', '.join(
+            '%d %s' % (count, key)
+            for key, count in sorted(self.counts.items())
+        )
+        self.stream.write('%d rows (%s), %.0f rows/sec' % (
+            self.rows, details or 'none', self.rate()
+        ))
+
+
+def _copy_users(connection, users):
+    """Insert users with COPY, skipping the emails that already exist
+
+    COPY aborts on the first duplicate so the rows go through a temporary
+    table and are moved with INSERT ... ON CONFLICT DO NOTHING.
+    Returns how many users were created.
+    """
+    table = connection.ops.quote_name(get_user_model()._meta.db_table)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for user in users:
+        writer.writerow([
+            user['email'], user['name'], user['password'],
+            't' if user['is_active'] else 'f',
+            't' if user['is_staff'] else 'f',
+            't' if user['is_superuser'] else 'f',
+        ])
+    buffer.seek(0)
+
+    columns = 'email, name, password, is_active, is_staff, is_superuser'
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS user_import ('
+                ' email varchar(255), name varchar(255),'
+                ' password varchar(128), is_active boolean,'
+                ' is_staff boolean, is_superuser boolean'
+                ') ON COMMIT DELETE ROWS'
+            )
+            # copy_expert is psycopg2's, the django cursor wrapper
+            # exposes it on the underlying cursor
+            cursor.cursor.copy_expert(
+                'COPY user_import (%s) FROM STDIN WITH (FORMAT csv)'
+                % columns,
+                buffer,
+            )
+            cursor.execute(
+                'INSERT INTO {table} ({columns}, updated_at, version) '
+                'SELECT DISTINCT ON (email) {columns}, now(), 1 '
+                'FROM user_import '
+                'ON CONFLICT (email) DO NOTHING'.format(
+                    table=table, columns=columns,
+                )
+            )
+            return cursor.rowcount
+
+
+def import_users(rows, using, batch_size, hasher, progress):
+    """Create the users of rows, batch_size rows in memory at a time
+
+    Sharded, the users go to their shards whatever `using` is.
+    """
+    connection = connections[using]
+    sharded = is_sharded()
+    manager = get_user_model().objects.db_manager(None if sharded else using)
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+
+        users = []
+        invalid = 0
+        for row in chunk:
+            try:
+                users.append(clean_row(row))
+            except ValueError:
+                invalid += 1
+        # hashed in the worker processes of the pool
+        hashed = hasher([user['password'] for user in users])
+        for user, password in zip(users, hashed):
+            user['password'] = password
+
+        if connection.vendor == 'postgresql' and not sharded:
+            created = _copy_users(connection, users)
+        else:
+            # the users are already hashed, bulk_create_users must not
+            # hash the hashes again
+            created = sum(
+                is_new for _, is_new in manager.bulk_create_users(
+                    users, batch_size=len(users) or 1,
+                    hasher=lambda passwords: passwords,
+                )
+            )
+        progress.add(created=created, skipped=len(users) - created,
+                     invalid=invalid)
+
+
+def _export_query(using):
+    return get_user_model().objects.using(using).order_by('id').values_list(
+        *USER_COLUMNS
+    )
+
+
+def export_users(out, fmt, using, chunk_size, progress):
+    """Write every user to the text stream out, in constant memory
+
+    Sharded, the shards are exported one after the other, whatever using
+    is.
+    """
+    for index, alias in enumerate(get_shards() or [using]):
+        _export_database(out, fmt, alias, chunk_size, progress,
+                         header=index == 0)
+
+
+def _export_database(out, fmt, using, chunk_size, progress, header):
+    connection = connections[using]
+    if fmt == 'csv' and connection.vendor == 'postgresql':
+        # the server formats the CSV, the rows never become python objects
+        sql, params = _export_query(using).query.get_compiler(
+            using
+        ).as_sql()
+        with connection.cursor() as cursor:
+            query = cursor.cursor.mogrify(sql, params).decode()
+            if header:
+                out.write(','.join(USER_COLUMNS) + '\n')
+            cursor.cursor.copy_expert(
+                'COPY (%s) TO STDOUT WITH (FORMAT csv)' % query, out
+            )
+            progress.add(exported=cursor.rowcount)
+        return
+
+    writer = csv.writer(out) if fmt == 'csv' else None
+    if writer is not None and header:
+        writer.writerow(USER_COLUMNS)
+    # iterator() streams through a server side cursor where supported
+    rows = _export_query(using).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        for row in chunk:
+            if writer is not None:
+                # booleans written the way COPY writes them
+                writer.writerow([
+                    ('t' if value else 'f') if isinstance(value, bool)
+                    else value
+                    for value in row
+                ])
+            else:
+                out.write(json.dumps(dict(zip(USER_COLUMNS, row))) + '\n')
+        progress.add(exported=len(chunk))
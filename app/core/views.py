@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from core.metrics import registry
+
+
+def metrics(request):
+    """Scrape endpoint exposing the metrics in the prometheus format"""
+    token = getattr(settings, 'PERF_METRICS_TOKEN', None)
+    if token:
+        # scrapers authenticate with "Authorization: Bearer <token>"
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if not constant_time_compare(header, 'Bearer ' + token):
+            return HttpResponseForbidden()
+    elif not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
@@ -3,3 +3,14 @@ from django.apps import AppConfig
 
 class UserConfig(AppConfig):
     name = 'user'
+
+    def ready(self):
+        from core.metrics import LazyCollector, registry
+        # connect the cache invalidation signal handlers
+        from user import signals  # noqa: F401
+
+        # user.authentication imports DRF, which the management commands
+        # never need, the modules are only loaded by their first use
+        for module in ('user.authentication', 'user.backends',
+                       'user.singleflight', 'user.throttling'):
+            registry.register_collector(LazyCollector(module))
@@ -0,0 +1,340 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token
+
+from core.routers import pin_if_user_wrote
+from core.sharding import is_sharded, shard_for_token, shard_for_user_id
+from user.backends import get_permission_cache
+from user.cache import LRUCache
+from user.singleflight import get_group
+from user.tokens import is_expired
+
+
+DEFAULT_TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    # name of an entry of settings.CACHES shared by all the processes,
+    # None keeps the cache local to the process
+    'SHARED_CACHE': None,
+    'KEY_PREFIX': 'user:token:',
+}
+
+
+# the only columns the authenticated requests need, the password hash and
+# the rest of the row are never loaded
+HOT_FIELDS = (
+    'id', 'email', 'name', 'is_active', 'is_staff', 'is_superuser',
+    'version', 'updated_at',
+)
+
+
+class CachedUser:
+    """Compact, read only stand-in for the authenticated User
+
+    It quacks like the model for what the request handling uses (the hot
+    fields, is_authenticated, has_perm...) without the cost of building a
+    model instance. Permissions come from user.backends.PermissionCache,
+    with the same rules as ModelBackend.
+    """
+    __slots__ = HOT_FIELDS + ('_perms',)
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, *values):
+        for name, value in zip(HOT_FIELDS, values):
+            setattr(self, name, value)
+        self._perms = None
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_username(self):
+        return self.email
+
+    def __str__(self):
+        return self.email
+
+    def __eq__(self, other):
+        if not isinstance(other, (CachedUser, get_user_model())):
+            return NotImplemented
+        return self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def get_all_permissions(self, obj=None):
+        if not self.is_active or obj is not None:
+            return set()
+        if self._perms is None:
+            self._perms = get_permission_cache().get(
+                self.id, self.is_superuser
+            )
+        return set(self._perms)
+
+    def has_perm(self, perm, obj=None):
+        if self.is_active and self.is_superuser:
+            return True
+        return perm in self.get_all_permissions(obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+    def has_module_perms(self, app_label):
+        if self.is_active and self.is_superuser:
+            return True
+        return any(
+            perm[:perm.index('.')] == app_label
+            for perm in self.get_all_permissions()
+        )
+
+
+def load_snapshot(key):
+    """Return the picklable snapshot of a token and its user, None if unknown
+
+    A single query reading the token and the hot fields of its user, on
+    the shard the key names when sharded. It reads from the primary: a
+    replica may not have the change that invalidated the previous
+    snapshot yet, which would then be cached for the whole TTL.
+    """
+    tokens = Token.objects.using(DEFAULT_DB_ALIAS)
+    if is_sharded():
+        shard = shard_for_token(key)
+        if shard is None:
+            # not one of ours
+            return None
+        tokens = tokens.using(shard)
+    return tokens.filter(key=key).values_list(
+        'created', *('user__' + name for name in HOT_FIELDS)
+    ).first()
+
+
+def load_and_cache_snapshot(cache, key):
+    # an invalidation landing while the query runs must not be overwritten
+    # by what it read
+    stamp = cache.stamp()
+    snapshot = load_snapshot(key)
+    if snapshot is not None:
+        cache.set(key, snapshot, stamp=stamp)
+    return snapshot
+
+
+def restore_snapshot(key, snapshot):
+    """Rebuild the (user, token) pair authenticate_credentials returns"""
+    created = snapshot[0]
+    user = CachedUser(*snapshot[1:])
+    token = Token(key=key, user_id=user.id, created=created)
+    return user, token
+
+
+class TokenCache:
+    """Two tier cache mapping a token key to a user snapshot
+
+    With a shared tier, every invalidation bumps a generation counter
+    kept in it and the local entries are stamped with the generation they
+    were stored at: a token or user changed by any process is never served
+    from the local tier of another one. The counters are read along with
+    the shared entry, one round trip per lookup. clear() bumps an epoch the
+    shared entries are stamped with, which drops them as well.
+
+    Without a shared tier the entries are local to the process, the other
+    processes see a change once their copy expired (TTL).
+    A snapshot read from the database is stored with the stamp() taken
+    before the query, and dropped if an invalidation happened meanwhile.
+    """
+
+    def __init__(self, max_size, ttl, shared_cache=None, key_prefix=''):
+        self.local = LRUCache(max_size=max_size, ttl=ttl)
+        self.ttl = ttl
+        self.shared = caches[shared_cache] if shared_cache else None
+        self.key_prefix = key_prefix
+        self.shared_hits = 0
+        # invalidations of this process, the stamp without a shared tier
+        self._generation = 0
+
+    @classmethod
+    def from_settings(cls):
+        """Build the cache from settings.USER_TOKEN_CACHE"""
+        conf = dict(DEFAULT_TOKEN_CACHE)
+        conf.update(getattr(settings, 'USER_TOKEN_CACHE', {}))
+        return cls(
+            max_size=conf['MAX_SIZE'],
+            ttl=conf['TTL'],
+            shared_cache=conf['SHARED_CACHE'],
+            key_prefix=conf['KEY_PREFIX'],
+        )
+
+    def _read_shared(self, key=None):
+        """Return the (generation, epoch) stamp and the shared entry of key"""
+        names = [self.key_prefix + 'generation', self.key_prefix + 'epoch']
+        if key is not None:
+            names.append(self.key_prefix + key)
+        values = self.shared.get_many(names)
+        stamp = (values.get(names[0], 0), values.get(names[1], 0))
+        entry = values.get(names[-1]) if key is not None else None
+        if entry is not None and entry[0] != stamp[1]:
+            # stored before the last clear()
+            entry = None
+        return stamp, entry and entry[1]
+
+    def _bump(self, name):
+        name = self.key_prefix + name
+        try:
+            self.shared.incr(name)
+        except ValueError:
+            # never set or evicted, every stamp becomes stale anyway
+            if not self.shared.add(name, 1, None):
+                self.shared.incr(name)
+
+    def get(self, key):
+        """Return the snapshot for key, looking at the local tier first"""
+        entry = self.local.get(key)
+        if self.shared is None:
+            return entry and entry[1]
+        stamp, snapshot = self._read_shared(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        if snapshot is not None:
+            # promote it so the next request does not unpickle it again
+            self.shared_hits += 1
+            self.local.set(key, (stamp, snapshot))
+        return snapshot
+
+    def stamp(self):
+        """Return the current generation, to pass to set() later"""
+        if self.shared is None:
+            return self._generation
+        return self._read_shared()[0]
+
+    def set(self, key, snapshot, stamp=None):
+        """Store snapshot, unless invalidated since stamp() gave stamp"""
+        if self.shared is None:
+            current = self._generation
+        else:
+            current, _ = self._read_shared()
+        if stamp is not None and stamp != current:
+            return
+        if self.shared is not None:
+            self.shared.set(self.key_prefix + key, (current[1], snapshot),
+                            self.ttl)
+            self.local.set(key, (current, snapshot))
+        else:
+            self.local.set(key, (None, snapshot))
+
+    def invalidate(self, key):
+        """Drop a single token key from both tiers, in every process"""
+        self._generation += 1
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(self.key_prefix + key)
+            self._bump('generation')
+
+    def invalidate_user(self, user_pk):
+        """Drop every cached token belonging to the given user"""
+        keys = Token.objects.using(
+            shard_for_user_id(user_pk)
+        ).filter(user_id=user_pk).values_list(
+            'key', flat=True
+        )
+        for key in keys:
+            self.invalidate(key)
+        self.invalidate_issued(user_pk)
+
+    # the token issued to a user (see user.tokens) is kept in the same
+    # tiers, under a key that can not collide with a 40 hex digits token
+
+    def get_issued(self, user_pk):
+        """Return the (key, created) of the token of a user, if cached"""
+        return self.get('issued:%s' % user_pk)
+
+    def set_issued(self, user_pk, key, created):
+        self.set('issued:%s' % user_pk, (key, created))
+
+    def invalidate_issued(self, user_pk):
+        self.invalidate('issued:%s' % user_pk)
+
+    def clear(self):
+        """Drop every entry of both tiers"""
+        self._generation += 1
+        self.local.clear()
+        if self.shared is not None:
+            self._bump('epoch')
+        self.shared_hits = 0
+
+    def stats(self):
+        """Return the hit/miss counters of the cache"""
+        stats = self.local.stats()
+        # a local miss served by the shared tier is still a hit overall
+        stats['shared_hits'] = self.shared_hits
+        stats['misses'] -= self.shared_hits
+        return stats
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    """Return the process wide token cache, creating it on first use"""
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache.from_settings()
+    return _token_cache
+
+
+@receiver(setting_changed)
+def reset_token_cache(**kwargs):
+    """Rebuild the cache when the tests override its settings"""
+    global _token_cache
+    if kwargs['setting'] == 'USER_TOKEN_CACHE':
+        _token_cache = None
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """Token authentication that caches the token -> user lookup
+
+    request.user is a CachedUser, views that modify the user have to load
+    the model instance themselves.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        snapshot = cache.get(key)
+        if snapshot is None:
+            # cache miss, do the same Token + User query DRF does and
+            # remember the result for the next requests. The concurrent
+            # requests of the same token share a single query.
+            snapshot = get_group('token').do(
+                key, lambda: load_and_cache_snapshot(cache, key)
+            )
+            if snapshot is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        user, token = restore_snapshot(key, snapshot)
+        if is_expired(token.created):
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        # token clients do not send the pin cookie back
+        pin_if_user_wrote(user.pk)
+
+        return (user, token)
+
+
+def collect_metrics():
+    """Gauges of the token cache, see core.metrics"""
+    if _token_cache is None:
+        return []
+    return [
+        ('token_cache_' + key, {}, value)
+        for key, value in _token_cache.stats().items()
+    ]
@@ -0,0 +1,158 @@
+import copy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.core.signals import setting_changed
+from django.db.models import Q
+from django.dispatch import receiver
+
+from core.sharding import shard_for_user_id
+from user.cache import LRUCache
+from user.singleflight import get_group
+
+
+DEFAULT_PERMISSION_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+}
+
+
+def load_permissions(user_id, is_superuser=False):
+    """Return the "app_label.codename" permissions of a user in one query
+
+    Covers both the permissions given to the user and the ones of their
+    groups, the same set ModelBackend.get_all_permissions builds with two
+    queries. Sharded, the memberships are read from the user's shard.
+    """
+    permissions = Permission.objects.using(shard_for_user_id(user_id))
+    if not is_superuser:
+        permissions = permissions.filter(
+            Q(user=user_id) | Q(group__user=user_id)
+        )
+    return frozenset(
+        '%s.%s' % (app_label, codename)
+        for app_label, codename in permissions.values_list(
+            'content_type__app_label', 'codename'
+        ).distinct()
+    )
+
+
+class PermissionCache:
+    """Process local cache of the permission set of each user
+
+    Entries are dropped by the signal handlers in user.signals when a
+    user, their groups or permissions change; other processes see the
+    change once their entry expires.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.local = LRUCache(max_size=max_size, ttl=ttl)
+
+    @classmethod
+    def from_settings(cls):
+        """Build the cache from settings.USER_PERMISSION_CACHE"""
+        conf = dict(DEFAULT_PERMISSION_CACHE)
+        conf.update(getattr(settings, 'USER_PERMISSION_CACHE', {}))
+        return cls(max_size=conf['MAX_SIZE'], ttl=conf['TTL'])
+
+    def get(self, user_id, is_superuser=False):
+        """Return the permissions of a user, loading them on a miss"""
+        key = (user_id, is_superuser)
+        permissions = self.local.get(key)
+        if permissions is None:
+            permissions = load_permissions(user_id, is_superuser)
+            self.local.set(key, permissions)
+        return permissions
+
+    def invalidate(self, user_id):
+        for is_superuser in (False, True):
+            self.local.delete((user_id, is_superuser))
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self):
+        return self.local.stats()
+
+
+_permission_cache = None
+
+
+def get_permission_cache():
+    """Return the process wide permission cache, creating it on first use"""
+    global _permission_cache
+    if _permission_cache is None:
+        _permission_cache = PermissionCache.from_settings()
+    return _permission_cache
+
+
+@receiver(setting_changed)
+def reset_permission_cache(**kwargs):
+    """Rebuild the cache when the tests override its settings"""
+    global _permission_cache
+    if kwargs['setting'] == 'USER_PERMISSION_CACHE':
+        _permission_cache = None
+
+
+class CachedPermissionBackend(ModelBackend):
+    """ModelBackend reading the permission sets from the PermissionCache
+
+    The admin checks permissions on every page, this saves the user and
+    group permission queries ModelBackend runs once per request.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        """ModelBackend.authenticate, sharing the concurrent email lookups
+
+        Each caller gets its own copy of the user, the login saves it.
+        """
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        try:
+            user = copy.deepcopy(get_group('email').do(
+                username,
+                lambda: UserModel._default_manager.get_by_natural_key(
+                    username
+                ),
+            ))
+        except UserModel.DoesNotExist:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user
+            UserModel().set_password(password)
+        else:
+            if (user.check_password(password) and
+                    self.user_can_authenticate(user)):
+                return user
+
+    def get_user(self, user_id):
+        """ModelBackend.get_user, on the user's shard when sharded"""
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.db_manager(
+                shard_for_user_id(user_id)
+            ).get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            user_obj._perm_cache = set(get_permission_cache().get(
+                user_obj.pk, user_obj.is_superuser
+            ))
+        return user_obj._perm_cache
+
+
+def collect_metrics():
+    """Gauges of the permission cache, see core.metrics"""
+    if _permission_cache is None:
+        return []
+    return [
+        ('permission_cache_' + key, {}, value)
+        for key, value in _permission_cache.stats().items()
+    ]
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user.tokens import purge_expired_tokens, token_settings
+
+
+class Command(BaseCommand):
+    """Django command deleting the expired API tokens"""
+    help = ('Delete the tokens older than USER_TOKEN["EXPIRES_AFTER"] in '
+            'small batches, meant to run periodically (e.g. from cron)')
+
+    # run from cron, the checks ran when the app was deployed
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=token_settings()['PURGE_BATCH_SIZE'])
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='seconds to pause between two batches')
+
+    def handle(self, *args, **options):
+        if token_settings()['EXPIRES_AFTER'] is None:
+            self.stdout.write('Tokens do not expire, nothing to purge')
+            return
+
+        deleted = 0
+        for count in purge_expired_tokens(options['batch_size']):
+            deleted += count
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted %d expired token(s)' % deleted
+        ))
@@ -0,0 +1,35 @@
+from django.conf import settings
+
+from rest_framework.pagination import CursorPagination
+
+
+DEFAULT_USER_LIST = {
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+    # rows fetched per round trip of the server side cursor when exporting
+    'EXPORT_CHUNK_SIZE': 2000,
+}
+
+
+def list_settings():
+    """Return settings.USER_LIST with its defaults filled in"""
+    conf = dict(DEFAULT_USER_LIST)
+    conf.update(getattr(settings, 'USER_LIST', {}))
+    return conf
+
+
+class UserCursorPagination(CursorPagination):
+    """Keyset pagination over the user ids
+
+    Each page is a `WHERE id > last_id ORDER BY id LIMIT n` query, so the
+    last page of millions of users is as cheap as the first one and there
+    is no COUNT(*) at all.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        conf = list_settings()
+        self.page_size = conf['PAGE_SIZE']
+        self.max_page_size = conf['MAX_PAGE_SIZE']
+        return super().get_page_size(request)
@@ -3,12 +3,21 @@ from django.utils.translation import ugettext_lazy as _  # Whenever we output
 #   a message to the screen by using this we can easily trnasform it to be in
 #   another language
 
-from rest_framework import serializers
+from rest_framework import exceptions, serializers
+
+from core.metrics import TimedSerializerMixin
+from core.serializers import CompiledReadMixin
+from user.tasks import provision_token
+from user.throttling import get_client_ip, get_login_limiter
 
 
 # by using the rest_framework serializer ModelSerializer we get a build in
 # functionality to send objects and read objects from the database.
-class UserSerializer(serializers.ModelSerializer):
+# TimedSerializerMixin reports the time spent in the serializer to the
+# request metrics (see core.middleware.PerformanceMiddleware) and
+# CompiledReadMixin skips the per instance field introspection on reads
+class UserSerializer(TimedSerializerMixin, CompiledReadMixin,
+                     serializers.ModelSerializer):
     """Serializer for the users object"""
 
     class Meta:
@@ -29,7 +38,10 @@ class UserSerializer(serializers.ModelSerializer):
         """Create a new user with encrypted password and returns the user"""
         # we want to use our model create user as it will make sure the
         # password is encrypted
-        return get_user_model().objects.create_user(**validated_data)
+        user = get_user_model().objects.create_user(**validated_data)
+        # the rest of the signup runs in a worker after the row committed
+        provision_token.delay({'user_id': user.pk})
+        return user
 
     # the instance is going to be the model linked to our model serializer in
     # this case the user object.
@@ -49,7 +61,38 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class AuthTokenSerializer(serializers.Serializer):
+# Read only view of the users for the staff list/export endpoint. The
+# `fields` entry of the context restricts the output to those fields.
+class UserListSerializer(UserSerializer):
+    """Serializer for the users listed to the staff"""
+
+    class Meta(UserSerializer.Meta):
+        fields = ('id', 'email', 'name', 'is_active', 'is_staff',
+                  'last_login')
+        read_only_fields = fields
+        extra_kwargs = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.context.get('fields')
+        # leave self.fields alone when everything is selected, so the
+        # compiled read path is used
+        if selected and set(selected) != set(self.Meta.fields):
+            for name in set(self.fields) - set(selected):
+                self.fields.pop(name)
+
+
+# Rows of the bulk create endpoint only have their shape validated here, the
+# uniqueness of the email is checked for a whole batch at once by
+# UserManager.bulk_create_users instead of one query per row.
+class BulkUserRowSerializer(serializers.Serializer):
+    """Serializer for a single row of a bulk user creation"""
+    email = serializers.EmailField(max_length=255)
+    password = serializers.CharField(min_length=5, trim_whitespace=False)
+    name = serializers.CharField(max_length=255, required=False)
+
+
+class AuthTokenSerializer(TimedSerializerMixin, serializers.Serializer):
     """Serializer for the user authentication object"""
     email = serializers.CharField()  # make sure it is character field
     password = serializers.CharField(  # no trimming and type is password
@@ -61,15 +104,28 @@ class AuthTokenSerializer(serializers.Serializer):
         """Validate and authenticate the user"""
         email = attrs.get('email')
         password = attrs.get('password')
+        request = self.context.get('request')
+
+        # reject clients that keep failing before touching the database or
+        # running the (expensive) password hash
+        limiter = get_login_limiter()
+        client_ip = get_client_ip(request)
+        wait = limiter.retry_after(email, client_ip)
+        if wait is not None:
+            raise exceptions.Throttled(wait=wait)
 
+        # a full hashing pool raises HashingBusy, which
+        # core.exceptions.exception_handler answers with a 429
         user = authenticate(
-            request=self.context.get('request'),
+            request=request,
             username=email,
             password=password
         )
         if not user:
+            limiter.record_failure(email, client_ip)
             msg = _('Unable to authenticate with provided credentials')
             raise serializers.ValidationError(msg, code='authentication')
+        limiter.reset(email, client_ip)
 
         # in the validation we need to return the attributes back with the
         # user in it
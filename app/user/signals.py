@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+                                     pre_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from core.sharding import token_key
+from user.backends import get_permission_cache
+
+
+def get_token_cache():
+    # imported on first use, user.authentication pulls in DRF
+    from user.authentication import get_token_cache
+    return get_token_cache()
+
+
+@receiver(pre_save, sender=Token)
+def shard_token_key(sender, instance, **kwargs):
+    """Make the keys DRF generates (Token.save) start with their bucket"""
+    if instance._state.adding:
+        instance.key = token_key(instance.user_id, instance.key)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Forget a token as soon as it is deleted (logout, user deleted...)"""
+    get_token_cache().invalidate(instance.key)
+    get_token_cache().invalidate_issued(instance.user_id)
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_updated_user(sender, instance, created, **kwargs):
+    """Forget the cached snapshots of a user that has just been changed"""
+    # a brand new user can not have a token yet
+    if not created:
+        get_token_cache().invalidate_user(instance.pk)
+        # is_active or is_superuser may have changed
+        get_permission_cache().invalidate(instance.pk)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """Forget the permissions of users whose groups/permissions changed"""
+    if not action.startswith('post_'):
+        return
+    cache = get_permission_cache()
+    if not reverse:
+        cache.invalidate(instance.pk)
+    elif pk_set:
+        # the instance is the group or permission, pk_set the users
+        for user_pk in pk_set:
+            cache.invalidate(user_pk)
+    else:
+        # cleared from the group/permission side, the users are unknown
+        cache.clear()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    """Forget every permission set, any number of users are affected"""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        get_permission_cache().clear()
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+
+
+class _Call:
+    """A call in flight and the callers waiting for its result"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        # (loop, future) of the asyncio callers
+        self.futures = []
+        self.result = None
+        self.error = None
+
+    def resolve(self, future):
+        if future.cancelled():
+            return
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            future.set_result(self.result)
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Coalesces the concurrent calls made for the same key
+
+    The first caller of a key runs the function, the callers arriving
+    while it runs wait for it and get its result (or its exception)
+    instead of running it again. Nothing is cached: once the call returns
+    the next caller runs the function anew. A waiter may get the result of
+    a call that started just before it arrived, which is no staler than
+    the caches in front of these lookups.
+
+    Threads call do(), coroutines do_async(); both kinds share the calls
+    in flight. do() blocks, it must not be called from an event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def _join(self, key):
+        """Return (call, True if the caller has to run it)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.calls += 1
+            return call, True
+
+    def _leave(self, key, call, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+            call.result = result
+            call.error = error
+            call.event.set()
+            # no coroutine can add itself once the event is set
+            futures = call.futures
+        for loop, future in futures:
+            loop.call_soon_threadsafe(call.resolve, future)
+
+    def do(self, key, func):
+        """Return func(), or the result of the func() running for key"""
+        call, leader = self._join(key)
+        if not leader:
+            call.event.wait()
+            return call.outcome()
+        try:
+            result = func()
+        except BaseException as exc:
+            self._leave(key, call, error=exc)
+            raise
+        self._leave(key, call, result)
+        return result
+
+    async def do_async(self, key, func):
+        """Coroutine version of do(), func is a coroutine function"""
+        call, leader = self._join(key)
+        if not leader:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            with self._lock:
+                done = call.event.is_set()
+                if not done:
+                    call.futures.append((loop, future))
+            if done:
+                return call.outcome()
+            return await future
+        try:
+            result = await func()
+        except BaseException as exc:
+            self._leave(key, call, error=exc)
+            raise
+        self._leave(key, call, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            total = self.calls + self.shared
+            return {
+                'calls': self.calls,
+                # the queries saved
+                'shared': self.shared,
+                'shared_ratio': self.shared / total if total else 0.0,
+                'in_flight': len(self._calls),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.calls = self.shared = 0
+
+
+# name -> SingleFlight, see get_group
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name):
+    """Return the process wide SingleFlight of the given name"""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight()
+        return group
+
+
+def collect_metrics():
+    """Gauges of the single-flight groups, see core.metrics"""
+    with _groups_lock:
+        groups = sorted(_groups.items())
+    return [
+        ('singleflight_' + key, {'group': name}, value)
+        for name, group in groups
+        for key, value in group.stats().items()
+    ]
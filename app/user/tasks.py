@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, router, transaction
+
+from rest_framework.authtoken.models import Token
+
+from core.sharding import shard_for_user_id
+from core.tasks import task
+from user.tokens import new_key
+
+
+@task('user.provision_token', batch=True)
+def provision_token(payloads):
+    """Create the API token of newly signed up users
+
+    Runs for a whole batch of signups at once: one query for the users
+    still there, one for the tokens that already exist (a message may be
+    delivered twice) and one INSERT, per shard the users are on.
+    """
+    shards = {}
+    for payload in payloads:
+        user_id = payload['user_id']
+        using = shard_for_user_id(user_id) or router.db_for_write(Token)
+        shards.setdefault(using, set()).add(user_id)
+    for using, user_ids in shards.items():
+        # users deleted since they signed up get no token
+        user_ids = set(get_user_model().objects.using(using).filter(
+            pk__in=user_ids
+        ).values_list('pk', flat=True))
+        tokens = Token.objects.using(using)
+        existing = set(tokens.filter(user_id__in=user_ids).values_list(
+            'user_id', flat=True
+        ))
+        # bulk_create skips Token.save(), which is what sets the key
+        new = [Token(user_id=user_id, key=new_key(user_id))
+               for user_id in sorted(user_ids - existing)]
+        try:
+            with transaction.atomic(using=using):
+                tokens.bulk_create(new)
+        except IntegrityError:
+            # a login (issue_token) or a deletion got in between, insert
+            # them one by one and skip the ones that conflict
+            for token in new:
+                try:
+                    with transaction.atomic(using=using):
+                        token.save(using=using, force_insert=True)
+                except IntegrityError:
+                    pass
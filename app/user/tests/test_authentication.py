@@ -0,0 +1,261 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core import routers
+from core.tests.utils import FakeClock
+from user.authentication import CachedTokenAuthentication, CachedUser, \
+                                TokenCache, get_token_cache, \
+                                load_and_cache_snapshot, load_snapshot
+from user.backends import get_permission_cache
+from user.cache import LRUCache
+
+
+ME_URL = reverse('user:me')
+
+
+class LRUCacheTests(TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        """Test the cache never grows beyond max_size"""
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # reading 'a' makes 'b' the least recently used entry
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_entries_expire(self):
+        """Test entries are not returned once their TTL has passed"""
+        clock = FakeClock()
+        cache = LRUCache(max_size=10, ttl=5, clock=clock)
+        cache.set('a', 1)
+        clock.now = 4
+        self.assertEqual(cache.get('a'), 1)
+        clock.now = 5
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test the token cache used by the private user endpoints"""
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            email='cached@gmail.com',
+            password='testpass',
+            name='Cached Name',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_cache_hit_makes_no_queries(self):
+        """Test a second request with the same token does not hit the db"""
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.data['email'], self.user.email)
+        stats = get_token_cache().stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_invalid_token(self):
+        """Test an unknown token is still rejected"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token wrong')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_is_invalidated(self):
+        """Test a deleted token can not be used even if it was cached"""
+        self.client.get(ME_URL)
+        self.token.delete()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_updated_user_is_invalidated(self):
+        """Test the cache does not serve a stale user after an update"""
+        self.client.get(ME_URL)
+        res = self.client.patch(ME_URL, {'name': 'New Name'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.data['name'], 'New Name')
+
+    def test_inactive_user_rejected(self):
+        """Test a deactivated user can not authenticate any longer"""
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(USER_TOKEN_CACHE={'SHARED_CACHE': 'default'})
+    def test_shared_cache_tier(self):
+        """Test a snapshot stored by another process is used"""
+        self.client.get(ME_URL)
+        # simulate a fresh process that only has the shared tier
+        get_token_cache().local.clear()
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_token_cache().stats()['shared_hits'], 1)
+
+    def test_other_processes_see_invalidations(self):
+        """Test a change made elsewhere is not served from the local tier"""
+        first, second = (TokenCache(max_size=10, ttl=60,
+                                    shared_cache='default')
+                         for _ in range(2))
+        first.set('key', ('snapshot',))
+        self.assertEqual(second.get('key'), ('snapshot',))
+
+        first.invalidate('key')
+        self.assertIsNone(second.get('key'))
+
+        second.set('key', ('new snapshot',))
+        first.clear()
+        self.assertIsNone(second.get('key'))
+        self.assertIsNone(first.get('key'))
+
+    def test_invalidation_during_the_load_wins(self):
+        """Test a snapshot invalidated while it was read is not cached"""
+        for conf in ({}, {'SHARED_CACHE': 'default'}):
+            with override_settings(USER_TOKEN_CACHE=conf):
+                cache = get_token_cache()
+
+                def load(key):
+                    snapshot = load_snapshot(key)
+                    cache.invalidate(key)
+                    return snapshot
+
+                with patch('user.authentication.load_snapshot', load):
+                    load_and_cache_snapshot(cache, self.token.key)
+                self.assertIsNone(cache.get(self.token.key))
+
+                load_and_cache_snapshot(cache, self.token.key)
+                self.assertIsNotNone(cache.get(self.token.key))
+                cache.clear()
+
+    def test_snapshot_read_from_the_primary(self):
+        """Test a reloaded snapshot never comes from a replica"""
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertIsNotNone(load_snapshot(self.token.key))
+        self.assertEqual(len(queries), 1)
+
+        with patch('core.routers.ReplicaRouter.db_for_read',
+                   return_value='replica_0'):
+            self.assertIsNotNone(load_snapshot(self.token.key))
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'])
+    def test_recent_writer_reads_from_the_primary(self):
+        """Test a token whose user just wrote is pinned to the primary"""
+        routers.pin_user(self.user.pk, 5)
+        self.addCleanup(routers.unpin)
+        self.addCleanup(
+            cache.delete, routers.USER_PIN_KEY % self.user.pk
+        )
+
+        CachedTokenAuthentication().authenticate_credentials(self.token.key)
+
+        self.assertTrue(routers.is_pinned())
+
+    def test_cache_miss_single_query(self):
+        """Test the token and its user are loaded with a single query"""
+        auth = CachedTokenAuthentication()
+        with self.assertNumQueries(1):
+            user, token = auth.authenticate_credentials(self.token.key)
+
+        self.assertIsInstance(user, CachedUser)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.name, 'Cached Name')
+        self.assertEqual(token.user_id, self.user.pk)
+        self.assertFalse(hasattr(user, 'password'))
+
+
+class CachedUserPermissionTests(TestCase):
+    """Test the permissions of the compact cached user"""
+
+    def setUp(self):
+        get_token_cache().clear()
+        get_permission_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            'perms@gmail.com', 'testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.permission = Permission.objects.get(codename='view_user')
+        self.group = Group.objects.create(name='support')
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(
+            self.token.key
+        )[0]
+
+    def test_group_permissions_cached(self):
+        """Test permissions are loaded once and match ModelBackend"""
+        self.group.permissions.add(self.permission)
+        self.user.groups.add(self.group)
+
+        user = self.authenticate()
+        with self.assertNumQueries(1):
+            self.assertTrue(user.has_perm('core.view_user'))
+            self.assertTrue(user.has_module_perms('core'))
+            self.assertFalse(user.has_perm('core.delete_user'))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticate().has_perm('core.view_user'))
+
+        model_user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual(
+            user.get_all_permissions(), model_user.get_all_permissions()
+        )
+
+    def test_permission_changes_invalidate(self):
+        """Test added and removed permissions are seen right away"""
+        self.assertFalse(self.authenticate().has_perm('core.view_user'))
+
+        self.user.user_permissions.add(self.permission)
+        self.assertTrue(self.authenticate().has_perm('core.view_user'))
+
+        self.group.user_set.add(self.user)
+        self.group.permissions.add(
+            Permission.objects.get(codename='change_user')
+        )
+        self.assertTrue(self.authenticate().has_perm('core.change_user'))
+
+        self.user.user_permissions.clear()
+        self.assertFalse(self.authenticate().has_perm('core.view_user'))
+
+    def test_superuser_and_inactive(self):
+        """Test superusers have every permission and inactive users none"""
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertTrue(self.authenticate().has_perm('core.delete_user'))
+
+        user = CachedUser(self.user.pk, self.user.email, '', False, False,
+                          False, 1, None)
+        self.user.user_permissions.add(self.permission)
+        self.assertFalse(user.has_perm('core.view_user'))
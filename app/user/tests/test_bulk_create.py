@@ -0,0 +1,97 @@
+import json
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+
+BULK_CREATE_URL = reverse('user:bulk-create')
+
+
+def read_results(res):
+    """Decode the NDJSON streamed by the bulk create endpoint"""
+    body = b''.join(res.streaming_content).decode('utf-8')
+    return [json.loads(line) for line in body.splitlines()]
+
+
+@override_settings(USER_BULK_CREATE={'HASH_WORKERS': 0})
+class BulkCreateUserApiTests(TestCase):
+    """Test the bulk user creation API"""
+
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser(
+            'admin@gmail.com', 'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def post(self, body, content_type='application/json', **params):
+        url = BULK_CREATE_URL
+        if params:
+            url += '?' + '&'.join('%s=%s' % item for item in params.items())
+        return self.client.generic('POST', url, body, content_type)
+
+    def test_bulk_create_json_array(self):
+        """Test creating users from a JSON array"""
+        rows = [
+            {'email': 'one@gmail.com', 'password': 'testpass', 'name': 'One'},
+            {'email': 'two@gmail.com', 'password': 'testpass'},
+            {'email': 'three@gmail.com', 'password': 'testpass'},
+        ]
+        res = self.post(json.dumps(rows), batch_size=2)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = read_results(res)
+        self.assertEqual(
+            [result['status'] for result in results[:-1]],
+            ['created'] * 3,
+        )
+        self.assertEqual(results[-1]['summary']['created'], 3)
+        user = get_user_model().objects.get(email='one@gmail.com')
+        self.assertEqual(user.name, 'One')
+        self.assertTrue(user.check_password('testpass'))
+
+    def test_bulk_create_ndjson_mixed_rows(self):
+        """Test invalid and duplicate rows are reported per row"""
+        get_user_model().objects.create_user('taken@gmail.com', 'testpass')
+        rows = [
+            {'email': 'taken@gmail.com', 'password': 'testpass'},
+            {'email': 'new@gmail.com', 'password': 'pw'},
+            {'email': 'new@gmail.com', 'password': 'testpass'},
+            {'email': 'new@gmail.com', 'password': 'testpass'},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows)
+        res = self.post(body, 'application/x-ndjson')
+
+        results = read_results(res)
+        self.assertEqual(
+            [(result['index'], result['status']) for result in results[:-1]],
+            [(0, 'exists'), (1, 'invalid'), (2, 'created'), (3, 'exists')],
+        )
+        self.assertIn('password', results[1]['errors'])
+        self.assertEqual(
+            results[-1]['summary'],
+            {'created': 1, 'exists': 2, 'invalid': 1},
+        )
+
+    def test_malformed_payload(self):
+        """Test the rows before a syntax error are still created"""
+        res = self.post('[{"email": "ok@gmail.com", "password": "testpass"},')
+
+        results = read_results(res)
+        self.assertEqual(results[0]['status'], 'created')
+        self.assertEqual(results[1]['status'], 'error')
+        self.assertTrue(
+            get_user_model().objects.filter(email='ok@gmail.com').exists()
+        )
+
+    def test_bulk_create_requires_staff(self):
+        """Test regular users can not bulk create users"""
+        user = get_user_model().objects.create_user('me@gmail.com', 'testpw')
+        self.client.force_authenticate(user=user)
+        res = self.post('[]')
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
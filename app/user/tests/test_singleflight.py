@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import authenticate, get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from user import singleflight
+from user.authentication import CachedTokenAuthentication, HOT_FIELDS, \
+                                get_token_cache
+from user.singleflight import SingleFlight
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.001)
+
+
+class BlockingCall:
+    """Function returning `result` once released, counting its calls"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run_threads(count, target):
+    results = []
+
+    def run():
+        try:
+            results.append(target())
+        except Exception as exc:
+            results.append(exc)
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Test the concurrent calls of a key share a single call"""
+
+    def test_threads_share_the_call(self):
+        group = SingleFlight()
+        func = BlockingCall(result='snapshot')
+        threads, results = run_threads(5, lambda: group.do('key', func))
+        wait_for(lambda: group.stats()['shared'] == 4)
+        func.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(func.calls, 1)
+        self.assertEqual(results, ['snapshot'] * 5)
+        self.assertEqual(group.stats(), {
+            'calls': 1, 'shared': 4, 'shared_ratio': 0.8, 'in_flight': 0,
+        })
+        # nothing is cached once the call is over
+        self.assertEqual(group.do('key', lambda: 'new'), 'new')
+
+    def test_error_is_shared(self):
+        group = SingleFlight()
+        error = ValueError('down')
+        func = BlockingCall(error=error)
+        threads, results = run_threads(3, lambda: group.do('key', func))
+        wait_for(lambda: group.stats()['shared'] == 2)
+        func.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [error] * 3)
+        self.assertEqual(group.stats()['in_flight'], 0)
+
+    def test_coroutines_and_threads_share_the_call(self):
+        """Test coroutines wait for a call a thread is running"""
+        group = SingleFlight()
+        func = BlockingCall(result=42)
+        threads, results = run_threads(1, lambda: group.do('key', func))
+        wait_for(lambda: group.stats()['in_flight'] == 1)
+
+        async def lookup():
+            return await group.do_async('key', asyncio.sleep)
+
+        async def main():
+            lookups = asyncio.gather(lookup(), lookup())
+            await asyncio.sleep(0)
+            func.release.set()
+            return await lookups
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertEqual(loop.run_until_complete(main()), [42, 42])
+        threads[0].join()
+        self.assertEqual(results, [42])
+        self.assertEqual(func.calls, 1)
+
+    def test_coroutine_leader(self):
+        group = SingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'user'
+
+        async def main():
+            return await asyncio.gather(*(
+                group.do_async('key', load) for _ in range(3)
+            ))
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertEqual(loop.run_until_complete(main()), ['user'] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(group.stats()['shared'], 2)
+
+    def test_metrics(self):
+        group = singleflight.get_group('test')
+        group.reset()
+        group.do('key', lambda: None)
+
+        self.assertIn(('singleflight_calls', {'group': 'test'}, 1),
+                      singleflight.collect_metrics())
+
+
+class CoalescedLookupTests(TestCase):
+    """Test the token and email lookups of concurrent logins"""
+
+    def test_token_lookups_coalesced(self):
+        get_token_cache().clear()
+        snapshot = (timezone.now(),) + tuple(
+            {'id': 7, 'email': 'shared@gmail.com', 'is_active': True}.get(
+                name
+            )
+            for name in HOT_FIELDS
+        )
+        load = BlockingCall(result=snapshot)
+        auth = CachedTokenAuthentication()
+        group = singleflight.get_group('token')
+        group.reset()
+
+        with patch('user.authentication.load_snapshot',
+                   side_effect=lambda key: load()):
+            threads, results = run_threads(
+                4, lambda: auth.authenticate_credentials('k' * 40)
+            )
+            wait_for(lambda: group.stats()['shared'] == 3)
+            load.release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(load.calls, 1)
+        self.assertEqual({user.pk for user, _ in results}, {7})
+        self.assertEqual(get_token_cache().get('k' * 40), snapshot)
+
+    def test_email_lookups_get_their_own_user(self):
+        """Test the users of a shared email lookup are distinct copies"""
+        user = get_user_model().objects.create_user(
+            email='shared@gmail.com', password='testpass'
+        )
+        lookup = BlockingCall(result=user)
+        group = singleflight.get_group('email')
+        group.reset()
+
+        with patch.object(get_user_model().objects, 'get_by_natural_key',
+                          side_effect=lambda email: lookup()):
+            threads, results = run_threads(3, lambda: authenticate(
+                email='shared@gmail.com', password='testpass'
+            ))
+            wait_for(lambda: group.stats()['shared'] == 2)
+            lookup.release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(lookup.calls, 1)
+        self.assertEqual(results, [user] * 3)
+        self.assertEqual(len({id(result) for result in results}), 3)
@@ -0,0 +1,149 @@
+from django.core.cache import cache
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings,
+)
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.tests.utils import FakeClock
+from user.throttling import LocalWindowStore, LoginFailureLimiter, \
+                            SharedWindowStore, get_client_ip, \
+                            get_login_limiter
+
+
+TOKEN_URL = reverse('user:token')
+
+
+class LoginFailureLimiterTests(SimpleTestCase):
+
+    def test_local_sliding_window(self):
+        """Test an email is blocked until its failures leave the window"""
+        clock = FakeClock()
+        limiter = LoginFailureLimiter(
+            LocalWindowStore(window=60, max_keys=100, clock=clock),
+            max_per_email=0, max_per_ip=0, max_per_email_and_ip=2,
+        )
+        limiter.record_failure('Test@gmail.com', '1.2.3.4')
+        clock.now = 10
+        limiter.record_failure('test@gmail.com', '1.2.3.4')
+
+        self.assertEqual(limiter.retry_after('TEST@gmail.com', '1.2.3.4'), 50)
+        # the same email from another address is not blocked
+        self.assertIsNone(limiter.retry_after('test@gmail.com', '5.6.7.8'))
+        clock.now = 60
+        self.assertIsNone(limiter.retry_after('test@gmail.com', '1.2.3.4'))
+
+    def test_email_limit_across_addresses(self):
+        """Test a client rotating addresses is stopped by the email limit"""
+        limiter = LoginFailureLimiter(
+            LocalWindowStore(window=60, max_keys=100),
+            max_per_email=3, max_per_ip=0, max_per_email_and_ip=2,
+        )
+        for ip in ('1.1.1.1', '2.2.2.2', '3.3.3.3'):
+            self.assertIsNone(limiter.retry_after('test@gmail.com', ip))
+            limiter.record_failure('test@gmail.com', ip)
+
+        self.assertIsNotNone(limiter.retry_after('test@gmail.com', '4.4.4.4'))
+        self.assertIsNone(limiter.retry_after('other@gmail.com', '4.4.4.4'))
+
+    def test_ip_limit_and_reset(self):
+        """Test the IP limit is not cleared by a successful login"""
+        limiter = LoginFailureLimiter(
+            LocalWindowStore(window=60, max_keys=100),
+            max_per_email=0, max_per_ip=3, max_per_email_and_ip=2,
+        )
+        for email in ('one@gmail.com', 'two@gmail.com', 'one@gmail.com'):
+            limiter.record_failure(email, '1.2.3.4')
+
+        limiter.reset('one@gmail.com', '1.2.3.4')
+        self.assertIsNotNone(limiter.retry_after('new@gmail.com', '1.2.3.4'))
+        self.assertIsNone(limiter.retry_after('one@gmail.com', '5.6.7.8'))
+
+    def test_shared_window(self):
+        """Test the previous bucket is weighted by its overlap"""
+        clock = FakeClock(now=1000 * 60)
+        store = SharedWindowStore(60, cache, 'test:failures:', clock=clock)
+        limiter = LoginFailureLimiter(store, max_per_email=2, max_per_ip=0)
+        for _ in range(4):
+            limiter.record_failure('shared@gmail.com', None)
+        self.assertIsNotNone(limiter.retry_after('shared@gmail.com', None))
+
+        # half of the previous bucket is still inside the window
+        clock.now += 90
+        self.assertIsNotNone(limiter.retry_after('shared@gmail.com', None))
+        clock.now += 5
+        self.assertIsNone(limiter.retry_after('shared@gmail.com', None))
+
+
+@override_settings(LOGIN_FAILURE_LIMIT={
+    'MAX_PER_EMAIL_AND_IP': 3, 'MAX_PER_EMAIL': 6,
+    'CLIENT_IP_HEADER': 'HTTP_X_FORWARDED_FOR',
+})
+class LoginThrottlingApiTests(TestCase):
+    """Test failed logins are short circuited on the token API"""
+
+    def setUp(self):
+        get_login_limiter().clear()
+        self.client = APIClient()
+        self.payload = {'email': 'throttled@gmail.com', 'password': 'testpass'}
+        get_user_model().objects.create_user(**self.payload)
+
+    def test_repeated_failures_are_blocked(self):
+        """Test the account is blocked without queries after the limit"""
+        for _ in range(3):
+            res = self.client.post(
+                TOKEN_URL, dict(self.payload, password='wrong')
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.assertNumQueries(0):
+            res = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    def test_others_do_not_lock_the_user_out(self):
+        """Test failures from one address leave the others alone"""
+        for _ in range(3):
+            self.client.post(TOKEN_URL, dict(self.payload, password='wrong'),
+                             REMOTE_ADDR='10.0.0.1')
+
+        res = self.client.post(TOKEN_URL, self.payload,
+                               REMOTE_ADDR='10.0.0.2')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_client_ip_from_the_proxy_header(self):
+        """Test clients behind the proxy are told apart by the header"""
+        for _ in range(3):
+            self.client.post(
+                TOKEN_URL, dict(self.payload, password='wrong'),
+                REMOTE_ADDR='172.18.0.2',
+                # the first entry is whatever the client sent
+                HTTP_X_FORWARDED_FOR='10.0.0.2, 10.0.0.1',
+            )
+
+        res = self.client.post(TOKEN_URL, self.payload,
+                               REMOTE_ADDR='172.18.0.2',
+                               HTTP_X_FORWARDED_FOR='10.0.0.2')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        request = RequestFactory().get(
+            '/', REMOTE_ADDR='172.18.0.2', HTTP_X_FORWARDED_FOR='1.2.3.4'
+        )
+        self.assertEqual(get_client_ip(request), '1.2.3.4')
+
+    def test_success_resets_failures(self):
+        """Test a successful login clears the failures of the email"""
+        for _ in range(2):
+            self.client.post(TOKEN_URL, dict(self.payload, password='wrong'))
+        res = self.client.post(TOKEN_URL, self.payload)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        for _ in range(2):
+            self.client.post(TOKEN_URL, dict(self.payload, password='wrong'))
+        res = self.client.post(TOKEN_URL, self.payload)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
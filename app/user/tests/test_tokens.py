@@ -0,0 +1,143 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from user.authentication import get_token_cache
+from user.tokens import issue_token, purge_expired_tokens
+
+
+TOKEN_URL = reverse('user:token')
+ME_URL = reverse('user:me')
+
+
+def age_token(token, seconds):
+    Token.objects.filter(pk=token.pk).update(
+        created=timezone.now() - timedelta(seconds=seconds)
+    )
+
+
+class IssueTokenTests(TestCase):
+    """Test the issuance of the API tokens"""
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            'token@gmail.com', 'testpass'
+        )
+
+    def test_token_created_once(self):
+        """Test the same token is returned by every login"""
+        token = issue_token(self.user)
+        self.assertTrue(Token.objects.filter(key=token.key).exists())
+
+        # served by the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(issue_token(self.user).key, token.key)
+
+        get_token_cache().clear()
+        self.assertEqual(issue_token(self.user).key, token.key)
+        self.assertEqual(Token.objects.filter(user=self.user).count(), 1)
+
+    def test_existing_token_reused(self):
+        """Test a token created elsewhere is reused"""
+        existing = Token.objects.create(user=self.user)
+
+        self.assertEqual(issue_token(self.user).key, existing.key)
+
+    def test_deleted_token_not_served_from_cache(self):
+        """Test a deleted token is replaced instead of returned"""
+        token = issue_token(self.user)
+        Token.objects.filter(key=token.key).delete()
+
+        self.assertNotEqual(issue_token(self.user).key, token.key)
+
+    @override_settings(USER_TOKEN={'ROTATE_AFTER': 60})
+    def test_old_token_rotated(self):
+        """Test a login past ROTATE_AFTER replaces the token"""
+        token = issue_token(self.user)
+        age_token(token, 61)
+        get_token_cache().clear()
+
+        rotated = issue_token(self.user)
+
+        self.assertNotEqual(rotated.key, token.key)
+        self.assertEqual(
+            list(Token.objects.filter(user=self.user).values_list(
+                'key', flat=True
+            )),
+            [rotated.key],
+        )
+
+    def test_login_endpoint(self):
+        """Test the login endpoint returns the issued token"""
+        res = APIClient().post(TOKEN_URL, {
+            'email': 'token@gmail.com', 'password': 'testpass'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['token'],
+                         Token.objects.get(user=self.user).key)
+
+
+@override_settings(USER_TOKEN={'EXPIRES_AFTER': 3600})
+class TokenExpiryTests(TestCase):
+    """Test expired tokens are refused and purged"""
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            'expiry@gmail.com', 'testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_expired_token_rejected(self):
+        """Test an expired token no longer authenticates"""
+        self.assertEqual(self.client.get(ME_URL).status_code,
+                         status.HTTP_200_OK)
+        get_token_cache().clear()
+        age_token(self.token, 3600)
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_expired_token_replaced_on_login(self):
+        """Test logging in with an expired token issues a new one"""
+        age_token(self.token, 3600)
+
+        self.assertNotEqual(issue_token(self.user).key, self.token.key)
+
+    def test_purge_in_batches(self):
+        """Test only the expired tokens are deleted, a batch at a time"""
+        for index in range(4):
+            user = get_user_model().objects.create_user(
+                'old%d@gmail.com' % index, 'testpass'
+            )
+            age_token(Token.objects.create(user=user), 7200)
+
+        self.assertEqual(list(purge_expired_tokens(batch_size=3)), [3, 1])
+        self.assertEqual(list(Token.objects.all()), [self.token])
+
+    def test_purge_command(self):
+        """Test the purge_tokens command reports what it deleted"""
+        age_token(self.token, 7200)
+        out = StringIO()
+
+        with patch('time.sleep') as sleep:
+            call_command('purge_tokens', sleep=0.1, stdout=out)
+
+        self.assertIn('Deleted 1 expired token(s)', out.getvalue())
+        sleep.assert_called_once_with(0.1)
+        self.assertFalse(Token.objects.exists())
@@ -1,11 +1,21 @@
-from django.test import TestCase
+import copy
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse  # generates API URL
 
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient  # test client
 from rest_framework import status  # module containing status codes in
 #     humanreadible strings
 
+from core.hashing import HashingBusy
+from core.tasks import Worker, get_broker
+from user.tasks import provision_token
+from user.tokens import new_key
+
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')  # URL we are going to use to make the
@@ -112,6 +122,34 @@ class PublicUserApiTests(TestCase):
         self.assertNotIn('token', res.data)
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_token_hashing_busy(self):
+        """Test that login is throttled when the hashing pool is full"""
+        payload = {'email': 'isuarezsolatest@gmail.com',
+                   'password': 'testpass'}
+        create_user(**payload)
+        # pretend every worker of the hashing pool is busy
+        with patch('core.hashing.HashingExecutor.submit') as submit:
+            submit.side_effect = HashingBusy
+            res = self.client.post(TOKEN_URL, payload)
+
+        self.assertNotIn('token', res.data)
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '5')
+
+    def test_create_user_hashing_busy(self):
+        """Test a signup is told to retry when the hashing pool is full"""
+        payload = {'email': 'isuarezsolatest@gmail.com',
+                   'password': 'testpass', 'name': 'Test name'}
+        with patch('core.hashing.HashingExecutor.submit') as submit:
+            submit.side_effect = HashingBusy
+            res = self.client.post(CREATE_USER_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+        self.assertFalse(get_user_model().objects.filter(
+            email=payload['email']
+        ).exists())
+
     def test_create_token_missing_field(self):
         """Test that email and password are required"""
         # very similar to invalid credentials just that one field is empty
@@ -131,14 +169,20 @@ class PublicUserApiTests(TestCase):
 class PrivateUserApiTests(TestCase):
     """Test API requests that require authentication"""
 
-    # In the setUp we set the authentication and this will be
-    # seeing by all the tests.
-    def setUp(self):
-        self.user = create_user(
+    # The user is created once for the class, each test rolls back to it
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(
             email='isuarezsolatest@gmail.com',
             password='testpass',
             name='Test Name',
         )
+
+    # In the setUp we set the authentication and this will be
+    # seeing by all the tests.
+    def setUp(self):
+        # the tests refresh the user, they get their own copy of it
+        self.user = copy.deepcopy(self.user)
         self.client = APIClient()
         # we force authentication with the user created here
         self.client.force_authenticate(user=self.user)
@@ -173,3 +217,118 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_profile_not_modified(self):
+        """Test an unchanged profile is answered with a 304"""
+        res = self.client.get(ME_URL)
+        etag = res['ETag']
+        self.assertIn('Last-Modified', res)
+
+        res = self.client.get(ME_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+
+        res = self.client.get(
+            ME_URL, HTTP_IF_MODIFIED_SINCE=res['Last-Modified']
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_update_changes_etag(self):
+        """Test the ETag changes once the profile is updated"""
+        etag = self.client.get(ME_URL)['ETag']
+
+        res = self.client.patch(ME_URL, {'name': 'new name'},
+                                HTTP_IF_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+        self.user.refresh_from_db()
+        self.client.force_authenticate(user=self.user)
+        res = self.client.get(ME_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['name'], 'new name')
+
+    def test_update_weak_if_match(self):
+        """Test a tag weakened by the compression still matches"""
+        etag = self.client.get(ME_URL)['ETag']
+
+        res = self.client.patch(ME_URL, {'name': 'new name'},
+                                HTTP_IF_MATCH='W/' + etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.patch(ME_URL, {'name': 'newer name'},
+                                HTTP_IF_MATCH='W/' + etag)
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_update_stale_if_match(self):
+        """Test an update based on an old version is rejected"""
+        etag = self.client.get(ME_URL)['ETag']
+        self.client.patch(ME_URL, {'name': 'first edit'})
+
+        res = self.client.patch(ME_URL, {'name': 'second edit'},
+                                HTTP_IF_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'first edit')
+
+    def test_update_password_hashing_busy(self):
+        """Test a password change is told to retry when hashing is full"""
+        with patch('core.hashing.HashingExecutor.submit') as submit:
+            submit.side_effect = HashingBusy
+            res = self.client.patch(ME_URL, {'password': 'newpassword123'})
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('testpass'))
+
+
+@override_settings(TASKS={'BROKER': 'memory'})
+class SignupTaskTests(TestCase):
+    """Test the work done after a signup"""
+
+    def test_signup_provisions_token(self):
+        """Test a token is created by the worker once the user committed"""
+        res = APIClient().post(CREATE_USER_URL, {
+            'email': 'signup@gmail.com', 'password': 'testpass',
+            'name': 'Signup',
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        user = get_user_model().objects.get(email='signup@gmail.com')
+        self.assertFalse(Token.objects.filter(user=user).exists())
+
+        # what would run when the request transaction commits
+        for _, hook in connection.run_on_commit:
+            hook()
+        # delivered twice, the task must not create a second token
+        get_broker().push('user.provision_token', {'user_id': user.pk})
+        Worker(get_broker()).run_once()
+
+        self.assertEqual(Token.objects.filter(user=user).count(), 1)
+
+    def test_provision_token_skips_missing_users(self):
+        """Test a deleted user or an existing token fail nothing"""
+        users = [create_user(email='user%d@gmail.com' % n, password='pass1')
+                 for n in range(3)]
+        deleted_id = users[0].pk
+        users[0].delete()
+        existing = Token.objects.create(user=users[1])
+
+        provision_token([{'user_id': user.pk} for user in users])
+
+        self.assertFalse(Token.objects.filter(user_id=deleted_id).exists())
+        self.assertEqual(Token.objects.get(user=users[1]), existing)
+        self.assertTrue(Token.objects.filter(user=users[2]).exists())
+
+    def test_provision_token_races_a_login(self):
+        """Test a token created by a login meanwhile is not an error"""
+        user = create_user(email='user@gmail.com', password='pass1')
+
+        def login_then_key(user_id):
+            # the user logs in between the read of the tokens and the INSERT
+            Token.objects.create(user=user)
+            return new_key(user_id)
+        with patch('user.tasks.new_key', side_effect=login_then_key):
+            provision_token([{'user_id': user.pk}])
+
+        self.assertEqual(Token.objects.filter(user=user).count(), 1)
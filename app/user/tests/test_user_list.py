@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+
+LIST_URL = reverse('user:list')
+
+
+def streamed_body(res):
+    return b''.join(res.streaming_content).decode('utf-8')
+
+
+@override_settings(USER_LIST={'PAGE_SIZE': 2, 'EXPORT_CHUNK_SIZE': 2})
+class UserListApiTests(TestCase):
+    """Test the staff user list API"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # created once for the class, each test rolls back to them
+        cls.admin = get_user_model().objects.create_superuser(
+            'admin@gmail.com', 'password123'
+        )
+        for index in range(4):
+            get_user_model().objects.create_user(
+                'user%d@gmail.com' % index, 'testpass', name='User %d' % index
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def test_list_requires_staff(self):
+        """Test regular users can not list the users"""
+        user = get_user_model().objects.get(email='user0@gmail.com')
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        res = client.get(LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_list_follows_cursor(self):
+        """Test every user is listed once following the next links"""
+        emails = []
+        url = LIST_URL
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), 2)
+            emails.extend(user['email'] for user in res.data['results'])
+            url = res.data['next']
+
+        self.assertEqual(emails, list(
+            get_user_model().objects.order_by('id').values_list(
+                'email', flat=True
+            )
+        ))
+        self.assertNotIn('password', res.data['results'][0])
+
+    def test_list_selected_fields(self):
+        """Test ?fields= restricts the fields returned"""
+        res = self.client.get(LIST_URL, {'fields': 'email,name'})
+
+        self.assertEqual(set(res.data['results'][0]), {'email', 'name'})
+
+    def test_list_unknown_field(self):
+        """Test asking for a field that is not listed is rejected"""
+        res = self.client.get(LIST_URL, {'fields': 'email,password'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_csv(self):
+        """Test exporting every user as CSV"""
+        res = self.client.get(LIST_URL, {'export': 'csv',
+                                         'fields': 'email,name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(streamed_body(res))))
+        self.assertEqual(rows[0], ['email', 'name'])
+        self.assertEqual(len(rows), 6)
+        self.assertIn(['user3@gmail.com', 'User 3'], rows)
+
+    def test_export_ndjson(self):
+        """Test exporting every user as NDJSON"""
+        res = self.client.get(LIST_URL, {'export': 'ndjson'})
+
+        users = [json.loads(line)
+                 for line in streamed_body(res).splitlines()]
+        self.assertEqual(len(users), 5)
+        self.assertEqual(users[0]['email'], 'admin@gmail.com')
+        self.assertTrue(users[0]['is_staff'])
+        self.assertIsNone(users[1]['last_login'])
+
+    def test_export_unknown_format(self):
+        """Test an unknown export format is rejected"""
+        res = self.client.get(LIST_URL, {'export': 'xml'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,265 @@
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from user.cache import LRUCache
+
+
+DEFAULT_LOGIN_FAILURE_LIMIT = {
+    # failed logins allowed in WINDOW seconds, 0 disables the check. The
+    # tight limit is per email and client IP, so failures from one address
+    # do not lock the account out everywhere else; the looser email limit
+    # caps the guesses on one account of a client rotating addresses
+    'MAX_PER_EMAIL_AND_IP': 5,
+    'MAX_PER_EMAIL': 20,
+    'MAX_PER_IP': 50,
+    'WINDOW': 300,
+    # most emails/IPs tracked in memory, the least recent are forgotten
+    'MAX_KEYS': 100000,
+    # name of an entry of settings.CACHES shared by all the processes,
+    # None keeps the counters local to the process
+    'SHARED_CACHE': None,
+    'KEY_PREFIX': 'user:login-failures:',
+    # behind a reverse proxy REMOTE_ADDR is the proxy: read the client from
+    # this META key instead (e.g. 'HTTP_X_FORWARDED_FOR'), as set by the
+    # TRUSTED_PROXIES proxies in front of the app, each adding an address
+    'CLIENT_IP_HEADER': None,
+    'TRUSTED_PROXIES': 1,
+}
+
+
+def login_failure_settings():
+    conf = dict(DEFAULT_LOGIN_FAILURE_LIMIT)
+    conf.update(getattr(settings, 'LOGIN_FAILURE_LIMIT', {}))
+    return conf
+
+
+class LocalWindowStore:
+    """Exact sliding window of failure timestamps kept in process memory"""
+
+    def __init__(self, window, max_keys, clock=time.monotonic):
+        self.window = window
+        self._clock = clock
+        # the LRU bounds the memory used by a flood of distinct emails
+        self._counters = LRUCache(max_size=max_keys, ttl=window, clock=clock)
+        # the deques are read, changed and stored back by request threads
+        self._lock = threading.Lock()
+
+    def retry_after(self, key, limit):
+        """Seconds until key may try again, None if it is not blocked"""
+        with self._lock:
+            failures = self._counters.get(key)
+            if failures is None or len(failures) < limit:
+                return None
+            oldest = failures[0]
+        # the deque holds the last `limit` failures, the key is blocked
+        # until the oldest of them leaves the window
+        retry_after = oldest + self.window - self._clock()
+        return retry_after if retry_after > 0 else None
+
+    def add(self, key, limit):
+        with self._lock:
+            failures = self._counters.get(key)
+            if failures is None or failures.maxlen != limit:
+                failures = deque(failures or (), maxlen=limit)
+            failures.append(self._clock())
+            self._counters.set(key, failures)
+
+    def reset(self, key):
+        with self._lock:
+            self._counters.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class SharedWindowStore:
+    """Approximate sliding window kept in a cache shared by all processes
+
+    Failures are counted in fixed buckets of `window` seconds and the
+    previous bucket is weighted by how much of it still overlaps the
+    sliding window, which only needs two cache keys per email or IP.
+    """
+
+    def __init__(self, window, cache, key_prefix, clock=time.time):
+        self.window = window
+        self.cache = cache
+        self.key_prefix = key_prefix
+        self._clock = clock
+
+    def _bucket_keys(self, key, now):
+        bucket = int(now // self.window)
+        return (
+            '%s%s:%d' % (self.key_prefix, key, bucket),
+            '%s%s:%d' % (self.key_prefix, key, bucket - 1),
+        )
+
+    def retry_after(self, key, limit):
+        now = self._clock()
+        current_key, previous_key = self._bucket_keys(key, now)
+        counts = self.cache.get_many([current_key, previous_key])
+        current = counts.get(current_key, 0)
+        previous = counts.get(previous_key, 0)
+        elapsed = (now % self.window) / self.window
+        if current + previous * (1 - elapsed) < limit:
+            return None
+        if current >= limit:
+            # only the next bucket starts from scratch
+            return self.window - now % self.window
+        # wait until enough of the previous bucket has slid out
+        needed = 1 - (limit - current) / previous
+        return max(1, math.ceil((needed - elapsed) * self.window))
+
+    def add(self, key, limit):
+        current_key, _ = self._bucket_keys(key, self._clock())
+        # the bucket has to outlive the next one which still reads it
+        if not self.cache.add(current_key, 1, self.window * 2):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                # expired between add() and incr()
+                self.cache.set(current_key, 1, self.window * 2)
+
+    def reset(self, key):
+        now = self._clock()
+        self.cache.delete_many(list(self._bucket_keys(key, now)))
+
+    def clear(self):
+        """Shared counters just expire, there is nothing to clear"""
+
+
+class LoginFailureLimiter:
+    """Counts failed logins per email and IP, per email and per client IP
+
+    A key that has reached its limit is rejected before authenticate() is
+    called, so brute force attempts cost neither a query nor a hash. The
+    email and IP limit is the tight one: someone failing on purpose from
+    one address can not keep the real user, logging in from elsewhere, out
+    before the much higher email limit.
+    """
+
+    def __init__(self, store, max_per_email, max_per_ip,
+                 max_per_email_and_ip=0):
+        self.store = store
+        self.max_per_email = max_per_email
+        self.max_per_ip = max_per_ip
+        self.max_per_email_and_ip = max_per_email_and_ip
+        self.blocked = 0
+
+    @classmethod
+    def from_settings(cls):
+        """Build the limiter from settings.LOGIN_FAILURE_LIMIT"""
+        conf = login_failure_settings()
+        if conf['SHARED_CACHE']:
+            store = SharedWindowStore(
+                conf['WINDOW'], caches[conf['SHARED_CACHE']],
+                conf['KEY_PREFIX'],
+            )
+        else:
+            store = LocalWindowStore(conf['WINDOW'], conf['MAX_KEYS'])
+        return cls(
+            store, conf['MAX_PER_EMAIL'], conf['MAX_PER_IP'],
+            conf['MAX_PER_EMAIL_AND_IP'],
+        )
+
+    def _email_and_ip_key(self, email, ip):
+        if email and ip and self.max_per_email_and_ip:
+            # emails are case insensitive for the purpose of counting
+            return 'email-ip:%s|%s' % (email.strip().lower(), ip)
+        return None
+
+    def _keys(self, email, ip):
+        keys = []
+        key = self._email_and_ip_key(email, ip)
+        if key:
+            keys.append((key, self.max_per_email_and_ip))
+        if email and self.max_per_email:
+            keys.append(('email:' + email.strip().lower(), self.max_per_email))
+        if ip and self.max_per_ip:
+            keys.append(('ip:' + ip, self.max_per_ip))
+        return keys
+
+    def retry_after(self, email, ip):
+        """Seconds the client has to wait, None if it may try to log in"""
+        waits = [
+            self.store.retry_after(key, limit)
+            for key, limit in self._keys(email, ip)
+        ]
+        waits = [wait for wait in waits if wait is not None]
+        if not waits:
+            return None
+        self.blocked += 1
+        return max(waits)
+
+    def record_failure(self, email, ip):
+        for key, limit in self._keys(email, ip):
+            self.store.add(key, limit)
+
+    def reset(self, email, ip):
+        """Forget the failures of an email from ip after a successful login
+
+        The email and IP failures of their own stay until they expire, or
+        a login from ip would hand a client rotating addresses new guesses.
+        """
+        key = self._email_and_ip_key(email, ip)
+        if key:
+            self.store.reset(key)
+
+    def clear(self):
+        self.store.clear()
+        self.blocked = 0
+
+
+_login_limiter = None
+
+
+def get_login_limiter():
+    """Return the process wide limiter, creating it on first use"""
+    global _login_limiter
+    if _login_limiter is None:
+        _login_limiter = LoginFailureLimiter.from_settings()
+    return _login_limiter
+
+
+@receiver(setting_changed)
+def reset_login_limiter(**kwargs):
+    """Rebuild the limiter when the tests override its settings"""
+    global _login_limiter
+    if kwargs['setting'] == 'LOGIN_FAILURE_LIMIT':
+        _login_limiter = None
+
+
+def get_client_ip(request):
+    """Return the address of the client that sent the request
+
+    With LOGIN_FAILURE_LIMIT['CLIENT_IP_HEADER'] set, the address is the
+    one added by the farthest trusted proxy: the entries before it come
+    from the client and can be anything.
+    """
+    if request is None:
+        return None
+    conf = login_failure_settings()
+    header = conf['CLIENT_IP_HEADER']
+    if header:
+        addresses = [
+            address.strip()
+            for address in request.META.get(header, '').split(',')
+            if address.strip()
+        ]
+        if len(addresses) >= conf['TRUSTED_PROXIES']:
+            return addresses[-conf['TRUSTED_PROXIES']]
+    return request.META.get('REMOTE_ADDR')
+
+
+def collect_metrics():
+    """Gauges of the failed login limiter, see core.metrics"""
+    if _login_limiter is None:
+        return []
+    return [('login_failures_blocked', {}, _login_limiter.blocked)]
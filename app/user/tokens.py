@@ -0,0 +1,169 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from core.sharding import get_shards, shard_for_user_id, token_key
+
+
+DEFAULT_USER_TOKEN = {
+    # seconds after which a token stops authenticating, None never expires
+    'EXPIRES_AFTER': None,
+    # seconds after which a login replaces the token with a new one, None
+    # only replaces expired tokens
+    'ROTATE_AFTER': None,
+    # tokens deleted per query by the purge_tokens command
+    'PURGE_BATCH_SIZE': 1000,
+}
+
+
+def token_settings():
+    """Return settings.USER_TOKEN with its defaults filled in"""
+    conf = dict(DEFAULT_USER_TOKEN)
+    conf.update(getattr(settings, 'USER_TOKEN', {}))
+    return conf
+
+
+def new_key(user_id=None):
+    """Return a new token key, sharded it starts with the user's bucket"""
+    return token_key(user_id, Token().generate_key())
+
+
+def is_expired(created, now=None):
+    """Return True if a token created at `created` no longer authenticates"""
+    expires_after = token_settings()['EXPIRES_AFTER']
+    if expires_after is None:
+        return False
+    now = now or timezone.now()
+    return created + timedelta(seconds=expires_after) <= now
+
+
+def needs_rotation(created, now=None):
+    rotate_after = token_settings()['ROTATE_AFTER']
+    now = now or timezone.now()
+    if (rotate_after is not None and
+            created + timedelta(seconds=rotate_after) <= now):
+        return True
+    return is_expired(created, now)
+
+
+def _upsert_postgresql(connection, user_pk, key, created):
+    """Insert the token unless the user has one, return (key, created)
+
+    One round trip whether the token is new or not, and no unique
+    violation (nor the retry that comes with it) when logins race.
+    """
+    quote = connection.ops.quote_name
+    table = quote(Token._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'WITH inserted AS ('
+            ' INSERT INTO {table} ({key}, {user_id}, {created})'
+            ' VALUES (%s, %s, %s)'
+            ' ON CONFLICT ({user_id}) DO NOTHING'
+            ' RETURNING {key}, {created}'
+            ') '
+            'SELECT {key}, {created} FROM inserted '
+            'UNION ALL '
+            'SELECT {key}, {created} FROM {table} WHERE {user_id} = %s '
+            'LIMIT 1'.format(
+                table=table, key=quote('key'), user_id=quote('user_id'),
+                created=quote('created'),
+            ),
+            [key, user_pk, created, user_pk],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        # the conflicting row was committed after the statement started
+        row = Token.objects.using(connection.alias).filter(
+            user_id=user_pk
+        ).values_list('key', 'created').first()
+    return row
+
+
+def _upsert_generic(connection, user_pk, key, created):
+    """Read the token, insert it if missing, return (key, created)"""
+    tokens = Token.objects.using(connection.alias)
+    row = tokens.filter(user_id=user_pk).values_list('key', 'created').first()
+    if row is not None:
+        return row
+    try:
+        with transaction.atomic(using=connection.alias):
+            tokens.create(key=key, user_id=user_pk, created=created)
+    except IntegrityError:
+        # a concurrent login created it first
+        return tokens.filter(user_id=user_pk).values_list(
+            'key', 'created'
+        ).get()
+    return key, created
+
+
+def _rotate(using, user_pk, old_key):
+    """Replace old_key, return the (key, created) the user now has"""
+    # user.authentication imports this module for is_expired()
+    from user.authentication import get_token_cache
+    key, created = new_key(user_pk), timezone.now()
+    rotated = Token.objects.using(using).filter(
+        user_id=user_pk, key=old_key
+    ).update(key=key, created=created)
+    get_token_cache().invalidate(old_key)
+    if rotated:
+        return key, created
+    # another login rotated it first, or it was deleted meanwhile
+    return _upsert(using, user_pk)
+
+
+def _upsert(using, user_pk):
+    connection = connections[using]
+    upsert = (
+        _upsert_postgresql if connection.vendor == 'postgresql'
+        else _upsert_generic
+    )
+    return upsert(connection, user_pk, new_key(user_pk), timezone.now())
+
+
+def issue_token(user):
+    """Return the token of a user, creating or rotating it as needed
+
+    The token of a user that logged in recently comes from the token
+    cache, otherwise it is read or created with a single upsert instead of
+    get_or_create's SELECT + INSERT (+ SELECT on a race).
+    """
+    from user.authentication import get_token_cache
+    cache = get_token_cache()
+    issued = cache.get_issued(user.pk)
+    if issued is not None and not needs_rotation(issued[1]):
+        key, created = issued
+    else:
+        using = shard_for_user_id(user.pk) or router.db_for_write(Token)
+        key, created = _upsert(using, user.pk)
+        if needs_rotation(created):
+            key, created = _rotate(using, user.pk, key)
+        cache.set_issued(user.pk, key, created)
+    return Token(key=key, user_id=user.pk, created=created)
+
+
+def purge_expired_tokens(batch_size=None, now=None):
+    """Delete the expired tokens a batch at a time, yield the batch sizes"""
+    expires_after = token_settings()['EXPIRES_AFTER']
+    if expires_after is None:
+        return
+    batch_size = batch_size or token_settings()['PURGE_BATCH_SIZE']
+    cutoff = (now or timezone.now()) - timedelta(seconds=expires_after)
+    for using in get_shards() or [router.db_for_write(Token)]:
+        tokens = Token.objects.using(using)
+        while True:
+            # short statements, they do not hold locks for long and each
+            # batch commits on its own
+            keys = list(tokens.filter(
+                created__lte=cutoff
+            ).order_by().values_list('key', flat=True)[:batch_size])
+            if not keys:
+                break
+            # delete() sends post_delete, which drops the tokens from the
+            # cache
+            tokens.filter(key__in=keys).delete()
+            yield len(keys)
@@ -9,7 +9,11 @@ urlpatterns = [
     # The app_name and the below name='create' helps with the url reverse
     # lookup done in the test functions.
     # Finally we want to include this url on the app main urls in app/urls.py
+    # staff only list/export of every user
+    path('', views.UserListView.as_view(), name='list'),
     path('create/', views.CreateUserView.as_view(), name='create'),
     path('token/', views.CreateTokenView.as_view(), name='token'),
     path('me/', views.ManageUserView.as_view(), name='me'),
+    path('bulk-create/', views.BulkCreateUserView.as_view(),
+         name='bulk-create'),
  ]
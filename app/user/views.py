@@ -1,8 +1,31 @@
-from rest_framework import generics, authentication, permissions
+import copy
+import csv
+import heapq
+import json
+from itertools import chain, islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags, quote_etag
+
+from rest_framework import exceptions, generics, permissions, status, views
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
-from user.serializers import UserSerializer, AuthTokenSerializer
+from core.hashing import PasswordHasherPool
+from core.sharding import MergedQuerySet, fan_out, is_sharded, \
+                          shard_for_user_id
+from core.streaming import iter_json_records
+from user.authentication import CachedTokenAuthentication
+from user.pagination import UserCursorPagination, list_settings
+from user.serializers import UserSerializer, AuthTokenSerializer, \
+                             BulkUserRowSerializer, UserListSerializer
+from user.tokens import issue_token
 
 
 # this view will interact with the database back and forth
@@ -23,14 +46,52 @@ class CreateTokenView(ObtainAuthToken):
     # sets the renderer so we can use the this view in the HTML/browser
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    # same as ObtainAuthToken.post, with issue_token instead of
+    # get_or_create so concurrent logins do not fight over the row
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data,
+                                           context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        token = issue_token(serializer.validated_data['user'])
+        return Response({'token': token.key})
+
+
+def user_validators(request, user):
+    """Return the (ETag, Last-Modified timestamp) of a user representation
+
+    The version is bumped by every save so it identifies the state of the
+    user, the renderer is part of the tag because JSON and the browsable
+    API are different representations of that state.
+    """
+    etag = quote_etag('%s-%s-%s' % (
+        user.pk, user.version, request.accepted_renderer.format
+    ))
+    return etag, int(user.updated_at.timestamp())
+
+
+def set_validators(request, response, user):
+    etag, last_modified = user_validators(request, user)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # the response is per user and has to be revalidated before reuse
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 
 # note we are basing this on the RetrieveUpdateAPIView which already provides
 # a bunch of functionality
 class ManageUserView(generics.RetrieveUpdateAPIView):
-    """Manage the authenticated user"""
+    """Manage the authenticated user
+
+    Responses carry an ETag and Last-Modified: If-None-Match and
+    If-Modified-Since are answered with a 304, and an If-Match that no
+    longer matches makes PUT/PATCH fail with a 412 instead of overwriting
+    a concurrent change.
+    """
     serializer_class = UserSerializer  # serializer class attribute
-    # the authentication class type is going to be token base
-    authentication_classes = (authentication.TokenAuthentication,)
+    # the authentication class type is going to be token base, the cached
+    # version avoids the Token + User query on every request
+    authentication_classes = (CachedTokenAuthentication,)
     # the permissions are going to be just that it is authenticated
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -42,4 +103,258 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
         """Retrieve and return authentication user"""
         # the authentication_classes will make sure to attach to the request
         # the authenticated user. It is done automatically.
-        return self.request.user
+        # Updates work on the row locked by update() instead.
+        return getattr(self, 'locked_user', None) or self.request.user
+
+    def check_preconditions(self, request, user):
+        """Return the 304/412 response the conditional headers call for"""
+        etag, last_modified = user_validators(request, user)
+        conditions = request._request
+        if_match = request.META.get('HTTP_IF_MATCH')
+        if if_match:
+            # compared weakly by hand: the compression middleware weakens
+            # our tags, the representation they stand for is the same
+            tags = [tag[2:] if tag.startswith('W/') else tag
+                    for tag in parse_etags(if_match)]
+            if '*' not in tags and etag not in tags:
+                return set_validators(
+                    request,
+                    HttpResponse(status=status.HTTP_412_PRECONDITION_FAILED),
+                    user,
+                )
+            # the other conditions are left to django, which would compare
+            # If-Match strongly. If-Unmodified-Since does not apply when
+            # there is an If-Match.
+            conditions = copy.copy(conditions)
+            conditions.META = {
+                key: value for key, value in conditions.META.items()
+                if key not in ('HTTP_IF_MATCH', 'HTTP_IF_UNMODIFIED_SINCE')
+            }
+        response = get_conditional_response(
+            conditions, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            return set_validators(request, response, user)
+        return None
+
+    def retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        # answered before anything is serialized
+        response = self.check_preconditions(request, user)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return set_validators(request, response, user)
+
+    def update(self, request, *args, **kwargs):
+        user_model = get_user_model()
+        # request.user is a CachedUser, the model instance is loaded here
+        using = shard_for_user_id(request.user.pk) or \
+            router.db_for_write(user_model)
+        with transaction.atomic(using=using):
+            # the row stays locked until the update is committed, so the
+            # version If-Match was checked against can't change under us
+            self.locked_user = user_model.objects.using(
+                using
+            ).select_for_update().get(pk=request.user.pk)
+            response = self.check_preconditions(request, self.locked_user)
+            if response is None:
+                response = super().update(request, *args, **kwargs)
+                set_validators(request, response, self.locked_user)
+        return response
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+class UserListView(generics.ListAPIView):
+    """List the users to the staff, or export all of them
+
+    ?fields=email,name selects the fields returned, ?export=csv or
+    ?export=ndjson streams every user instead of a page.
+    """
+    serializer_class = UserListSerializer
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAdminUser,)
+    pagination_class = UserCursorPagination
+    export_formats = ('csv', 'ndjson')
+
+    def get_fields(self):
+        """Return the fields asked for with ?fields=, all of them if empty"""
+        readable = UserListSerializer.Meta.fields
+        requested = self.request.query_params.get('fields')
+        if not requested:
+            return readable
+        fields = tuple(
+            name for name in (item.strip() for item in requested.split(','))
+            if name
+        )
+        unknown = sorted(set(fields) - set(readable))
+        if unknown:
+            raise exceptions.ValidationError(
+                {'fields': ['Unknown fields: %s.' % ', '.join(unknown)]}
+            )
+        return fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_fields()
+        return context
+
+    def get_queryset(self):
+        # the pagination orders by id so it has to be loaded too
+        queryset = get_user_model().objects.only(
+            'id', *self.get_fields()
+        ).order_by('id')
+        if is_sharded():
+            # the pages are merged from every shard
+            return MergedQuerySet(fan_out(queryset), ['id'])
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        export = request.query_params.get('export')
+        if export is None:
+            return super().list(request, *args, **kwargs)
+        if export not in self.export_formats:
+            raise exceptions.ValidationError({'export': [
+                'Use one of: %s.' % ', '.join(self.export_formats)
+            ]})
+        return self.export(export)
+
+    def export_rows(self):
+        """Yield every user as a dict, whatever the size of the table"""
+        fields = self.get_fields()
+        serializer_fields = self.get_serializer().fields
+        # values_list skips building model instances, and iterator() reads
+        # through a server side cursor on postgres, chunk_size rows at a
+        # time. Sharded, the shards are read side by side and merged by id.
+        querysets = fan_out(get_user_model().objects.order_by(
+            'id'
+        ).values_list('id', *fields))
+        rows = heapq.merge(*(
+            queryset.iterator(
+                chunk_size=list_settings()['EXPORT_CHUNK_SIZE']
+            )
+            for queryset in querysets
+        ), key=itemgetter(0))
+        for row in rows:
+            yield {
+                name: None if value is None
+                else serializer_fields[name].to_representation(value)
+                for name, value in zip(fields, row[1:])
+            }
+
+    def export(self, export_format):
+        if export_format == 'csv':
+            fields = self.get_fields()
+            writer = csv.writer(_Echo())
+            lines = (
+                writer.writerow([row[name] for name in fields])
+                for row in self.export_rows()
+            )
+            content = chain([writer.writerow(fields)], lines)
+            content_type = 'text/csv'
+        else:
+            content = (json.dumps(row) + '\n' for row in self.export_rows())
+            content_type = 'application/x-ndjson'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            'attachment; filename="users.%s"' % export_format
+        )
+        return response
+
+
+def _bulk_settings():
+    """Return settings.USER_BULK_CREATE with its defaults filled in"""
+    conf = {'BATCH_SIZE': 500, 'MAX_BATCH_SIZE': 5000, 'HASH_WORKERS': None}
+    conf.update(getattr(settings, 'USER_BULK_CREATE', {}))
+    return conf
+
+
+def bulk_create_results(stream, batch_size, hash_workers):
+    """Create the users of a JSON stream, yielding one result per row
+
+    The stream is consumed batch_size rows at a time: each batch is
+    validated, hashed in the process pool and inserted with a single
+    bulk_create before the next one is read.
+    """
+    errors = []
+
+    def records():
+        # stop at the first malformed record but keep what was parsed so far
+        try:
+            yield from iter_json_records(stream)
+        except ValueError as exc:
+            errors.append(str(exc))
+
+    summary = {'created': 0, 'exists': 0, 'invalid': 0}
+    rows = enumerate(records()) if stream is not None else iter(())
+    manager = get_user_model().objects
+    with PasswordHasherPool(hash_workers) as hasher:
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+
+            results = {}
+            valid_rows = []
+            valid_indexes = []
+            for index, record in chunk:
+                serializer = BulkUserRowSerializer(data=record)
+                if serializer.is_valid():
+                    valid_rows.append(dict(serializer.validated_data))
+                    valid_indexes.append(index)
+                else:
+                    results[index] = {
+                        'index': index,
+                        'status': 'invalid',
+                        'errors': serializer.errors,
+                    }
+
+            created = manager.bulk_create_users(
+                valid_rows, batch_size=batch_size, hasher=hasher
+            )
+            for index, (row, is_new) in zip(valid_indexes, created):
+                results[index] = {
+                    'index': index,
+                    'email': row['email'],
+                    'status': 'created' if is_new else 'exists',
+                }
+
+            for index in sorted(results):
+                summary[results[index]['status']] += 1
+                yield results[index]
+
+    if errors:
+        yield {'status': 'error', 'detail': errors[0]}
+    yield {'summary': summary}
+
+
+class BulkCreateUserView(views.APIView):
+    """Create many users from a JSON array or NDJSON request body"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAdminUser,)
+    # the body is parsed lazily while the response is streamed back, so we
+    # do not want DRF to read it up front
+    parser_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        conf = _bulk_settings()
+        try:
+            batch_size = int(
+                request.query_params.get('batch_size', conf['BATCH_SIZE'])
+            )
+        except ValueError:
+            batch_size = conf['BATCH_SIZE']
+        batch_size = min(max(batch_size, 1), conf['MAX_BATCH_SIZE'])
+
+        results = bulk_create_results(
+            request.stream, batch_size, conf['HASH_WORKERS']
+        )
+        return StreamingHttpResponse(
+            (json.dumps(result) + '\n' for result in results),
+            content_type='application/x-ndjson',
+        )